@@ -0,0 +1,170 @@
+import argparse
+from pathlib import Path
+from datetime import datetime
+import logging
+
+import numpy as np
+import quantities as pq
+
+import neo
+
+import matplotlib.pyplot as plt
+
+from alpaca import Provenance, activate, alpaca_setting
+
+from analysis_utils.backends import BACKENDS, get_backend
+from analysis_utils.cch_plots import plot_cch_with_significance
+from analysis_utils.cch_results import CCH_RESULTS_FILE, load_cch_results
+from analysis_utils.provenance import (merge_run_provenance,
+                                       save_provenance_file)
+
+
+# Apply the decorator to the functions used
+
+plt.Figure.savefig = Provenance(
+    inputs=['self'], file_output=['fname'])(plt.Figure.savefig)
+
+plot_cch_with_significance = Provenance(
+    inputs=['cch', 'cch_mean', 'cch_sd'])(plot_cch_with_significance)
+
+
+# Setup logging
+logging.basicConfig(level=logging.INFO,
+                    format="[%(asctime)s] %(module)s - %(levelname)s: %(message)s")
+
+
+@Provenance(inputs=[], file_input=['file_name'], container_output=1)
+def load_pair_cchs(file_name):
+    """
+    Reads the CCH results file `file_name` saved by `compute_cchs.py`.
+
+    The return object is a dictionary where the pair of unit ids is the key,
+    and the values are tuples with the aggregated CCH of the pair (as
+    `neo.AnalogSignal`), and the mean and standard deviation of the
+    surrogate CCHs.
+    """
+    results = load_cch_results(file_name)
+    sampling_period = results['bin_size']
+    t_start = -results['max_lag']
+
+    pair_cchs = {}
+    for pair, cch, cch_mean, cch_sd in zip(results['pairs'], results['cch'],
+                                           results['mean'], results['sd']):
+        cch = neo.AnalogSignal(cch[:, np.newaxis] * pq.dimensionless,
+                               sampling_period=sampling_period,
+                               t_start=t_start, **results['annotations'])
+        pair_cchs[pair] = (cch, cch_mean[:, np.newaxis],
+                           cch_sd[:, np.newaxis])
+    return pair_cchs
+
+
+def render_pairs(pairs, worker, pair_cchs, output_dir, max_lag,
+                 significance_threshold):
+    """
+    Plots the CCH of each pair of units in `pairs`, together with the
+    significance threshold obtained from the surrogates.
+
+    If `worker` is not None, this runs in a separate worker process, that
+    saves the provenance of its computations to its own file.
+    """
+    # Capture the provenance of the computations in this function. Worker
+    # processes only record their own computations
+    activate(clear=worker is not None)
+
+    for unit_a, unit_b in pairs:
+        cch, cch_mean, cch_sd = pair_cchs[(unit_a, unit_b)]
+
+        # Define title and output file name
+        title = f"CCH ({unit_a} x {unit_b})"
+        out_file = output_dir / f"cch_{unit_a}_{unit_b}.png"
+
+        fig, _ = plot_cch_with_significance(
+            cch, cch_mean, cch_sd,
+            significance_threshold=significance_threshold,
+            max_lag=max_lag, title=title)
+        # Save plot as PNG
+        fig.savefig(out_file, format="png", facecolor="white")
+        plt.close(fig)
+
+    if worker is not None:
+        save_provenance_file(__file__, output_dir, process_id=worker)
+
+
+def main(results_file, output_dir, significance_threshold=None,
+         backend=None, merge_provenance=False):
+    if backend is None:
+        backend = get_backend('serial')
+
+    # Use builtin hash for matplotlib objects
+    alpaca_setting('use_builtin_hash_for_module', ['matplotlib'])
+
+    # Activate provenance tracking
+    activate()
+
+    # Plots use the threshold and maximum lag of the analysis, unless a
+    # different threshold is requested
+    results = load_cch_results(results_file)
+    if significance_threshold is None:
+        significance_threshold = results['significance_threshold']
+    max_lag = results['max_lag']
+
+    logging.info(f"Loading CCH results: {results_file}")
+    pair_cchs = load_pair_cchs(results_file)
+
+    logging.info(f"Plotting {len(pair_cchs)} CCHs")
+    backend.run(render_pairs, list(pair_cchs.keys()), pair_cchs=pair_cchs,
+                output_dir=output_dir, max_lag=max_lag,
+                significance_threshold=significance_threshold)
+
+    # Save provenance information as Turtle file
+    save_provenance_file(__file__, output_dir, process_id=backend.rank)
+
+    # Merge the files of all processes into the one of the main process
+    if merge_provenance:
+        merge_run_provenance(__file__, output_dir, backend)
+
+if __name__ == "__main__":
+    # Parse inputs to the script
+    parser = argparse.ArgumentParser(
+        description="Plots the CCHs saved by `compute_cchs.py` (file "
+                    f"`{CCH_RESULTS_FILE}` in the session folder)")
+    parser.add_argument('--output_path', type=str, required=False,
+                        default=None,
+                        help="folder where the plots are saved (default: "
+                             "the folder of the results file)")
+    parser.add_argument('--significance_threshold', type=float,
+                        required=False, default=None,
+                        help="number of SDs above the mean of the surrogate "
+                             "CCHs (default: the one used in the analysis)")
+    parser.add_argument('--backend', type=str, required=False,
+                        choices=BACKENDS, default='pool',
+                        help="plot with a pool of local processes, a single "
+                             "process, or MPI processes")
+    parser.add_argument('--workers', type=int, required=False, default=None,
+                        help="number of processes of the pool backend "
+                             "(default: number of CPUs)")
+    parser.add_argument('--merge_provenance', action='store_true',
+                        help="merge the provenance files of all processes "
+                             "into a single file")
+    parser.add_argument('input', metavar='input', nargs=1)
+    args = parser.parse_args()
+
+    # Define values passed as parameters to the main function, and create any
+    # directories needed
+    results_file = Path(args.input[0]).expanduser().absolute()
+    output_dir = results_file.parent
+    if args.output_path is not None:
+        output_dir = Path(args.output_path).expanduser().absolute()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    backend = get_backend(args.backend, n_workers=args.workers)
+
+    # Run the plotting
+    start = datetime.now()
+    logging.info(f"Start time: {start}")
+
+    main(results_file, output_dir,
+         significance_threshold=args.significance_threshold,
+         backend=backend, merge_provenance=args.merge_provenance)
+
+    end = datetime.now()
+    logging.info(f"End time: {end}; Total processing time:{end - start}")
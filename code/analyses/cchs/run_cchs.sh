@@ -1,9 +1,13 @@
 #!/bin/bash
 
 # This script runs all the CCH analyses for the ontology use case, generating
-# annotated provenance records with Alpaca. The scripts in this folder require
-# MPI parallelization. This bash script must be submitted via SLURM in a
-# cluster with MPI properly configured.
+# annotated provenance records with Alpaca. The scripts in this folder use
+# MPI parallelization by default. This bash script must be submitted via SLURM
+# in a cluster with MPI properly configured. Any number of processes can be
+# used: the unit pairs are distributed on demand to the processes, with rank 0
+# coordinating the distribution. To run the scripts on a single machine
+# without MPI, pass `--backend=pool` (optionally with `--workers=N`) or
+# `--backend=serial` to the Python scripts instead of using `mpiexec`.
 #
 # When experimental data is used, the reduced Reach2Grasp datasets in NIX
 # must be present. The `i140703-001_no_raw.nix` file must be downloaded
@@ -13,27 +17,121 @@
 # symbolic link was created. If using the dataset by providing the path to the
 # local GIN repository folder, please change $DATA_I accordingly.
 #
+# Several sessions can be analyzed by a single run of each script, by setting
+# SESSIONS to their files or to glob patterns (e.g.,
+# SESSIONS='../../../data/*_no_raw.nix'). The pairs of all sessions are
+# distributed to the same processes, and the results of each session are
+# saved in its own folder.
+#
 # Outputs will be stored into the `analyses` subfolder in the `outputs` folder
 # with respect to the root of the repository. To change, please modify the
 # $OUTPUT_FOLDER variable below.
+#
+# The results of each pair are checkpointed as they are finished. If a run was
+# interrupted (e.g., by the SLURM time limit), set RESUME=1 when submitting
+# this script to keep the existing outputs and compute only the remaining
+# pairs. Otherwise, the output folders are cleared before each analysis.
+#
+# To store the generated spike train surrogates, set SURROGATE_STORE to a
+# folder (e.g., SURROGATE_STORE=../../../outputs/surrogate_store), that is not
+# cleared between runs. Surrogates are then reused by any later run (e.g.,
+# with a different maximum lag) with the same data, parameters and seed. The
+# store is not used by default, so that the surrogates are generated (and
+# recorded in the provenance) by each run.
+#
+# The CCHs are plotted by the analysis scripts, and also saved to a results
+# file in the session folder. To plot again (e.g., with a different
+# significance threshold), run only `render_cchs.py` on the results file. Set
+# RENDER=1 to compute the CCHs without plotting, and render all plots from
+# the results files with a pool of $RENDER_WORKERS local processes instead.
+# The provenance of the plots is then saved by `render_cchs.py`, and is
+# linked to the analysis only through the results file.
+#
+# Each process saves its provenance to a separate file in the session
+# folder. Set MERGE_PROVENANCE=1 to merge them into a single file per
+# session and stage (`compute_cchs.ttl` and `render_cchs.ttl`), where the
+# data shared by all processes is described only once.
+#
+# The peak memory of each process is projected before the surrogates are
+# generated, and written to the log. To limit it, set MEMORY_BUDGET (e.g.,
+# MEMORY_BUDGET=8G) when submitting this script. If the projection exceeds
+# the budget, the surrogate CCHs of each pair are computed in chunks of
+# surrogates that fit in it.
 
 
 DATA_I=../../../data/i140703-001_no_raw.nix
 
 OUTPUT_FOLDER=../../../outputs/analyses
 
+SESSIONS=${SESSIONS:-$DATA_I}
+
+
+RESUME=${RESUME:-0}
+
+RENDER=${RENDER:-0}
+
+RENDER_WORKERS=${RENDER_WORKERS:-20}
+
+MERGE_PROVENANCE=${MERGE_PROVENANCE:-0}
+
+MEMORY_BUDGET=${MEMORY_BUDGET:-}
+
+SURROGATE_STORE=${SURROGATE_STORE:-}
+
 
 # Setup PYTHONPATH
 PYTHONPATH=$(pwd)/../..
 export PYTHONPATH
 
 
+# Clears the output folder `$1`, unless resuming a previous run
+prepare_output () {
+    if [ "$RESUME" != "1" ]; then
+        rm -rf "$1"
+    fi
+    mkdir -p "$1"
+}
+
+RESUME_FLAG=""
+if [ "$RESUME" = "1" ]; then
+    RESUME_FLAG="--resume"
+fi
+
+MEMORY_FLAG=""
+if [ -n "$MEMORY_BUDGET" ]; then
+    MEMORY_FLAG="--memory_budget=$MEMORY_BUDGET"
+fi
+
+PLOT_FLAG=""
+if [ "$RENDER" = "1" ]; then
+    PLOT_FLAG="--no_plots"
+fi
+
+STORE_FLAG=""
+if [ -n "$SURROGATE_STORE" ]; then
+    STORE_FLAG="--surrogate_store=$SURROGATE_STORE"
+fi
+
+MERGE_FLAG=""
+if [ "$MERGE_PROVENANCE" = "1" ]; then
+    MERGE_FLAG="--merge_provenance"
+fi
+
+
 CCH_OUTPUT_1=$OUTPUT_FOLDER/reach2grasp/cchs_1
-rm -rf $CCH_OUTPUT_1
-mkdir $CCH_OUTPUT_1
-mpiexec -n 20 python ./surrogate_1/compute_cchs.py --output_path=$CCH_OUTPUT_1 $DATA_I
+prepare_output $CCH_OUTPUT_1
+mpiexec -n 20 python ./surrogate_1/compute_cchs.py $RESUME_FLAG $MEMORY_FLAG $STORE_FLAG $PLOT_FLAG $MERGE_FLAG --output_path=$CCH_OUTPUT_1 $SESSIONS
+if [ "$RENDER" = "1" ]; then
+    for RESULTS in $CCH_OUTPUT_1/*/cch_results.npz; do
+        python ./render_cchs.py --workers=$RENDER_WORKERS $MERGE_FLAG $RESULTS
+    done
+fi
 
 CCH_OUTPUT_2=$OUTPUT_FOLDER/reach2grasp/cchs_2
-rm -rf $CCH_OUTPUT_2
-mkdir $CCH_OUTPUT_2
-mpiexec -n 20 python ./surrogate_2/compute_cchs.py --output_path=$CCH_OUTPUT_2 $DATA_I
+prepare_output $CCH_OUTPUT_2
+mpiexec -n 20 python ./surrogate_2/compute_cchs.py $RESUME_FLAG $MEMORY_FLAG $STORE_FLAG $PLOT_FLAG $MERGE_FLAG --output_path=$CCH_OUTPUT_2 $SESSIONS
+if [ "$RENDER" = "1" ]; then
+    for RESULTS in $CCH_OUTPUT_2/*/cch_results.npz; do
+        python ./render_cchs.py --workers=$RENDER_WORKERS $MERGE_FLAG $RESULTS
+    done
+fi
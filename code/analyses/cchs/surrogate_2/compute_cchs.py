@@ -1,13 +1,10 @@
 import argparse
-import itertools
-from pathlib import Path
 from datetime import datetime
 import logging
 from tqdm import tqdm
 
 from collections import defaultdict
 
-import random
 import numpy as np
 import quantities as pq
 
@@ -15,26 +12,56 @@ import neo
 from neo.utils import add_epoch, get_events, cut_segment_by_epoch
 
 from elephant.spike_train_correlation import cross_correlation_histogram
+from elephant import spike_train_surrogates
 from elephant.spike_train_surrogates import trial_shifting
 from elephant.conversion import BinnedSpikeTrain
 from elephant.statistics import mean_firing_rate
-from viziphant.spike_train_correlation import plot_cross_correlation_histogram
 
 import matplotlib.pyplot as plt
 
-from alpaca import Provenance, activate, alpaca_setting, save_provenance
-from alpaca.utils import get_file_name
+from alpaca import Provenance, activate, alpaca_setting
 
 from neao_annotation import annotate_neao
+from analysis_utils.cch import cross_correlation_histogram_batch
+from analysis_utils.backends import get_backend
+from analysis_utils.seeding import RandomStreams, seed_global_generators
+from analysis_utils.accumulators import SurrogateCCHAccumulator
+from analysis_utils.surrogate_store import SurrogateStore, hash_file
+from analysis_utils.surrogate_provider import (SurrogateStreams,
+                                               surrogate_seeds)
+from analysis_utils.provenance import (ProvenanceHistories, batched_execution,
+                                       merge_run_provenance,
+                                       save_provenance_file,
+                                       suspended_tracking)
+from analysis_utils.sessions import check_session_names
+from analysis_utils.trial_data import TrialSpikeTrains
+from analysis_utils.cch_plots import plot_cch_with_significance
+from analysis_utils.cch_results import (CCH_RESULTS_FILE,
+                                        collect_pair_results,
+                                        save_cch_results)
+from analysis_utils.cch_analysis import (add_cch_arguments, cch_arguments,
+                                         memory_parameters,
+                                         pair_computation_modes,
+                                         plan_surrogate_chunk, process_units,
+                                         remaining_pairs, run_session_pairs,
+                                         save_pair_checkpoint,
+                                         select_pairs,
+                                         select_session_cch_method,
+                                         session_folders, surrogate_blocks)
 
-from mpi4py import MPI
 
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank()
-nprocs = comm.Get_size()
+SEED = 689
 
 
-SEED = 689
+# Versions of the CCH functions that process all trials of a pair in a
+# single call, tracked as one aggregate execution. These are created before
+# the original functions are decorated
+cross_correlation_histogram_trials = batched_execution(
+    cross_correlation_histogram,
+    ['binned_spiketrain_i', 'binned_spiketrain_j'], output=0)
+cross_correlation_histogram_batch_trials = batched_execution(
+    cross_correlation_histogram_batch,
+    ['binned_spiketrains_i', 'binned_spiketrains_j'], output=0)
 
 
 # Apply the decorator to the functions used
@@ -47,6 +74,11 @@ get_events = Provenance(inputs=['container'],
 cut_segment_by_epoch = Provenance(inputs=['seg', 'epoch'],
                                   container_output=True)(cut_segment_by_epoch)
 
+# The spike trains of the trials of a unit are created from the spike times
+# stored in the container, without copies
+TrialSpikeTrains.spiketrains = Provenance(
+    inputs=['self'], container_output=True)(TrialSpikeTrains.spiketrains)
+
 BinnedSpikeTrain.__init__ = annotate_neao(
     "neao_steps:ApplySpikeTrainBinning",
     arguments={
@@ -66,6 +98,37 @@ cross_correlation_histogram = Provenance(
     inputs=['binned_spiketrain_i',
             'binned_spiketrain_j'])(cross_correlation_histogram)
 
+cross_correlation_histogram_batch = annotate_neao(
+    "neao_steps:ComputeSpikeTrainCrossCorrelationHistogram",
+    returns={0: "neao_data:SpikeTrainCrossCorrelationHistogram"})(
+    cross_correlation_histogram_batch)
+cross_correlation_histogram_batch = Provenance(
+    inputs=['binned_spiketrains_i',
+            'binned_spiketrains_j'])(cross_correlation_histogram_batch)
+
+cross_correlation_histogram_trials = annotate_neao(
+    "neao_steps:ComputeSpikeTrainCrossCorrelationHistogram",
+    arguments={'bin_size': "neao_params:BinSize"},
+    returns={'*': "neao_data:SpikeTrainCrossCorrelationHistogram"})(
+    cross_correlation_histogram_trials)
+cross_correlation_histogram_trials = Provenance(
+    inputs=[], container_input=['binned_spiketrain_i', 'binned_spiketrain_j'],
+    container_output=True)(cross_correlation_histogram_trials)
+
+cross_correlation_histogram_batch_trials = annotate_neao(
+    "neao_steps:ComputeSpikeTrainCrossCorrelationHistogram",
+    returns={'*': "neao_data:SpikeTrainCrossCorrelationHistogram"})(
+    cross_correlation_histogram_batch_trials)
+cross_correlation_histogram_batch_trials = Provenance(
+    inputs=[],
+    container_input=['binned_spiketrains_i', 'binned_spiketrains_j'],
+    container_output=True)(cross_correlation_histogram_batch_trials)
+
+# Surrogates are taken from the on-disk store, if enabled. This wraps the
+# original function, so that it is tracked with the same annotations
+surrogate_store = SurrogateStore()
+trial_shifting = surrogate_store.cached(trial_shifting)
+
 trial_shifting = annotate_neao(
     "neao_steps:GenerateTrialShiftingSurrogate",
     arguments={
@@ -78,6 +141,12 @@ trial_shifting = Provenance(inputs=[], container_input=['spiketrains'],
 plt.Figure.savefig = Provenance(
     inputs=['self'], file_output=['fname'])(plt.Figure.savefig)
 
+plot_cch_with_significance = Provenance(
+    inputs=['cch', 'cch_mean', 'cch_sd'])(plot_cch_with_significance)
+
+save_cch_results = Provenance(inputs=['cchs', 'means', 'sds'],
+                              file_output=['file_name'])(save_cch_results)
+
 
 # Setup logging
 logging.basicConfig(level=logging.INFO,
@@ -94,21 +163,22 @@ def load_data(file_name):
     return block
 
 
-@Provenance(inputs=[], container_input=['trials'], container_output=1)
+@Provenance(inputs=[], container_input=['trials'])
 def get_suas_trials(trials, min_snr=5.0, min_firing_rate=5 * pq.Hz):
     """
     This function takes a list of `neo.Segment`s containing trial-level data,
-    and returns a dictionary with the `neo.SpikeTrain` objects of each trial
-    for a selected subset of SUA units.
+    and returns a `TrialSpikeTrains` object with the spike times of each
+    trial for a selected subset of SUA units.
 
     The `neo.SpikeTrain`s are expected to have annotations `sua == True` and
     `SNR`. The parameter `min_snr` will be compared against the latter to
     filter out the units. The parameter `min_firing_rate` filters out
     spike trains with a mean firing rate in the trial less than its value.
 
-    The return object is a dictionary where the unit id is the key and the
-    values are a list of `neo.SpikeTrain`s, each containing the data of a
-    single trial for that SUA unit.
+    The return object stores the spike times of all trials of the selected
+    units in a single buffer. The ids of the units are in `unit_ids`, and
+    `spiketrains(unit_id)` returns a list of `neo.SpikeTrain`s, each
+    containing the data of a single trial for that SUA unit.
 
     If a unit does not have data available for all the trials, it is not
     included.
@@ -141,36 +211,30 @@ def get_suas_trials(trials, min_snr=5.0, min_firing_rate=5 * pq.Hz):
     selected_suas = {st_id: sts for st_id, sts in suas.items() if
                      st_id in unit_ids}
 
-    return selected_suas
-
-
-@Provenance(inputs=['cch'], container_input=['surrogate_cchs'])
-def plot_cch_with_significance(cch, surrogate_cchs,
-                               significance_threshold=3.0,
-                               max_lag=200 * pq.ms,
-                               title=None):
-    fig, axes = plt.subplots()
-
-    cch_mean = np.mean(surrogate_cchs, axis=0)
-    cch_sd = np.std(surrogate_cchs, axis=0, ddof=1)
-    cch_threshold = cch_mean + significance_threshold * cch_sd
-
-    # Viziphant function expects each CCH to be a `neo.AnalogSignal`
-    # Duplicate using the original CCH to keep the annotations
-    cch_mean = cch.duplicate_with_new_data(cch_mean)
-    cch_threshold = cch.duplicate_with_new_data(cch_threshold)
-
-    kwargs = {}
-    if title is not None:
-        kwargs['title'] = title
+    return TrialSpikeTrains.from_spiketrains(selected_suas)
 
-    axes = plot_cross_correlation_histogram(
-        [cch, cch_mean, cch_threshold], axes=axes, units='ms',
-        maxlag=max_lag,
-        legend=['Raw CCH', 'Mean surrogate CCH', 'Significance threshold'],
-        **kwargs)
 
-    return fig, axes
+@Provenance(inputs=[], container_input=['spiketrains'], container_output=1)
+@annotate_neao("neao_steps:GenerateTrialShiftingSurrogate",
+               arguments={'spiketrains': "neao_data:SpikeTrain",
+                          'dither': "neao_params:DitheringTime"},
+               returns={'***': "neao_data:SpikeTrainSurrogate"})
+def seeded_trial_shifting(spiketrains, dither, n_surrogates, seed, unit,
+                          first_surrogate=0):
+    """
+    Generates `n_surrogates` trial shifting surrogates of the spike trains
+    of `unit` (one per trial), as `trial_shifting`, starting with surrogate
+    `first_surrogate`. Each surrogate `k` is generated from its own seed,
+    derived from `(seed, unit, k)`, such that it is the same whenever it is
+    regenerated, by any process, and in any block of surrogates.
+    """
+    surrogates = []
+    for surrogate_seed in surrogate_seeds(seed, unit, n_surrogates,
+                                          first_surrogate=first_surrogate):
+        seed_global_generators(surrogate_seed)
+        surrogates.extend(spike_train_surrogates.trial_shifting(
+            spiketrains, dither=dither, n_surrogates=1))
+    return surrogates
 
 
 @Provenance(inputs=[], container_input=['cchs'])
@@ -181,26 +245,316 @@ def aggregate_cchs(cchs, max_lag, n_lags):
     Sums a list of trial-level cross-correlation histograms, to obtain an
     aggregate across all trials. Each element in `cchs` is the
     cross-correlation histogram computed between a pair of units in a single
-    trial.
+    trial. For surrogates, each channel of an element is the
+    cross-correlation histogram of one surrogate, and the aggregate is
+    computed separately for each channel.
     """
-    cch_shape = cchs[0].shape
     num_bins = 2 * n_lags + 1
 
-    # Reshape
-    if cch_shape[0] != num_bins:
-        # Surrogate CCHs:.must be rescaled
-        cchs = [surr_cch.reshape(num_bins, -1) for surr_cch in cchs]
-
-    agg_cch = neo.AnalogSignal(np.zeros(num_bins) * pq.dimensionless,
+    # Stack the magnitudes of all CCHs into a single array (trials first),
+    # and sum across trials in a single operation
+    magnitudes = np.stack([np.asarray(cch.magnitude).reshape(num_bins, -1)
+                           for cch in cchs])
+    agg_cch = neo.AnalogSignal(np.sum(magnitudes, axis=0) * pq.dimensionless,
                                sampling_period=cchs[0].sampling_period,
                                t_start=-max_lag)
+
     for cch in cchs:
-        agg_cch += cch
         agg_cch.annotations.update(cch.annotations)
     return agg_cch
 
 
-def main(session_file, output_dir, bin_size, max_lag, n_surrogates):
+@Provenance(inputs=['surrogate_cchs'])
+@annotate_neao(["neao_steps:ComputeMean",
+                "neao_steps:ComputeStandardDeviation"],
+               returns={0: "neao_data:SpikeTrainCrossCorrelationHistogram",
+                        1: "neao_data:Data"})
+def surrogate_cchs_mean_and_sd(surrogate_cchs):
+    """
+    Computes the mean and standard deviation across the surrogate
+    cross-correlation histograms aggregated by `aggregate_cchs`, where each
+    channel is the cross-correlation histogram of one surrogate.
+    """
+    surrogate_cchs = np.ascontiguousarray(
+        surrogate_cchs.magnitude.T[..., np.newaxis])
+
+    cch_mean = np.mean(surrogate_cchs, axis=0)
+    cch_sd = np.std(surrogate_cchs, axis=0, ddof=1)
+    return cch_mean, cch_sd
+
+
+@Provenance(inputs=['accumulator', 'surrogate_cchs'])
+@annotate_neao("neao_steps:ApplySum")
+def accumulate_surrogate_cchs(accumulator, surrogate_cchs):
+    """
+    Adds the surrogate cross-correlation histograms of one trial to the
+    running sums of `accumulator` (a `SurrogateCCHAccumulator`), so that
+    they do not need to be stored.
+    """
+    return accumulator.add_trial(surrogate_cchs)
+
+
+@Provenance(inputs=['accumulator'])
+@annotate_neao(["neao_steps:ComputeMean",
+                "neao_steps:ComputeStandardDeviation"],
+               returns={0: "neao_data:SpikeTrainCrossCorrelationHistogram",
+                        1: "neao_data:Data"})
+def accumulated_mean_and_sd(accumulator):
+    """
+    Computes the mean and standard deviation across the surrogate
+    cross-correlation histograms added to `accumulator`, using running
+    (Welford) estimates.
+    """
+    accumulator.finish_surrogates()
+    cch_mean, cch_sd = accumulator.mean_and_sd(ddof=1)
+    return cch_mean[:, np.newaxis], cch_sd[:, np.newaxis]
+
+
+@Provenance(inputs=['cch', 'cch_mean', 'cch_sd'])
+def reverse_cch_lags(cch, cch_mean, cch_sd):
+    """
+    Obtains the cross-correlation histogram of the pair of units (j, i) from
+    the one of the pair (i, j), by reversing the lags. The same is done for
+    the mean and standard deviation of the surrogate cross-correlation
+    histograms, as the surrogates are generated independently for each unit.
+    """
+    reversed_cch = cch.duplicate_with_new_data(
+        np.ascontiguousarray(cch.magnitude[::-1]))
+    return (reversed_cch, np.ascontiguousarray(cch_mean[::-1]),
+            np.ascontiguousarray(cch_sd[::-1]))
+
+
+def process_pairs(pairs, worker, binned_suas, binned_surrogates, n_trials,
+                  n_surrogates, max_lag, n_lags, cch_parameters, cch_method,
+                  surrogate_statistics,
+                  session_dir, checkpoint_dir, checkpoint_parameters,
+                  symmetric=False, resume_id=None,
+                  provenance_mode='batched', significance_threshold=3.0,
+                  plot=True, suas=None, surrogate_parameters=None,
+                  bin_size=None, surrogate_generation='shared',
+                  surrogate_chunk=None, session_hash=None):
+    """
+    Computes the CCH of each pair of units in `pairs`, together with the
+    significance threshold obtained from the surrogates, and saves the plot
+    and checkpoint of each pair. If `symmetric` is True, the results of the
+    mirrored pair (j, i) are also derived and saved for each pair (i, j).
+    If `plot` is False, only the checkpoints are saved, and the plots are
+    rendered afterwards from the numeric results (`render_cchs.py`).
+
+    If `binned_surrogates` is None, the surrogates of both units of a pair
+    are generated from their spike trains in `suas` while the pair is
+    processed, using `surrogate_parameters` and `bin_size`, for one block of
+    surrogates at a time (see `surrogate_chunk`). With 'shared'
+    `surrogate_generation`, the blocks are the same as the surrogates shared
+    without chunks, and with 'lazy', surrogate `k` of a unit is seeded from
+    `(unit, k)`. The generation of a block of a unit is only recorded the
+    first time, as the surrogates generated again for the next pairs are the
+    same. `session_hash` identifies the session in the surrogate store.
+
+    If `provenance_mode` is 'batched', the CCHs of all trials of a pair are
+    computed by a single call, recorded as one execution. With streaming
+    surrogate statistics, the surrogate CCHs are still computed per trial,
+    so that only the CCHs of one trial are kept in memory.
+
+    If `surrogate_chunk` is given, the surrogates are generated, and their
+    CCHs computed, for blocks of `surrogate_chunk` surrogates, and the CCHs
+    of each block are folded into the running statistics before the next
+    block is processed (`surrogate_statistics` must be 'streaming').
+
+    If `worker` is not None, this runs in a separate worker process, that
+    saves the provenance of its computations to its own file.
+    """
+    # Capture the provenance of the computations in this function. Worker
+    # processes only record their own computations
+    activate(clear=worker is not None)
+
+    # Define the parameters used by the CCH aggregation function
+    aggregation_parameters = {'max_lag': max_lag, 'n_lags': n_lags}
+
+    # In batched mode, compute the CCHs of all trials of a pair in a single
+    # call. The surrogate CCHs are still computed per trial in streaming
+    # mode, and per chunk of surrogates in chunked mode
+    per_trial_cchs, per_trial_surrogate_cchs = pair_computation_modes(
+        provenance_mode, surrogate_statistics, surrogate_chunk)
+
+    # The generation of the surrogates of the units of a pair continues in
+    # each block where the previous block stopped. The blocks of each unit
+    # whose generation was recorded are kept
+    surrogate_streams = SurrogateStreams(RandomStreams(SEED))
+    recorded_blocks = set()
+
+    # For each SUA pair...
+    for unit_i, unit_j in pairs:
+
+        logging.info(f"Computing {unit_i} x {unit_j}")
+
+        # Get the binned spike train for each unit in the pair
+        binned_spiketrain_i = binned_suas[unit_i]
+        binned_spiketrain_j = binned_suas[unit_j]
+
+        # Lists to store the computed CCHs for later aggregations and
+        # mean/SD estimation. The surrogate CCHs of each trial are stored as
+        # a single object with one channel per surrogate. In streaming mode,
+        # the surrogate CCHs are only added to running sums
+        cchs = []
+        surrogate_cchs = []
+        if surrogate_statistics == 'streaming':
+            accumulator = SurrogateCCHAccumulator(2 * n_lags + 1)
+
+        # Compute the CCH between the pair of units in each trial
+        if per_trial_cchs:
+            for trial in tqdm(range(n_trials), "Trial"):
+                binned_trial_spiketrain_i = binned_spiketrain_i[trial]
+                binned_trial_spiketrain_j = binned_spiketrain_j[trial]
+                cch, _ = cross_correlation_histogram(
+                    binned_trial_spiketrain_i, binned_trial_spiketrain_j,
+                    **cch_parameters)
+                cchs.append(cch)
+        else:
+            binned_trial_spiketrains_i = [binned_spiketrain_i[trial]
+                                          for trial in range(n_trials)]
+            binned_trial_spiketrains_j = [binned_spiketrain_j[trial]
+                                          for trial in range(n_trials)]
+            cchs = cross_correlation_histogram_trials(
+                binned_trial_spiketrains_i, binned_trial_spiketrains_j,
+                n_calls=n_trials, **cch_parameters)
+
+        # Without shared surrogates, the generators are seeded from the
+        # unit, as for the surrogates shared without chunks
+        if binned_surrogates is None and surrogate_generation == 'shared':
+            surrogate_streams.clear()
+            for unit in (unit_i, unit_j):
+                surrogate_streams.start(unit)
+
+        # Compute the surrogate CCHs of all surrogates, or of each chunk of
+        # surrogates in chunked mode. The CCHs of a chunk are folded into
+        # the statistics before the next chunk is processed
+        blocks = surrogate_blocks(n_surrogates,
+                                  surrogate_chunk or n_surrogates)
+        for surrogate_block in tqdm(blocks, "Surrogate chunk",
+                                    disable=surrogate_chunk is None):
+
+            # Get the binned surrogates of the block for each unit in the
+            # pair, generating and binning them if they are not shared. The
+            # surrogates are the same whatever process generates them, and
+            # how often
+            block_surrogates = []
+            for unit in (unit_i, unit_j):
+                if binned_surrogates is not None:
+                    block_surrogates.append(binned_surrogates[unit])
+                    continue
+
+                block_size = len(range(n_surrogates)[surrogate_block])
+                block_key = (unit, surrogate_block.start)
+                with suspended_tracking(block_key in recorded_blocks):
+                    trial_suas = suas.spiketrains(unit)
+                    if surrogate_generation == 'lazy':
+                        surrogates = seeded_trial_shifting(
+                            trial_suas, n_surrogates=block_size, seed=SEED,
+                            unit=unit, first_surrogate=surrogate_block.start,
+                            **surrogate_parameters)
+                    else:
+                        if surrogate_store.enabled:
+                            surrogate_store.set_context(session=session_hash,
+                                                        unit=unit)
+                        with surrogate_streams.resume(unit):
+                            surrogates = trial_shifting(
+                                trial_suas, n_surrogates=block_size,
+                                **surrogate_parameters)
+
+                    # Bin the surrogates of each trial
+                    binned_unit_surrogates = []
+                    for trial in range(n_trials):
+                        trial_surrogates = [surrogate[trial]
+                                            for surrogate in surrogates]
+                        binned_trial_surrogates = BinnedSpikeTrain(
+                            trial_surrogates, bin_size=bin_size)
+                        binned_unit_surrogates.append(
+                            binned_trial_surrogates)
+                recorded_blocks.add(block_key)
+                block_surrogates.append(binned_unit_surrogates)
+            binned_surrogates_i, binned_surrogates_j = block_surrogates
+
+            if not per_trial_surrogate_cchs and surrogate_chunk is None:
+                surrogate_cchs = cross_correlation_histogram_batch_trials(
+                    binned_surrogates_i, binned_surrogates_j,
+                    n_calls=n_trials, method=cch_method, **cch_parameters)
+                continue
+
+            # For each trial, compute the CCH for all surrogate pairs at
+            # once
+            for trial in tqdm(range(n_trials), "Trial",
+                              disable=surrogate_chunk is not None):
+                binned_trial_surrogates_i = binned_surrogates_i[trial]
+                binned_trial_surrogates_j = binned_surrogates_j[trial]
+
+                surr_cchs, _ = cross_correlation_histogram_batch(
+                    binned_trial_surrogates_i, binned_trial_surrogates_j,
+                    method=cch_method, **cch_parameters)
+                if surrogate_statistics == 'streaming':
+                    accumulator = accumulate_surrogate_cchs(accumulator,
+                                                            surr_cchs)
+                else:
+                    surrogate_cchs.append(surr_cchs)
+            if surrogate_chunk is not None:
+                accumulator.finish_surrogates()
+
+        # Aggregate CCH across trials
+        agg_cch = aggregate_cchs(cchs, **aggregation_parameters)
+
+        # Obtain the mean and SD of the surrogate CCHs aggregated across
+        # trials
+        if surrogate_statistics == 'streaming':
+            surr_mean, surr_sd = accumulated_mean_and_sd(accumulator)
+        else:
+            # Aggregate each surrogate CCH across trials
+            agg_surr_cchs = aggregate_cchs(surrogate_cchs,
+                                           **aggregation_parameters)
+            surr_mean, surr_sd = surrogate_cchs_mean_and_sd(agg_surr_cchs)
+
+        pair_results = [(unit_i, unit_j, agg_cch, surr_mean, surr_sd)]
+
+        # In symmetric mode, derive the results of the mirrored pair
+        if symmetric:
+            rev_cch, rev_surr_mean, rev_surr_sd = reverse_cch_lags(
+                agg_cch, surr_mean, surr_sd)
+            pair_results.append((unit_j, unit_i, rev_cch, rev_surr_mean,
+                                 rev_surr_sd))
+
+        for unit_a, unit_b, pair_cch, pair_mean, pair_sd in pair_results:
+
+            if plot:
+                # Define title and output file name
+                title = f"CCH ({unit_a} x {unit_b})"
+                out_file = session_dir / f"cch_{unit_a}_{unit_b}.png"
+
+                fig, _ = plot_cch_with_significance(
+                    pair_cch, pair_mean, pair_sd,
+                    significance_threshold=significance_threshold,
+                    max_lag=max_lag, title=title)
+                # Save plot as PNG
+                fig.savefig(out_file, format="png", facecolor="white")
+                plt.close(fig)
+
+            # Checkpoint the results of the pair, after the plot was saved
+            save_pair_checkpoint(checkpoint_dir, unit_a, unit_b,
+                                 checkpoint_parameters, pair_cch, pair_mean,
+                                 pair_sd)
+
+    if worker is not None:
+        save_provenance_file(__file__, session_dir, process_id=worker,
+                             resume_id=resume_id)
+
+
+def main(session_files, output_dir, bin_size, max_lag, n_surrogates,
+         surrogate_statistics='aggregate', resume=False, symmetric=False,
+         cch_method='fft', backend=None, surrogate_store_dir=None,
+         provenance_mode='batched', plot=True, merge_provenance=False,
+         surrogate_generation='shared', memory_budget=None,
+         surrogate_chunk=None, estimate_only=False):
+    if backend is None:
+        backend = get_backend('serial')
+
     # Use builtin hash for matplotlib objects
     alpaca_setting('use_builtin_hash_for_module', ['matplotlib'])
 
@@ -217,6 +571,8 @@ def main(session_file, output_dir, bin_size, max_lag, n_surrogates):
     t_pre = 0.3 * pq.s              # Time before event where trial data starts
     t_post = 0.5 * pq.s             # Time after event where trial data ends
 
+    significance_threshold = 3.0    # SDs above the surrogate mean
+
     # Parameters for the surrogate function
     surr_parameters = {'dither': 15 * pq.ms,
                        'n_surrogates': n_surrogates}
@@ -226,194 +582,304 @@ def main(session_file, output_dir, bin_size, max_lag, n_surrogates):
     cch_parameters = {'window': [-n_lags, n_lags],
                       'border_correction': True}
 
-    # *** ANALYSIS ***
-
-    # Set seeds for reproducible surrogate generation
-    random.seed(SEED)
-    np.random.seed(SEED)
-
-    # Get session repository and directory to write the files for the session
-    session_name = session_file.stem
-    session_dir = output_dir / session_name
-    session_dir.mkdir(exist_ok=True)
-
-    if rank == 0:
-        # Load the Neo Block with the data
-        logging.info(f"Loading data file: {session_file}")
-        block = load_data(session_file)
-
-        # Select the trial intervals for the analysis
-        logging.info("Extracting trial data")
-        start_events = get_events(block.segments[0],
-                                  trial_event_labels=event_label,
-                                  performance_in_trial_str='correct_trial',
-                                  belongs_to_trialtype=trial_type)[0]
-        trial_epochs = add_epoch(block.segments[0], start_events, pre=-t_pre,
-                                 post=t_post, attach_result=False)
-        trial_segments = cut_segment_by_epoch(block.segments[0], trial_epochs,
-                                              reset_time=True)
-        n_trials = len(trial_segments)
-
-        # Select the data for the CCH computation
-        # For each SUA, a list of `neo.SpikeTrain`s, each containing the data
-        # of a single trial, is returned.
-        logging.info("Selecting SUAs for analysis")
-
-        suas = get_suas_trials(trial_segments, min_snr=min_snr,
-                               min_firing_rate=min_firing_rate)
-
-        # Bin the spike trains
-        # Store in a dict with the unit id as key to avoid recomputing
-        logging.info("Binning spike trains")
-
-        binned_suas = {sua_id: BinnedSpikeTrain(sua, bin_size=bin_size)
-                       for sua_id, sua in suas.items()}
-
-        # For each spike train, obtain a list of `n_surrogates`, and bin using
-        # the same parameters as the original spike trains.
-        # Each `BinnedSpikeTrain` object will be stored in a dictionary where
-        # the unit id is the key. Each dictionary entry will have
-        # `n_surrogates` `BinnedSpikeTrain`s objects, each with the
-        # `n_trials` of a surrogate.
-        logging.info("Generating spike train surrogates and binning")
-
-        binned_surrogates = defaultdict(list)
-        # For each unit...
-        for unit, trial_suas in tqdm(suas.items(), "Unit"):
-            # Obtain `n_surrogates` for the spike trains containing the trials
-            # of the unit (returns list of lists; `n_surrogates` x `n_trials`)
-            surrogates = trial_shifting(trial_suas, **surr_parameters)
-
-            for surrogate in surrogates:
-                # Bin and store the surrogate. Each binned spike train
-                # contains all trials for that surrogate
-                binned_surrogate = BinnedSpikeTrain(surrogate,
-                                                    bin_size=bin_size)
-                binned_surrogates[unit].append(binned_surrogate)
-
-        # Define the pairs which to compute the CCH for
-        pairs = list(itertools.permutations(suas.keys(), 2))
-
-        n_pairs = len(pairs)
-        if n_pairs > nprocs:
-            raise Exception(f"Need {n_pairs} processes for parallelization. "
-                            "Check your MPI run configuration.")
-
-    else:
-        binned_surrogates = None
-        binned_suas = None
-        pairs = None
-        n_trials = None
-
-    binned_suas = comm.bcast(binned_suas, root=0)
-    binned_surrogates = comm.bcast(binned_surrogates, root=0)
-    pairs = comm.bcast(pairs, root=0)
-    n_trials = comm.bcast(n_trials, root=0)
-
-    logging.info("Computing CCHs")
+    # Parameters defining the results of each pair. Checkpoints of a
+    # previous run are only reused if computed with the same values
+    checkpoint_parameters = {'seed': SEED,
+                             'bin_size': bin_size,
+                             'surrogates': surr_parameters,
+                             'surrogate_generation': surrogate_generation,
+                             'cch': cch_parameters}
 
-    # Define the parameters used by the CCH aggregation function
-    aggregation_parameters = {'max_lag': max_lag, 'n_lags': n_lags}
+    # *** ANALYSIS ***
 
-    # For each SUA pair...
-    for idx, (unit_i, unit_j) in enumerate(pairs):
-        if idx != rank:
+    # The outputs of each session are saved to a folder named after the
+    # session file
+    session_names = [session_file.stem for session_file in session_files]
+    check_session_names(session_names)
+
+    run_id = backend.bcast(datetime.now().strftime("%Y%m%dT%H%M%S")
+                           if backend.rank == 0 else None)
+
+    if surrogate_store_dir is not None:
+        surrogate_store.open(surrogate_store_dir)
+
+    # The data and surrogates of all sessions are prepared first, such that
+    # the pairs of all sessions are then processed by the same processes.
+    # The provenance of each session is recorded in a separate history, and
+    # saved to the session folder
+    provenance_histories = ProvenanceHistories()
+    sessions = {}
+    for session_name, session_file in zip(session_names, session_files):
+        provenance_histories.switch(session_name)
+
+        # Get the directories to write the files of the session, and the
+        # results of each finished pair, so that an interrupted run can be
+        # resumed
+        session_dir, checkpoint_dir = session_folders(output_dir,
+                                                      session_name)
+
+        # Surrogates stored by previous runs are identified by the contents
+        # of the session file
+        session_hash = None
+        if surrogate_store.enabled:
+            session_hash = backend.bcast(
+                hash_file(session_file) if backend.rank == 0 else None)
+
+        # The surrogate CCHs of the session may be computed in chunks
+        session_chunk = surrogate_chunk
+
+        if backend.rank == 0:
+            # Load the Neo Block with the data
+            logging.info(f"Loading data file: {session_file}")
+            block = load_data(session_file)
+
+            # Select the trial intervals for the analysis
+            logging.info("Extracting trial data")
+            start_events = get_events(
+                block.segments[0], trial_event_labels=event_label,
+                performance_in_trial_str='correct_trial',
+                belongs_to_trialtype=trial_type)[0]
+            trial_epochs = add_epoch(block.segments[0], start_events,
+                                     pre=-t_pre, post=t_post,
+                                     attach_result=False)
+            trial_segments = cut_segment_by_epoch(
+                block.segments[0], trial_epochs, reset_time=True)
+            n_trials = len(trial_segments)
+
+            # Select the data for the CCH computation
+            # For each SUA, a list of `neo.SpikeTrain`s, each containing the
+            # data of a single trial, is returned.
+            logging.info("Selecting SUAs for analysis")
+
+            suas = get_suas_trials(trial_segments, min_snr=min_snr,
+                                   min_firing_rate=min_firing_rate)
+
+            # Bin the spike trains
+            # Store in a dict with the unit id as key to avoid recomputing
+            logging.info("Binning spike trains")
+
+            binned_suas = {
+                sua_id: BinnedSpikeTrain(suas.spiketrains(sua_id),
+                                         bin_size=bin_size)
+                for sua_id in suas.unit_ids}
+
+            # Define the pairs which to compute the CCH for. In symmetric
+            # mode, only (i, j) is computed, and the results of (j, i) are
+            # derived
+            all_pairs, pairs = select_pairs(suas.unit_ids,
+                                            symmetric=symmetric)
+
+            # Project the peak memory of a process from the size of the
+            # data. If it exceeds the budget, the surrogate CCHs of each pair
+            # are computed in the largest chunks of surrogates that fit. The
+            # sessions prepared before are part of the baseline
+            session_memory = memory_parameters(
+                suas, binned_suas, n_trials, n_surrogates, n_lags,
+                surrogate_statistics, backend, n_pairs=len(pairs))
+            session_memory['generation_trials'] = n_trials
+            if surrogate_generation == 'lazy':
+                # The surrogates of both units are generated for each pair,
+                # and are not shared
+                session_memory['pair_generation'] = True
+                logging.warning(
+                    f"Lazy surrogates are generated for each of the "
+                    f"{len(pairs)} pairs ({2 * len(pairs)} generations), "
+                    f"instead of once for each of the {suas.n_units} units")
+            session_chunk = plan_surrogate_chunk(
+                session_memory, surrogate_chunk=session_chunk,
+                memory_budget=memory_budget)
+
+            # Skip the pairs already finished in a previous run
+            if resume:
+                pairs = remaining_pairs(pairs, all_pairs, checkpoint_dir,
+                                        checkpoint_parameters,
+                                        symmetric=symmetric)
+
+        else:
+            suas = None
+            binned_suas = None
+            all_pairs = None
+            pairs = None
+            n_trials = None
+
+        session_chunk = backend.bcast(session_chunk)
+        if estimate_only:
             continue
 
-        logging.info(f"Computing {unit_i} x {unit_j}")
-
-        # Define title and output file name
-        title = f"CCH ({unit_i} x {unit_j})"
-        out_file = session_dir / f"cch_{unit_i}_{unit_j}.png"
-
-        # Get the binned spike train for each unit in the pair
-        binned_spiketrain_i = binned_suas[unit_i]
-        binned_spiketrain_j = binned_suas[unit_j]
-
-        # Get the binned surrogates for each unit in the pair
-        binned_surrogates_i = binned_surrogates[unit_i]
-        binned_surrogates_j = binned_surrogates[unit_j]
+        # With MPI, the binned data is shared as flat buffers in the memory
+        # of each node, instead of sending a pickled copy to every process
+        binned_suas, suas_handles = backend.distribute_binned_spiketrains(
+            binned_suas)
+        suas = backend.bcast(suas)
+        pairs = backend.bcast(pairs)
+        n_trials = backend.bcast(n_trials)
+
+        # With lazy surrogates, or in chunked mode, each process generates
+        # the surrogates of the units of a pair while it processes the pair,
+        # one chunk at a time
+        if surrogate_generation == 'lazy' or session_chunk is not None:
+            binned_surrogates = None
+            surrogates_handles = []
+        else:
+            # For each spike train, obtain a list of `n_surrogates`, and
+            # bin using the same parameters as the original spike trains.
+            # Each `BinnedSpikeTrain` object will be stored in a dictionary
+            # where the unit id is the key. Each dictionary entry will have
+            # `n_trials` `BinnedSpikeTrain`s objects, each with the
+            # `n_surrogates` of a trial. The units are split among all
+            # processes. The random generators are seeded from the unit id,
+            # so that the surrogates of a unit do not depend on the number
+            # of processes, or on the pairs that still need to be computed
+            # when resuming.
+            logging.info("Generating spike train surrogates and binning")
+
+            units = process_units(suas.unit_ids, pairs, backend)
+            random_streams = RandomStreams(SEED)
+            process_binned_surrogates = defaultdict(list)
+            # For each unit of this process...
+            for unit in tqdm(units, "Unit"):
+                trial_suas = suas.spiketrains(unit)
+                random_streams.seed(unit)
+                if surrogate_store.enabled:
+                    surrogate_store.set_context(session=session_hash,
+                                                unit=unit)
+
+                # Obtain `n_surrogates` for the spike trains containing the
+                # trials of the unit (returns list of lists;
+                # `n_surrogates` x `n_trials`)
+                surrogates = trial_shifting(trial_suas, **surr_parameters)
+
+                for trial in range(len(trial_suas)):
+                    # Bin and store the surrogates for the trial. Each
+                    # binned spike train contains all surrogates for that
+                    # trial
+                    trial_surrogates = [surrogate[trial]
+                                        for surrogate in surrogates]
+                    binned_trial_surrogates = BinnedSpikeTrain(
+                        trial_surrogates, bin_size=bin_size)
+                    process_binned_surrogates[unit].append(
+                        binned_trial_surrogates)
+
+            # Collect the binned surrogates of all processes, and share
+            # them as flat buffers in the memory of each node
+            binned_surrogates, surrogates_handles = \
+                backend.allgather_binned_spiketrains(
+                    process_binned_surrogates)
+
+        # Select the fastest method to compute the surrogate CCHs, using the
+        # surrogates of the first pair in the first trial as sample. If the
+        # surrogates are generated for each pair, they are not available
+        # yet, and the spike trains of all trials of the pair, that have the
+        # same density, are used instead
+        samples, sample_trial = binned_surrogates, 0
+        if binned_surrogates is None:
+            samples, sample_trial = binned_suas, None
+        session_cch_method = select_session_cch_method(
+            cch_method, backend, pairs, cch_parameters, samples,
+            sample_trial=sample_trial)
+
+        # The chunks are folded into running statistics
+        session_statistics = surrogate_statistics
+        if session_chunk is not None:
+            session_statistics = 'streaming'
+
+        # Store the pairs, shared resources, and arguments of
+        # `process_pairs` of the session
+        sessions[session_name] = {
+            'pairs': pairs, 'all_pairs': all_pairs,
+            'handles': suas_handles + surrogates_handles,
+            'arguments': {'binned_suas': binned_suas,
+                          'binned_surrogates': binned_surrogates,
+                          'n_trials': n_trials,
+                          'cch_method': session_cch_method,
+                          'surrogate_statistics': session_statistics,
+                          'surrogate_chunk': session_chunk,
+                          'suas': suas, 'session_hash': session_hash,
+                          'session_dir': session_dir,
+                          'checkpoint_dir': checkpoint_dir}}
+
+    if estimate_only:
+        return
 
-        # Lists to store the computed CCHs for later aggregations and
-        # mean/SD estimation
-        cchs = []
-        surrogate_cchs = defaultdict(list)
-
-        # For each trial...
-        for trial in tqdm(range(n_trials), "Trial"):
-
-            # Compute the CCH between the pair of units
-
-            binned_trial_spiketrain_i = binned_spiketrain_i[trial]
-            binned_trial_spiketrain_j = binned_spiketrain_j[trial]
-            cch, _ = cross_correlation_histogram(binned_trial_spiketrain_i,
-                                                 binned_trial_spiketrain_j,
-                                                 **cch_parameters)
-            cchs.append(cch)
-
-            # Compute the CCH for each surrogate pair
-            for n_surrogate in range(n_surrogates):
-                binned_trial_surrogate_i = \
-                    binned_surrogates_i[n_surrogate][trial]
-                binned_trial_surrogate_j = \
-                    binned_surrogates_j[n_surrogate][trial]
-                surr_cch, _ = cross_correlation_histogram(
-                    binned_trial_surrogate_i, binned_trial_surrogate_j,
-                    **cch_parameters)
-                surrogate_cchs[n_surrogate].append(surr_cch)
-
-        # Aggregate CCH across trials
-        agg_cch = aggregate_cchs(cchs, **aggregation_parameters)
-
-        # Aggregate each surrogate CCH across trials
-        agg_surr_cchs = [aggregate_cchs(cchs, **aggregation_parameters)
-                         for cchs in surrogate_cchs.values()]
-
-        fig, _ = plot_cch_with_significance(agg_cch, agg_surr_cchs,
-                                            max_lag=max_lag, title=title)
-        # Save plot as PNG
-        fig.savefig(out_file, format="png", facecolor="white")
-        plt.close(fig)
-
-    # Save provenance information as Turtle file
-    prov_file_format = "ttl"
-    prov_file_suffix = f"_{rank}" if rank > 0 else None
-    prov_file = get_file_name(__file__, output_dir=session_dir,
-                              extension=prov_file_format,
-                              suffix=prov_file_suffix)
+    logging.info("Computing CCHs")
 
-    logging.info(f"Saving provenance to {prov_file}")
+    # Compute the CCHs of each SUA pair of all sessions. Pairs are handed
+    # out on demand to the available processes
+    run_session_pairs(backend, process_pairs, sessions,
+                      provenance_histories, n_surrogates=n_surrogates,
+                      max_lag=max_lag, n_lags=n_lags,
+                      cch_parameters=cch_parameters,
+                      checkpoint_parameters=checkpoint_parameters,
+                      symmetric=symmetric,
+                      resume_id=run_id if resume else None,
+                      provenance_mode=provenance_mode,
+                      significance_threshold=significance_threshold,
+                      plot=plot, bin_size=bin_size,
+                      surrogate_parameters={
+                          'dither': surr_parameters['dither']},
+                      surrogate_generation=surrogate_generation)
+
+    # Resume tracking in this function, as `process_pairs` captures the
+    # provenance in its own frame when it runs in this process
+    activate()
 
-    save_provenance(prov_file, file_format=prov_file_format,
-                    show_progress=True)
+    for session_name, session in sessions.items():
+        provenance_histories.switch(session_name)
+        session_dir = session['arguments']['session_dir']
+        checkpoint_dir = session['arguments']['checkpoint_dir']
+        all_pairs = session['all_pairs']
+
+        # Save the numeric results of all pairs (including the ones finished
+        # in previous runs) to a single file, from which the plots can be
+        # rendered again with `render_cchs.py`
+        if backend.rank == 0 and all_pairs:
+            logging.info(f"Saving CCH results of {session_name}")
+            cchs, means, sds, cch_annotations = collect_pair_results(
+                checkpoint_dir, all_pairs, checkpoint_parameters)
+            save_cch_results(session_dir / CCH_RESULTS_FILE, all_pairs,
+                             cchs, means, sds, bin_size=bin_size,
+                             max_lag=max_lag,
+                             significance_threshold=significance_threshold,
+                             annotations=cch_annotations,
+                             parameters=checkpoint_parameters)
+
+        # Save provenance information as Turtle file
+        save_provenance_file(__file__, session_dir, process_id=backend.rank,
+                             resume_id=run_id if resume else None)
+        if merge_provenance:
+            merge_run_provenance(__file__, session_dir, backend,
+                                 resume_id=run_id if resume else None)
+        provenance_histories.discard(session_name)
+
+        # Release the shared binned data. This is done only after saving
+        # the provenance, as the tracked objects still refer to the shared
+        # memory
+        backend.free(session['handles'])
 
 
 if __name__ == "__main__":
     # Parse inputs to the script
     parser = argparse.ArgumentParser()
-    parser.add_argument('--output_path', type=str, required=True)
-    parser.add_argument('--bin_size', type=int, required=False, default=1)
-    parser.add_argument('--max_lag', type=int, required=False, default=200)
-    parser.add_argument('--n_surrogates', type=int, required=False,
-                        default=1000)
-    parser.add_argument('input', metavar='input', nargs=1)
+    add_cch_arguments(parser)
+    parser.add_argument('--surrogates', type=str, required=False,
+                        choices=['shared', 'lazy'], default='shared',
+                        help="'shared' generates the surrogates of all units "
+                             "before computing the CCHs, and shares them "
+                             "with all processes; 'lazy' generates the "
+                             "surrogates of both units of a pair in the "
+                             "process computing it, again for every pair "
+                             "(not kept in the surrogate store)")
     args = parser.parse_args()
 
     # Define values passed as parameters to the main function, and create any
     # directories needed
-    session_file = Path(args.input[0]).expanduser().absolute()
-    output_dir = Path(args.output_path).expanduser().absolute()
-    output_dir.mkdir(parents=True, exist_ok=True)
-    max_lag = args.max_lag * pq.ms
-    bin_size = args.bin_size * pq.ms
-    n_surrogates = args.n_surrogates
+    arguments = cch_arguments(args)
 
     # Run the analysis
     start = datetime.now()
     logging.info(f"Start time: {start}")
 
-    main(session_file, output_dir, bin_size=bin_size, max_lag=max_lag,
-         n_surrogates=n_surrogates)
+    main(surrogate_generation=args.surrogates, **arguments)
 
     end = datetime.now()
     logging.info(f"End time: {end}; Total processing time:{end - start}")
@@ -7,7 +7,6 @@ import warnings
 from tqdm import tqdm
 from itertools import chain
 
-import random
 import numpy as np
 import quantities as pq
 
@@ -21,6 +20,7 @@ from alpaca import Provenance, activate, save_provenance, alpaca_setting
 from alpaca.utils.files import get_file_name
 
 from neao_annotation import annotate_neao
+from analysis_utils.seeding import SEEDING_MODES, RandomStreams
 
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
@@ -109,7 +109,7 @@ def plot_isi_histogram(counts, edges, cv_value):
     return fig, ax
 
 
-def main(output_dir, rate, t_stop, n_spiketrains=100):
+def main(output_dir, rate, t_stop, n_spiketrains=100, seeding='sequential'):
 
     # Use builtin hash for matplotlib objects
     alpaca_setting('use_builtin_hash_for_module', ['matplotlib'])
@@ -118,16 +118,23 @@ def main(output_dir, rate, t_stop, n_spiketrains=100):
     # Activate provenance tracking
     activate()
 
-    # Set seeds for reproducible spike train generation
-    random.seed(SEED)
-    np.random.seed(SEED)
+    # Set seeds for reproducible spike train generation. With keyed
+    # seeding, each spike train is generated from its own seed
+    random_streams = RandomStreams(SEED, mode=seeding)
+    random_streams.start()
 
     # Generate spike trains
-    poisson_process = [homogeneous_poisson_process(rate=rate, t_stop=t_stop)
-                       for _ in range(n_spiketrains)]
-
-    gamma_process = [homogeneous_gamma_process(a=1, b=rate, t_stop=t_stop)
-                     for _ in range(n_spiketrains)]
+    poisson_process = []
+    for index in range(n_spiketrains):
+        random_streams.seed('poisson', index)
+        spiketrain = homogeneous_poisson_process(rate=rate, t_stop=t_stop)
+        poisson_process.append(spiketrain)
+
+    gamma_process = []
+    for index in range(n_spiketrains):
+        random_streams.seed('gamma', index)
+        spiketrain = homogeneous_gamma_process(a=1, b=rate, t_stop=t_stop)
+        gamma_process.append(spiketrain)
 
     # For each spiketrain, compute the ISI histogram and variability statistics
     for idx, spiketrain in enumerate(
@@ -167,6 +174,12 @@ if __name__ == "__main__":
                         default=100)
     parser.add_argument("--rate", type=int, required=False, default=10)
     parser.add_argument("--t_stop", type=int, required=False, default=100)
+    parser.add_argument('--seeding', type=str, required=False,
+                        choices=SEEDING_MODES, default='sequential',
+                        help="'sequential' seeds the generators once, as "
+                             "in the published results; 'keyed' seeds the "
+                             "generation of each spike train separately, "
+                             "so that it does not depend on the order")
     args = parser.parse_args()
 
     # Define values passed as parameters to the main function, and create any
@@ -181,7 +194,8 @@ if __name__ == "__main__":
     start = datetime.now()
     logging.info(f"Start time: {start}")
 
-    main(output_dir, rate=rate, t_stop=t_stop, n_spiketrains=n_spiketrains)
+    main(output_dir, rate=rate, t_stop=t_stop, n_spiketrains=n_spiketrains,
+         seeding=args.seeding)
 
     end = datetime.now()
     logging.info(f"End time: {end}; Total processing time:{end - start}")
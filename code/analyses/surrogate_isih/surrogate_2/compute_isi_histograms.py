@@ -2,12 +2,9 @@ import argparse
 from pathlib import Path
 from datetime import datetime
 import logging
-from tqdm import tqdm
 
 from collections import defaultdict
-import re
 
-import random
 import numpy as np
 import quantities as pq
 
@@ -15,14 +12,26 @@ import neo
 from neo.utils import add_epoch, get_events, cut_segment_by_epoch
 
 from elephant.statistics import isi, mean_firing_rate
-from elephant.spike_train_surrogates import trial_shifting
 
 import matplotlib.pyplot as plt
 
-from alpaca import Provenance, activate, alpaca_setting, save_provenance
-from alpaca.utils import get_file_name
+from alpaca import Provenance, activate, alpaca_setting
 
 from neao_annotation import annotate_neao
+from analysis_utils.accumulators import SurrogateISIHAccumulator
+from analysis_utils.backends import get_backend
+from analysis_utils.isi import isi_histogram_batch, isi_histogram_edges
+from analysis_utils.provenance import (ProvenanceHistories,
+                                       merge_run_provenance,
+                                       save_provenance_file)
+from analysis_utils.surrogate_store import SurrogateStore, hash_file
+from analysis_utils.surrogates import (draw_trial_shifts,
+                                       trial_shifting_spike_times)
+from analysis_utils.seeding import SEEDING_MODES, RandomStreams
+from analysis_utils.sessions import (check_session_names,
+                                     expand_session_files, get_session_name,
+                                     process_session_tasks)
+from analysis_utils.trial_data import TrialSpikeTrains
 
 
 SEED = 689
@@ -42,14 +51,34 @@ get_events = Provenance(inputs=['container'],
 cut_segment_by_epoch = Provenance(inputs=['seg', 'epoch'],
                                   container_output=True)(cut_segment_by_epoch)
 
-trial_shifting = annotate_neao(
+# The spike trains of the trials of a unit are created from the spike times
+# stored in the container, without copies
+TrialSpikeTrains.spiketrains = Provenance(
+    inputs=['self'], container_output=True)(TrialSpikeTrains.spiketrains)
+
+# The trial shifting surrogates are generated as with Elephant's
+# `trial_shifting`: the relative shifts of all surrogates and trials are drawn
+# first, and applied to the spike times of each trial, scaled by the amount
+# of dithering. The shifts are taken from the on-disk store, if enabled
+surrogate_store = SurrogateStore()
+draw_trial_shifts = surrogate_store.cached(draw_trial_shifts)
+draw_trial_shifts = Provenance(
+    inputs=[], container_input=['spiketrains'])(draw_trial_shifts)
+
+# The spike times of the surrogates of each trial are generated in a single
+# array, and the surrogates of all trials of a unit are returned with the
+# same structure as `trial_shifting`. The generation is tracked and
+# annotated in the same way, with each surrogate as one object
+trial_shifting_spike_times = annotate_neao(
     "neao_steps:GenerateTrialShiftingSurrogate",
     arguments={
         'spiketrains': "neao_data:SpikeTrain",
         'dither': "neao_params:DitheringTime"},
-    returns={'***': "neao_data:SpikeTrainSurrogate"})(trial_shifting)
-trial_shifting = Provenance(inputs=[], container_input=['spiketrains'],
-                            container_output=(1, 1))(trial_shifting)
+    returns={'***': "neao_data:SpikeTrainSurrogate"})(
+        trial_shifting_spike_times)
+trial_shifting_spike_times = Provenance(
+    inputs=['shifts'], container_input=['spiketrains'],
+    container_output=(1, 1))(trial_shifting_spike_times)
 
 
 isi = annotate_neao(
@@ -57,6 +86,15 @@ isi = annotate_neao(
     returns={0: "neao_data:InterspikeIntervals"})(isi)
 isi = Provenance(inputs=['spiketrain'])(isi)
 
+# The histograms of all surrogates of a trial are computed at once
+isi_histogram_batch = annotate_neao(
+    ["neao_steps:ComputeInterspikeIntervals",
+     "neao_steps:ComputeInterspikeIntervalHistogram"],
+    arguments={'bin_size': "neao_params:BinSize"},
+    returns={0: "neao_data:InterspikeIntervalHistogram"})(isi_histogram_batch)
+isi_histogram_batch = Provenance(
+    inputs=[], container_input=['spiketrains'])(isi_histogram_batch)
+
 
 plt.Figure.savefig = Provenance(
     inputs=['self'], file_output=['fname'])(plt.Figure.savefig)
@@ -77,21 +115,22 @@ def load_data(file_name):
     return block
 
 
-@Provenance(inputs=[], container_input=['trials'], container_output=1)
+@Provenance(inputs=[], container_input=['trials'])
 def get_suas_trials(trials, min_snr=5.0, min_firing_rate=20*pq.Hz):
     """
     This function takes a list of `neo.Segment`s containing trial-level data,
-    and returns a dictionary with the `neo.SpikeTrain` objects of each trial
-    for a selected subset of SUA units.
+    and returns a `TrialSpikeTrains` object with the spike times of each
+    trial for a selected subset of SUA units.
 
     The `neo.SpikeTrain`s are expected to have annotations `sua == True` and
     `SNR`. The parameter `min_snr` will be compared against the latter to
     filter out the units. The parameter `min_firing_rate` filters out
     spike trains with a mean firing rate in the trial less than its value.
 
-    The return object is a dictionary where the unit id is the key and the
-    values are a list of `neo.SpikeTrain`s, each containing the data of a
-    single trial for that SUA unit.
+    The return object stores the spike times of all trials of the selected
+    units in a single buffer. The ids of the units are in `unit_ids`, and
+    `spiketrains(unit_id)` returns a list of `neo.SpikeTrain`s, each
+    containing the data of a single trial for that SUA unit.
 
     If a unit does not have data available for all the trials, it is not
     included.
@@ -125,7 +164,7 @@ def get_suas_trials(trials, min_snr=5.0, min_firing_rate=20*pq.Hz):
     selected_suas = {st_id: sts for st_id, sts in suas.items() if
                      st_id in unit_ids}
 
-    return selected_suas
+    return TrialSpikeTrains.from_spiketrains(selected_suas)
 
 
 @Provenance(inputs=['isi_times'])
@@ -195,76 +234,52 @@ def aggregate_isi_histograms(*histograms):
     return np.sum(stacked, axis=0)
 
 
-@Provenance(inputs=['arrays'])
+@Provenance(inputs=['accumulator', 'surrogate_histograms'])
+@annotate_neao("neao_steps:ApplySum")
+def accumulate_surrogate_isi_histograms(accumulator, surrogate_histograms):
+    """
+    Adds the surrogate ISI histograms of one trial (one row per surrogate)
+    to the running totals of `accumulator` (a `SurrogateISIHAccumulator`),
+    so that they do not need to be stored.
+    """
+    return accumulator.add_trial(surrogate_histograms)
+
+
+@Provenance(inputs=['accumulator'])
 @annotate_neao(["neao_steps:ComputeMean",
                 "neao_steps:ComputeStandardDeviation"],
                returns={0: "neao_data:InterspikeIntervalHistogram",
                         1: "neao_data:Data"})
-def mean_and_sd(*arrays, axis=0):
-    stacked = np.vstack(arrays)
-    mean = np.mean(stacked, axis=axis)
-    std_dev = np.std(stacked, axis=axis)
-    return mean, std_dev
-
-
-def main(session_file, output_dir, bin_size, max_time, n_surrogates,
-         min_firing_rate=15*pq.Hz, min_snr=5.0):
-
-    # Use builtin hash for matplotlib objects
-    alpaca_setting('use_builtin_hash_for_module', ['matplotlib'])
-    alpaca_setting('authority', "fz-juelich.de")
-
-    # Activate provenance tracking
-    activate()
-
-    # Parameters for the surrogate function
-    surr_parameters = {'dither': 30 * pq.ms,
-                       'n_surrogates': n_surrogates}
+def accumulated_mean_and_sd(accumulator):
+    """
+    Computes the mean and standard deviation across the surrogate ISI
+    histograms aggregated by `accumulator`.
+    """
+    return accumulator.mean_and_sd()
 
-    # Parameters for the ISI histogram function
-    histogram_parameters = {'bin_size': bin_size,
-                            'max_time': max_time}
 
-    # *** ANALYSIS ***
+def process_units(units, worker, suas, session_name, session_dir,
+                  session_hash, random_streams, surr_parameters,
+                  histogram_parameters, n_surrogates, n_bins):
+    """
+    Computes the ISI histograms of the trials of each unit in `units`, and
+    the mean and standard deviation of the histograms of their surrogates,
+    and saves the plot of each unit.
 
-    # Set seeds for reproducible surrogate generation
-    random.seed(SEED)
-    np.random.seed(SEED)
-
-    # Get session repository and directory to write the files for the session
-    session_name = re.match(r"^([a-z]\d{6}-\d{3}).*$",
-                            str(session_file.stem)).group(1)
-    session_dir = output_dir / session_name
-    session_dir.mkdir(exist_ok=True)
-
-    logging.info(f"Loading data file: {session_file}")
-    block = load_data(session_file)
-
-    # Select the trial intervals for the analysis
-    logging.info("Extracting trial data")
-    start_events = get_events(block.segments[0],
-                              trial_event_labels='TS-ON',
-                              performance_in_trial_str='correct_trial')[0]
-    end_events = get_events(block.segments[0],
-                            trial_event_labels='STOP',
-                            performance_in_trial_str='correct_trial')[0]
-    trial_epochs = add_epoch(block.segments[0], start_events, end_events,
-                             attach_result=False)
-    trial_segments = cut_segment_by_epoch(block.segments[0], trial_epochs,
-                                          reset_time=True)
-
-    # Select the data for the ISI histogram computation
-    # For each SUA, a list of `neo.SpikeTrain`s, each containing the data
-    # of a single trial, is returned.
-    logging.info("Selecting SUAs for analysis")
-
-    suas = get_suas_trials(trial_segments, min_snr=min_snr,
-                           min_firing_rate=min_firing_rate)
-
-    logging.info(f"SUAs selected: {','.join(suas.keys())}")
+    If `worker` is not None, this runs in a separate worker process, that
+    saves the provenance of its computations to its own file.
+    """
+    # Capture the provenance of the computations in this function. Worker
+    # processes only record their own computations
+    activate(clear=worker is not None)
 
     # For each unit
-    for unit, trial_suas in tqdm(suas.items(), "Unit"):
+    for unit in units:
+        logging.info(f"Computing ISI histograms of {unit}")
+        trial_suas = suas.spiketrains(unit)
+
+        if surrogate_store.enabled:
+            surrogate_store.set_context(session=session_hash, unit=unit)
 
         # Define title and output file name
         title = f"{session_name} - {unit}"
@@ -274,16 +289,16 @@ def main(session_file, output_dir, bin_size, max_time, n_surrogates,
         all_sua_histograms = list()
         all_sua_edges = list()
 
-        # {surr_idx_1: [surr_trial_1, surr_trial_2, ..., surr_trial_Nt],
-        #  surr_idx_2: [surr_trial_1, surr_trial_2, ..., surr_trial_Nt],
-        #  ...
-        #  surr_idx_N: [surr_trial_1, surr_trial_2, ..., surr_trial_Nt]}
-        # where N = number of surrogates and Nt = number of trials
-        all_surrogate_histograms = defaultdict(list)
+        # Running totals of the histograms of each surrogate across the
+        # trials (N x number of bins, where N = number of surrogates)
+        accumulator = SurrogateISIHAccumulator(n_surrogates, n_bins)
 
         # Obtain `n_surrogates` for the spike trains containing the trials
-        # of the unit (returns list of lists; `n_surrogates` x `n_trials`)
-        surrogates = trial_shifting(trial_suas, **surr_parameters)
+        # of the unit (`n_surrogates` x `n_trials`)
+        random_streams.seed(unit)
+        shifts = draw_trial_shifts(trial_suas, n_surrogates=n_surrogates)
+        surrogates = trial_shifting_spike_times(trial_suas, shifts=shifts,
+                                                **surr_parameters)
 
         # For the spike train of each trial of that unit...
         for trial, sua in enumerate(trial_suas):
@@ -295,24 +310,20 @@ def main(session_file, output_dir, bin_size, max_time, n_surrogates,
             all_sua_histograms.append(sua_histogram)
             all_sua_edges.append(sua_edges)
 
-            # For each surrogate, compute the ISI histogram of the trial
-            for idx, surrogate in enumerate(surrogates):
-                trial_surrogate = surrogate[trial]
-                surrogate_isis = isi(trial_surrogate)
-                surrogate_histogram, _ = isi_histogram(surrogate_isis,
-                                                       **histogram_parameters)
-                all_surrogate_histograms[idx].append(surrogate_histogram)
+            # Compute the ISI histograms of all surrogates of this trial
+            # and add them to the totals
+            trial_surrogates = [surrogate[trial] for surrogate in surrogates]
+            surrogate_histograms, _ = isi_histogram_batch(
+                trial_surrogates, **histogram_parameters)
+            accumulator = accumulate_surrogate_isi_histograms(
+                accumulator, surrogate_histograms)
 
         # Aggregate ISI histograms of the SUA across trials
         agg_sua_histogram = aggregate_isi_histograms(*all_sua_histograms)
 
-        # Aggregate each surrogate ISI histogram across trials
-        agg_surr_histograms = [aggregate_isi_histograms(*surrogate_histograms)
-                               for surrogate_histograms in
-                               all_surrogate_histograms.values()]
-
-        # Compute surrogate ISI histogram statistics
-        mean, std_dev = mean_and_sd(*agg_surr_histograms)
+        # Compute the statistics of the surrogate ISI histograms aggregated
+        # across trials
+        mean, std_dev = accumulated_mean_and_sd(accumulator)
 
         # Plot ISI histograms from the SUA and surrogate statistics
         plot_edges = all_sua_edges[0]
@@ -324,15 +335,126 @@ def main(session_file, output_dir, bin_size, max_time, n_surrogates,
         fig.savefig(out_file, format="png", facecolor="white")
         plt.close(fig)
 
-    # Save provenance information as Turtle file
-    prov_file_format = "ttl"
-    prov_file = get_file_name(__file__, output_dir=session_dir,
-                              extension=prov_file_format)
+    if worker is not None:
+        save_provenance_file(__file__, session_dir, process_id=worker)
+
 
-    logging.info(f"Saving provenance to {prov_file}")
+def main(session_files, output_dir, bin_size, max_time, n_surrogates,
+         min_firing_rate=15*pq.Hz, min_snr=5.0, surrogate_store_dir=None,
+         seeding='sequential', backend=None):
+    if backend is None:
+        backend = get_backend('serial')
+
+    # With sequential seeding, the surrogates depend on the order in which
+    # all units are processed
+    if backend.worker_ids and seeding != 'keyed':
+        raise ValueError("Worker processes require keyed seeding")
+
+    # Use builtin hash for matplotlib objects
+    alpaca_setting('use_builtin_hash_for_module', ['matplotlib'])
+    alpaca_setting('authority', "fz-juelich.de")
 
-    save_provenance(prov_file, file_format=prov_file_format,
-                    show_progress=True)
+    # Activate provenance tracking
+    activate()
+
+    # Parameters for the surrogate function
+    surr_parameters = {'dither': 30 * pq.ms}
+
+    # Parameters for the ISI histogram function
+    histogram_parameters = {'bin_size': bin_size,
+                            'max_time': max_time}
+    n_bins = len(isi_histogram_edges(**histogram_parameters)) - 1
+
+    # *** ANALYSIS ***
+
+    # Seeds for reproducible surrogate generation. With keyed seeding, the
+    # surrogates of each unit are generated from their own seed, and do not
+    # depend on the process that computes the unit
+    random_streams = RandomStreams(SEED, mode=seeding)
+
+    # Surrogates stored by previous runs are identified by the contents of
+    # the session file
+    if surrogate_store_dir is not None:
+        surrogate_store.open(surrogate_store_dir)
+
+    # The provenance of each session is recorded in its own history, and
+    # saved to the session folder
+    provenance_histories = ProvenanceHistories()
+
+    # Load the data of each session, and select the units to analyze
+    sessions = {}
+    for session_file in session_files:
+        # Get session repository and directory to write the files for the
+        # session
+        session_name = get_session_name(session_file)
+        provenance_histories.switch(session_name)
+        session_dir = output_dir / session_name
+        session_dir.mkdir(exist_ok=True)
+
+        session_hash = None
+        if surrogate_store.enabled:
+            session_hash = hash_file(session_file)
+
+        logging.info(f"Loading data file: {session_file}")
+        block = load_data(session_file)
+
+        # Select the trial intervals for the analysis
+        logging.info("Extracting trial data")
+        start_events = get_events(block.segments[0],
+                                  trial_event_labels='TS-ON',
+                                  performance_in_trial_str='correct_trial')[0]
+        end_events = get_events(block.segments[0],
+                                trial_event_labels='STOP',
+                                performance_in_trial_str='correct_trial')[0]
+        trial_epochs = add_epoch(block.segments[0], start_events, end_events,
+                                 attach_result=False)
+        trial_segments = cut_segment_by_epoch(block.segments[0], trial_epochs,
+                                              reset_time=True)
+
+        # Select the data for the ISI histogram computation
+        # For each SUA, a list of `neo.SpikeTrain`s, each containing the data
+        # of a single trial, is returned.
+        logging.info("Selecting SUAs for analysis")
+
+        suas = get_suas_trials(trial_segments, min_snr=min_snr,
+                               min_firing_rate=min_firing_rate)
+
+        logging.info(f"SUAs selected: {','.join(suas.unit_ids)}")
+
+        sessions[session_name] = {'suas': suas,
+                                  'session_name': session_name,
+                                  'session_dir': session_dir,
+                                  'session_hash': session_hash}
+
+    # Compute the ISI histograms of each unit of all sessions. With worker
+    # processes, the units are handed out on demand
+    tasks = [(session_name, unit)
+             for session_name, session in sessions.items()
+             for unit in session['suas'].unit_ids]
+    # In sequential mode, the generators are seeded at the start of each
+    # session, as in a run with that session alone
+    backend.run(process_session_tasks, tasks, process_function=process_units,
+                sessions=sessions, provenance_histories=provenance_histories,
+                session_start=random_streams.start,
+                random_streams=random_streams,
+                surr_parameters=surr_parameters,
+                histogram_parameters=histogram_parameters,
+                n_surrogates=n_surrogates, n_bins=n_bins)
+
+    # Resume tracking in this function, as `process_units` captures the
+    # provenance in its own frame when it runs in this process
+    activate()
+
+    for session_name, session in sessions.items():
+        provenance_histories.switch(session_name)
+        session_dir = session['session_dir']
+
+        # Save provenance information as Turtle file. The files saved by the
+        # worker processes are merged into it
+        save_provenance_file(__file__, session_dir, process_id=0)
+        if backend.worker_ids:
+            merge_run_provenance(__file__, session_dir, backend)
+        provenance_histories.discard(session_name)
 
 
 if __name__ == "__main__":
@@ -344,24 +466,60 @@ if __name__ == "__main__":
                         default=200)
     parser.add_argument('--n_surrogates', type=int, required=False,
                         default=30)
-    parser.add_argument('input', metavar='input', nargs=1)
+    parser.add_argument('--surrogate_store', type=str, required=False,
+                        default=None,
+                        help="folder to store the generated surrogates, "
+                             "that are reused by any run or script with the "
+                             "same data, parameters and seed")
+    parser.add_argument('--seeding', type=str, required=False,
+                        choices=SEEDING_MODES, default=None,
+                        help="'sequential' seeds the generators once, as "
+                             "in the published results; 'keyed' seeds the "
+                             "surrogates of each unit separately, so "
+                             "that they do not depend on the order "
+                             "(default: 'keyed' with `--workers`, "
+                             "'sequential' otherwise)")
+    parser.add_argument('--workers', type=int, required=False, default=None,
+                        help="number of worker processes that compute the "
+                             "units in parallel, with keyed seeding "
+                             "(default: the units are computed by the main "
+                             "process)")
+    parser.add_argument('input', metavar='input', nargs='+',
+                        help="session files, or glob patterns matching "
+                             "them. The units of all sessions are processed "
+                             "by the same processes")
     args = parser.parse_args()
 
     # Define values passed as parameters to the main function, and create any
     # directories needed
-    session_file = Path(args.input[0]).expanduser().absolute()
+    session_files = expand_session_files(args.input)
+    check_session_names([get_session_name(session_file)
+                         for session_file in session_files])
     output_dir = Path(args.output_path).expanduser().absolute()
     output_dir.mkdir(parents=True, exist_ok=True)
     max_time = args.max_time * pq.ms
     bin_size = args.bin_size * pq.ms
     n_surrogates = args.n_surrogates
+    surrogate_store_dir = None
+    if args.surrogate_store is not None:
+        surrogate_store_dir = \
+            Path(args.surrogate_store).expanduser().absolute()
+    if args.workers is not None:
+        backend = get_backend('pool', n_workers=args.workers)
+    else:
+        backend = get_backend('serial')
+    seeding = args.seeding
+    if seeding is None:
+        seeding = 'keyed' if args.workers is not None else 'sequential'
 
     # Run the analysis
     start = datetime.now()
     logging.info(f"Start time: {start}")
 
-    main(session_file, output_dir, bin_size=bin_size,
-         max_time=max_time, n_surrogates=n_surrogates)
+    main(session_files, output_dir, bin_size=bin_size,
+         max_time=max_time, n_surrogates=n_surrogates,
+         surrogate_store_dir=surrogate_store_dir, seeding=seeding,
+         backend=backend)
 
     end = datetime.now()
     logging.info(f"End time: {end}; Total processing time:{end - start}")
@@ -0,0 +1,251 @@
+"""
+Accumulators to compute statistics of surrogate data incrementally, without
+storing all the surrogate results.
+"""
+
+import numpy as np
+
+
+class RunningMeanVariance:
+    """
+    Running mean and variance of a sequence of samples, computed with
+    Welford's algorithm.
+
+    Each sample is an array with a fixed shape (e.g., one value per lag of a
+    cross-correlation histogram). Statistics are computed element-wise
+    across the samples, and only the mean and the sum of squared deviations
+    are stored.
+
+    Parameters
+    ----------
+    shape : int or tuple of int
+        Shape of each sample.
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self._m2 = np.zeros(shape, dtype=np.float64)
+
+    def add(self, sample):
+        """
+        Folds a single sample into the statistics.
+
+        Parameters
+        ----------
+        sample : np.ndarray
+            Sample with the shape defined at initialization.
+        """
+        sample = np.asarray(sample, dtype=np.float64)
+        self.count += 1
+        delta = sample - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (sample - self.mean)
+
+    def add_batch(self, samples):
+        """
+        Folds several samples into the statistics at once, by merging the
+        statistics of the batch with the running statistics (Chan et al.).
+
+        Parameters
+        ----------
+        samples : np.ndarray
+            Array where the first axis indexes the samples.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        n_samples = samples.shape[0]
+        if n_samples == 0:
+            return
+        batch_mean = np.mean(samples, axis=0)
+        batch_m2 = np.sum((samples - batch_mean) ** 2, axis=0)
+
+        count = self.count + n_samples
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * (n_samples / count)
+        self._m2 = self._m2 + batch_m2 + \
+            delta ** 2 * (self.count * n_samples / count)
+        self.count = count
+
+    def variance(self, ddof=1):
+        """
+        Returns the variance of the samples folded so far.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom.
+            Default: 1
+
+        Returns
+        -------
+        np.ndarray
+            Element-wise variance. NaN if there are not enough samples.
+        """
+        if self.count - ddof <= 0:
+            return np.full_like(self.mean, np.nan)
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=1):
+        """
+        Returns the standard deviation of the samples folded so far.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom.
+            Default: 1
+
+        Returns
+        -------
+        np.ndarray
+            Element-wise standard deviation.
+        """
+        return np.sqrt(self.variance(ddof=ddof))
+
+
+class SurrogateCCHAccumulator:
+    """
+    Streaming statistics of the trial-aggregated cross-correlation histograms
+    (CCHs) of a set of surrogates.
+
+    The CCHs of the surrogates are added trial by trial, and summed per lag
+    into running totals (one per surrogate). Once all trials were added, the
+    totals of each finished surrogate are folded into a running mean and
+    variance, and the totals are discarded. Therefore, memory does not grow
+    with the number of trials, and the surrogate CCHs do not need to be
+    stored.
+
+    Parameters
+    ----------
+    n_bins : int
+        Number of lags in each CCH.
+    """
+
+    def __init__(self, n_bins):
+        self.n_bins = n_bins
+        self.statistics = RunningMeanVariance(n_bins)
+        self._totals = None
+        self.n_trials = 0
+
+    def add_trial(self, surrogate_cchs):
+        """
+        Adds the CCHs of one trial to the running totals.
+
+        Parameters
+        ----------
+        surrogate_cchs : np.ndarray or neo.AnalogSignal
+            CCHs of the surrogates in the trial, with shape
+            (`n_bins`, n_surrogates). Each column is one surrogate.
+        """
+        cchs = np.asarray(surrogate_cchs).reshape(self.n_bins, -1)
+        if self._totals is None:
+            self._totals = np.zeros(cchs.shape, dtype=np.float64)
+        elif self._totals.shape != cchs.shape:
+            raise ValueError("The number of surrogates must be the same in "
+                             "all trials")
+        self._totals += cchs
+        self.n_trials += 1
+        return self
+
+    def finish_surrogates(self):
+        """
+        Folds the running totals of the current surrogates into the
+        statistics, and resets the totals so that a new set of surrogates
+        can be added.
+        """
+        if self._totals is not None:
+            self.statistics.add_batch(self._totals.T)
+        self._totals = None
+        self.n_trials = 0
+        return self
+
+    @property
+    def n_surrogates(self):
+        """
+        Number of surrogates folded into the statistics.
+        """
+        return self.statistics.count
+
+    def mean_and_sd(self, ddof=1):
+        """
+        Returns the mean and standard deviation across the finished
+        surrogates.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom of the standard deviation.
+            Default: 1
+
+        Returns
+        -------
+        mean : np.ndarray
+            Mean CCH.
+        sd : np.ndarray
+            Standard deviation of the CCHs.
+        """
+        return self.statistics.mean.copy(), self.statistics.std(ddof=ddof)
+
+
+class SurrogateISIHAccumulator:
+    """
+    Running totals of the trial-aggregated interspike interval (ISI)
+    histograms of a set of surrogates.
+
+    The histograms of all surrogates in a trial are added at once into a
+    preallocated array of totals (one row per surrogate), so that the
+    histograms of the individual trials do not need to be stored. As the
+    counts are integers, the totals are exact, and the mean and standard
+    deviation across the surrogates are computed from them in a single
+    reduction.
+
+    Parameters
+    ----------
+    n_surrogates : int
+        Number of surrogates.
+    n_bins : int
+        Number of bins in each histogram.
+    """
+
+    def __init__(self, n_surrogates, n_bins):
+        self.totals = np.zeros((n_surrogates, n_bins), dtype=np.int64)
+        self.n_trials = 0
+
+    def add_trial(self, surrogate_histograms):
+        """
+        Adds the ISI histograms of one trial to the running totals.
+
+        Parameters
+        ----------
+        surrogate_histograms : np.ndarray
+            Histograms of the surrogates in the trial, with shape
+            (`n_surrogates`, `n_bins`). Each row is one surrogate.
+        """
+        histograms = np.asarray(surrogate_histograms)
+        if histograms.shape != self.totals.shape:
+            raise ValueError(f"Expected histograms with shape "
+                             f"{self.totals.shape}, got {histograms.shape}")
+        self.totals += histograms
+        self.n_trials += 1
+        return self
+
+    def mean_and_sd(self, ddof=0):
+        """
+        Returns the mean and standard deviation of the aggregated histograms
+        across the surrogates.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom of the standard deviation.
+            Default: 0
+
+        Returns
+        -------
+        mean : np.ndarray
+            Mean histogram.
+        sd : np.ndarray
+            Standard deviation of the histograms.
+        """
+        return np.mean(self.totals, axis=0), \
+            np.std(self.totals, axis=0, ddof=ddof)
@@ -0,0 +1,255 @@
+"""
+Execution backends for analyses that process independent tasks (e.g., pairs
+of units).
+
+A backend defines the processes that take part in the analysis, how data
+is shared among them, and how the tasks are distributed. Three backends are
+available:
+
+* `serial`: all tasks are executed in the calling process.
+* `pool`: the tasks are executed by a pool of local worker processes
+  (`concurrent.futures.ProcessPoolExecutor`). The workers are forked from
+  the calling process, and access its data without copies.
+* `mpi`: the analysis script runs in every MPI process (e.g., launched by
+  `mpiexec`). Data is shared in the memory of each node, and the tasks are
+  handed out on demand by rank 0. This requires `mpi4py`.
+
+The analysis code is the same for all backends. Data preparation is done by
+the process with `rank == 0` and shared with `distribute_binned_spiketrains`,
+work split by rank is collected with `allgather_binned_spiketrains`, and the
+tasks are processed by a function passed to `run`.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+
+from analysis_utils.parallel import mpi_work_queue
+from analysis_utils.distribution import (distribute_binned_spiketrains,
+                                         allgather_binned_spiketrains,
+                                         free_shared_arrays)
+
+
+BACKENDS = ('mpi', 'pool', 'serial')
+
+# Object put in the task queue of the pool to stop a worker
+_NO_MORE_TASKS = None
+
+# Function and arguments executed by the pool workers. These are set when
+# the worker process starts, so that the data is not pickled
+_worker_function = None
+_worker_kwargs = None
+
+
+class SerialBackend:
+    """
+    Executes all the tasks in the calling process.
+    """
+
+    name = 'serial'
+
+    def __init__(self):
+        self.rank = 0
+        self.size = 1
+        # Numbers of the worker processes started by `run`
+        self.worker_ids = ()
+
+    def bcast(self, obj):
+        """
+        Returns `obj` as passed by the process with rank 0.
+        """
+        return obj
+
+    def gather(self, obj):
+        """
+        Returns a list with the `obj` passed by each process, ordered by
+        rank, in the process with rank 0, and None in the other processes.
+        """
+        return [obj]
+
+    def distribute_binned_spiketrains(self, binned_spiketrains):
+        """
+        Makes the `BinnedSpikeTrain` objects in `binned_spiketrains` (only
+        needed in the process with rank 0) available to all processes.
+
+        Returns
+        -------
+        binned_spiketrains : object
+            Structure with the `BinnedSpikeTrain` objects.
+        handles : list
+            Resources to release with `free`.
+        """
+        return binned_spiketrains, []
+
+    def allgather_binned_spiketrains(self, binned_spiketrains):
+        """
+        Collects the dictionaries of `BinnedSpikeTrain` objects computed by
+        each process, and makes the union available to all processes.
+
+        Returns
+        -------
+        binned_spiketrains : dict
+            Union of the dictionaries of all processes.
+        handles : list
+            Resources to release with `free`.
+        """
+        return dict(binned_spiketrains), []
+
+    def free(self, handles):
+        """
+        Releases the resources used to share data among the processes.
+        """
+
+    def run(self, function, tasks, **kwargs):
+        """
+        Processes a sequence of tasks.
+
+        The tasks are processed by calling
+        `function(assigned_tasks, worker=worker, **kwargs)`, where
+        `assigned_tasks` is an iterable with the tasks assigned to the
+        worker. `worker` is None if `function` runs in the calling process,
+        and the number of the worker process (starting at 1) otherwise.
+        Worker processes must save any results themselves.
+
+        This must be called by every process of the backend.
+
+        Parameters
+        ----------
+        function : callable
+            Function that processes the tasks.
+        tasks : sequence
+            Tasks to process. Must be the same in all processes.
+        kwargs : dict
+            Additional arguments passed to `function`.
+        """
+        function(iter(tasks), worker=None, **kwargs)
+
+
+class MPIBackend(SerialBackend):
+    """
+    Executes the tasks in the processes of an MPI communicator.
+
+    Parameters
+    ----------
+    comm : mpi4py.MPI.Comm, optional
+        Communicator of the processes. If None, `MPI.COMM_WORLD` is used.
+        Default: None
+    """
+
+    name = 'mpi'
+
+    def __init__(self, comm=None):
+        super().__init__()
+        if comm is None:
+            from mpi4py import MPI
+            comm = MPI.COMM_WORLD
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+
+    def bcast(self, obj):
+        return self.comm.bcast(obj, root=0)
+
+    def gather(self, obj):
+        return self.comm.gather(obj, root=0)
+
+    def distribute_binned_spiketrains(self, binned_spiketrains):
+        return distribute_binned_spiketrains(binned_spiketrains, self.comm)
+
+    def allgather_binned_spiketrains(self, binned_spiketrains):
+        return allgather_binned_spiketrains(binned_spiketrains, self.comm)
+
+    def free(self, handles):
+        free_shared_arrays(handles)
+
+    def run(self, function, tasks, **kwargs):
+        # Tasks are handed out on demand. With more than one process, rank 0
+        # only coordinates the distribution
+        function(mpi_work_queue(tasks, self.comm), worker=None, **kwargs)
+
+
+def _set_worker_function(function, kwargs):
+    global _worker_function, _worker_kwargs
+    _worker_function = function
+    _worker_kwargs = kwargs
+
+
+def _iterate_queue(queue):
+    while True:
+        task = queue.get()
+        if task is _NO_MORE_TASKS:
+            break
+        yield task
+
+
+def _run_worker(queue, worker):
+    _worker_function(_iterate_queue(queue), worker=worker, **_worker_kwargs)
+
+
+class ProcessPoolBackend(SerialBackend):
+    """
+    Executes the tasks in a pool of local worker processes.
+
+    Data preparation is done in the calling process. The workers are forked
+    when `run` is called, and take the tasks from a shared queue, on demand.
+
+    Parameters
+    ----------
+    n_workers : int, optional
+        Number of worker processes. If None, the number of CPUs is used.
+        Default: None
+    """
+
+    name = 'pool'
+
+    def __init__(self, n_workers=None):
+        super().__init__()
+        self.n_workers = n_workers if n_workers else os.cpu_count()
+        self.worker_ids = tuple(range(1, self.n_workers + 1))
+
+    def run(self, function, tasks, **kwargs):
+        # Forked workers inherit the data in `kwargs` without pickling it
+        context = multiprocessing.get_context('fork')
+        with context.Manager() as manager:
+            queue = manager.Queue()
+            for task in tasks:
+                queue.put(task)
+            for _ in range(self.n_workers):
+                queue.put(_NO_MORE_TASKS)
+
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.n_workers, mp_context=context,
+                    initializer=_set_worker_function,
+                    initargs=(function, kwargs)) as executor:
+                futures = [executor.submit(_run_worker, queue, worker)
+                           for worker in self.worker_ids]
+                for future in futures:
+                    # Raise any exception of the workers
+                    future.result()
+
+
+def get_backend(name, n_workers=None):
+    """
+    Creates an execution backend.
+
+    Parameters
+    ----------
+    name : {'mpi', 'pool', 'serial'}
+        Name of the backend.
+    n_workers : int, optional
+        Number of worker processes of the `pool` backend. If None, the
+        number of CPUs is used.
+        Default: None
+
+    Returns
+    -------
+    SerialBackend or MPIBackend or ProcessPoolBackend
+    """
+    if name == 'mpi':
+        return MPIBackend()
+    if name == 'pool':
+        return ProcessPoolBackend(n_workers)
+    if name == 'serial':
+        return SerialBackend()
+    raise ValueError(f"Invalid backend: {name}. Valid backends are: "
+                     f"{', '.join(BACKENDS)}")
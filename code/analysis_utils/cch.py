@@ -0,0 +1,336 @@
+"""
+Cross-correlation histogram (CCH) computations shared by the CCH analysis
+scripts.
+"""
+
+import logging
+import timeit
+
+import numpy as np
+import quantities as pq
+import scipy.signal
+
+import neo
+
+
+# Methods available to compute the cross-correlation histograms
+CCH_METHODS = ('direct', 'fft', 'sparse')
+
+
+def _check_binned_spiketrains(binned_spiketrain_i, binned_spiketrain_j):
+    # Checks that the two `BinnedSpikeTrain` objects have the same number of
+    # rows and the same binning, as required by the batched computation
+    if binned_spiketrain_i.shape != binned_spiketrain_j.shape:
+        raise ValueError("Binned spike trains must have the same shape: "
+                         f"{binned_spiketrain_i.shape} and "
+                         f"{binned_spiketrain_j.shape}")
+
+    binned_spiketrain_j.rescale(binned_spiketrain_i.units)
+    if not np.isclose(binned_spiketrain_i._bin_size,
+                      binned_spiketrain_j._bin_size):
+        raise ValueError("Bin sizes must be equal")
+    if not np.isclose(binned_spiketrain_i._t_start,
+                      binned_spiketrain_j._t_start):
+        raise ValueError("Binned spike trains must have the same `t_start`")
+
+
+def _check_window(window, n_bins):
+    # Only the integer window of `cross_correlation_histogram` is supported
+    if len(window) != 2 or \
+            not np.issubdtype(type(window[0]), np.integer) or \
+            not np.issubdtype(type(window[1]), np.integer):
+        raise ValueError("Window must be a pair of integers")
+    left_edge, right_edge = window
+    if left_edge >= right_edge:
+        raise ValueError(
+            f"Window's left edge ({left_edge}) must be lower than the right "
+            f"edge ({right_edge})")
+    if left_edge < -n_bins + 1 or right_edge > n_bins - 1:
+        raise ValueError("The window exceeds the length of the spike trains")
+
+
+def border_correction_factors(lags, n_bins):
+    """
+    Returns the factor that corrects each lag of a CCH for the number of bins
+    that overlap at that lag. This is the same correction applied by
+    `elephant.spike_train_correlation.cross_correlation_histogram` with
+    `border_correction=True`, for spike trains with the same `t_start` and
+    `t_stop`.
+
+    Parameters
+    ----------
+    lags : np.ndarray
+        Integer lags (in bins) of the CCH.
+    n_bins : int
+        Number of bins in the spike trains.
+
+    Returns
+    -------
+    np.ndarray
+        Correction factor for each lag in `lags`.
+    """
+    n_values_fall_in_window = n_bins - np.abs(lags)
+    return float(n_bins) / n_values_fall_in_window
+
+
+def cch_to_analog_signal(cross_corr, lags, binned_spiketrain, window,
+                         border_correction):
+    """
+    Wraps an array of CCH counts into a `neo.AnalogSignal`, with the same
+    time axis and annotations as the object returned by
+    `elephant.spike_train_correlation.cross_correlation_histogram`.
+
+    Parameters
+    ----------
+    cross_corr : np.ndarray
+        Array with the CCH counts. If two-dimensional, each row is one CCH
+        and is stored as a separate channel of the signal.
+    lags : np.ndarray
+        Integer lags (in bins) of the CCH.
+    binned_spiketrain : elephant.conversion.BinnedSpikeTrain
+        One of the binned spike trains used to compute the CCH. It defines
+        the time units and sampling period of the signal.
+    window : list of int
+        Window used to compute the CCH.
+    border_correction : bool
+        Whether the border correction was applied.
+
+    Returns
+    -------
+    neo.AnalogSignal
+        Signal with one channel per CCH.
+    """
+    annotations = dict(window=window, border_correction=border_correction,
+                       binary=False, kernel=False, normalization='counts')
+    t_start = pq.Quantity((lags[0] - 0.5) * binned_spiketrain._bin_size,
+                          units=binned_spiketrain.units)
+    signal = np.atleast_2d(cross_corr).T
+    return neo.AnalogSignal(signal=signal, units=pq.dimensionless,
+                            t_start=t_start,
+                            sampling_period=binned_spiketrain.bin_size,
+                            cch_parameters=annotations)
+
+
+def _cross_correlation_direct(binned_spiketrains_i, binned_spiketrains_j,
+                              left_edge, right_edge):
+    # Correlates all rows along the bins axis, computing the sum of products
+    # of the overlapping bins separately for each lag in the window
+    st_i = binned_spiketrains_i.to_array()
+    st_j = binned_spiketrains_j.to_array()
+    n_rows, n_bins = st_i.shape
+    cross_corr = np.empty((n_rows, right_edge - left_edge + 1))
+    for index, lag in enumerate(range(left_edge, right_edge + 1)):
+        if lag >= 0:
+            overlap_i, overlap_j = st_i[:, :n_bins - lag], st_j[:, lag:]
+        else:
+            overlap_i, overlap_j = st_i[:, -lag:], st_j[:, :n_bins + lag]
+        cross_corr[:, index] = np.einsum('ij,ij->i', overlap_i, overlap_j)
+    return cross_corr
+
+
+def _cross_correlation_fft(binned_spiketrains_i, binned_spiketrains_j,
+                           left_edge, right_edge):
+    # Correlates all rows along the bins axis, using the full bin vectors.
+    # Zero padding is used to stay between the edges of the window
+    st_i = binned_spiketrains_i.to_array()
+    st_j = binned_spiketrains_j.to_array()
+    pad_width = min(max(-left_edge, 0), max(right_edge, 0))
+    st_j = np.pad(st_j, pad_width=((0, 0), (pad_width, pad_width)),
+                  mode='constant')
+    cross_corr = scipy.signal.fftconvolve(st_j, st_i[:, ::-1], mode='valid',
+                                          axes=1)
+
+    # Convolution of integers is integers
+    return np.round(cross_corr)
+
+
+def _nonzero_bins(binned_spiketrains):
+    # Returns the row, bin index and spike count of the nonzero bins, sorted
+    # by row and bin
+    sparse_matrix = binned_spiketrains.sparse_matrix
+    if not sparse_matrix.has_sorted_indices:
+        sparse_matrix = sparse_matrix.sorted_indices()
+    rows = np.repeat(np.arange(sparse_matrix.shape[0], dtype=np.int64),
+                     np.diff(sparse_matrix.indptr))
+    return (rows, sparse_matrix.indices.astype(np.int64),
+            sparse_matrix.data.astype(np.float64))
+
+
+def _cross_correlation_sparse(binned_spiketrains_i, binned_spiketrains_j,
+                              left_edge, right_edge):
+    # Counts the coincidences of each row within the window directly from
+    # the bins with spikes. For each spike in `i`, the spikes of `j` at lags
+    # in the window are found with a binary search, so that the cost scales
+    # with the number of spikes instead of the number of bins
+    n_rows, n_bins = binned_spiketrains_i.shape
+    n_lags = right_edge - left_edge + 1
+
+    rows_i, bins_i, counts_i = _nonzero_bins(binned_spiketrains_i)
+    rows_j, bins_j, counts_j = _nonzero_bins(binned_spiketrains_j)
+
+    # Position of each nonzero bin in a single sorted sequence. Rows are
+    # separated by more than the window, so that no coincidences are found
+    # between different rows
+    stride = n_bins + n_lags
+    positions_i = rows_i * stride + bins_i
+    positions_j = rows_j * stride + bins_j
+
+    first = np.searchsorted(positions_j, positions_i + left_edge,
+                            side='left')
+    last = np.searchsorted(positions_j, positions_i + right_edge,
+                           side='right')
+    n_matches = last - first
+
+    # Indexes of the two nonzero bins in each coincidence
+    match_i = np.repeat(np.arange(len(positions_i)), n_matches)
+    match_start = np.cumsum(n_matches) - n_matches
+    match_j = np.repeat(first - match_start, n_matches) + \
+        np.arange(match_i.size)
+
+    lag_index = positions_j[match_j] - positions_i[match_i] - left_edge
+    cross_corr = np.bincount(rows_i[match_i] * n_lags + lag_index,
+                             weights=counts_i[match_i] * counts_j[match_j],
+                             minlength=n_rows * n_lags)
+    return cross_corr.reshape(n_rows, n_lags)
+
+
+def cross_correlation_histogram_batch(binned_spiketrains_i,
+                                      binned_spiketrains_j, window,
+                                      border_correction=False, method='fft'):
+    """
+    Computes the cross-correlation histograms between each row of two
+    `BinnedSpikeTrain` objects in a single vectorized pass.
+
+    Row `k` of `binned_spiketrains_i` is correlated with row `k` of
+    `binned_spiketrains_j`. This is intended to compute the CCHs of all
+    surrogates of a pair of units at once, where each row is one surrogate.
+    The result of each row is identical to the one obtained by
+    `elephant.spike_train_correlation.cross_correlation_histogram` with the
+    default `method='speed'`.
+
+    Three methods are available. `'direct'` computes the sum of products of
+    the bins for each lag, and is faster for small windows. `'fft'`
+    correlates the full bin vectors of all rows with FFTs. `'sparse'`
+    counts the coincidences from the bins with spikes only, and is faster
+    for sparse spike trains (e.g., low firing rates and small bin sizes).
+    All methods give the same result. `select_cch_method` finds the fastest
+    one for a given data set.
+
+    Parameters
+    ----------
+    binned_spiketrains_i, binned_spiketrains_j :
+        elephant.conversion.BinnedSpikeTrain
+        Binned spike trains with the same number of rows, bin size,
+        `t_start` and `t_stop`.
+    window : list of int
+        Left and right edges of the window (in bins) where the CCH is
+        computed.
+    border_correction : bool, optional
+        Whether to correct for the border effect.
+        Default: False
+    method : {'direct', 'fft', 'sparse'}, optional
+        Method used to compute the CCHs. `'direct'` and `'sparse'` require a
+        symmetric window.
+        Default: 'fft'
+
+    Returns
+    -------
+    cch : neo.AnalogSignal
+        Cross-correlation histograms. Each channel is the CCH of one row
+        pair.
+    lags : np.ndarray
+        Integer lags (in bins) of the CCH.
+    """
+    if method not in CCH_METHODS:
+        raise ValueError(f"Invalid method: {method}. Valid methods are: "
+                         f"{', '.join(CCH_METHODS)}")
+    _check_binned_spiketrains(binned_spiketrains_i, binned_spiketrains_j)
+    n_bins = binned_spiketrains_i.n_bins
+    _check_window(window, n_bins)
+
+    left_edge, right_edge = window
+    lags = np.arange(left_edge, right_edge + 1, dtype=np.int32)
+
+    # Elephant crops the result differently for asymmetric windows, which
+    # is only reproduced by the FFT method
+    if method != 'fft' and left_edge != -right_edge:
+        raise ValueError(f"The {method} method requires a symmetric window")
+
+    kernel = {'direct': _cross_correlation_direct,
+              'fft': _cross_correlation_fft,
+              'sparse': _cross_correlation_sparse}[method]
+    cross_corr = kernel(binned_spiketrains_i, binned_spiketrains_j,
+                        left_edge, right_edge)
+
+    if border_correction:
+        cross_corr = cross_corr * border_correction_factors(lags, n_bins)
+
+    cch = cch_to_analog_signal(cross_corr, lags, binned_spiketrains_i,
+                               window=window,
+                               border_correction=border_correction)
+    return cch, lags
+
+
+def select_cch_method(binned_spiketrains_i, binned_spiketrains_j, window,
+                      border_correction=False, methods=CCH_METHODS,
+                      repeats=3):
+    """
+    Selects the fastest method of `cross_correlation_histogram_batch` for a
+    sample of the data.
+
+    Each method is run `repeats` times with the sample, and the best time is
+    kept. Methods that do not support the window, or whose result is not
+    identical to the FFT method, are not considered. The decision and the
+    timings are logged.
+
+    Parameters
+    ----------
+    binned_spiketrains_i, binned_spiketrains_j :
+        elephant.conversion.BinnedSpikeTrain
+        Sample of the binned spike trains that will be correlated (e.g., the
+        surrogates of one pair of units in one trial).
+    window : list of int
+        Left and right edges of the window (in bins) where the CCH is
+        computed.
+    border_correction : bool, optional
+        Whether to correct for the border effect.
+        Default: False
+    methods : tuple of str, optional
+        Methods to compare.
+        Default: all the methods in `CCH_METHODS`
+    repeats : int, optional
+        Number of times each method is run.
+        Default: 3
+
+    Returns
+    -------
+    method : str
+        Fastest method.
+    timings : dict
+        Best time (in seconds) of each method considered.
+    """
+    def _compute(method):
+        cch, _ = cross_correlation_histogram_batch(
+            binned_spiketrains_i, binned_spiketrains_j, window=window,
+            border_correction=border_correction, method=method)
+        return cch.magnitude
+
+    reference = _compute('fft')
+    timings = {}
+    for method in methods:
+        try:
+            result = _compute(method)
+        except ValueError:
+            continue
+        if not np.array_equal(result, reference):
+            logging.warning(f"CCH method '{method}' ignored, as the result "
+                            f"differs from the FFT method")
+            continue
+        timings[method] = min(timeit.repeat(lambda: _compute(method),
+                                            number=1, repeat=repeats))
+
+    method = min(timings, key=timings.get)
+    timings_str = ", ".join(f"{name}: {time * 1000:.2f} ms"
+                            for name, time in timings.items())
+    logging.info(f"Selected CCH method '{method}' ({timings_str})")
+    return method, timings
@@ -0,0 +1,421 @@
+"""
+Parts of the CCH analysis scripts (`analyses/cchs/surrogate_*/
+compute_cchs.py`) that do not depend on the surrogate method: the command
+line arguments, the selection of the pairs of each session, the planning of
+the surrogate CCH computations, and the distribution of the pairs of all
+sessions to the processes.
+
+Alpaca only records the calls of tracked functions made directly by the
+function where tracking was activated, and attributes them to its source
+file. Therefore, the steps of the analysis (loading the data, generating
+the surrogates, and computing and plotting the CCHs) are still called by
+the scripts, and the functions in this module only prepare and schedule
+them.
+"""
+
+import itertools
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import quantities as pq
+
+from analysis_utils.backends import BACKENDS, get_backend
+from analysis_utils.cch import CCH_METHODS, select_cch_method
+from analysis_utils.checkpoint import completed_pairs, save_pair_result
+from analysis_utils.memory import (describe_memory_estimate,
+                                   estimate_cch_memory, format_memory_size,
+                                   parse_memory_size, peak_rss,
+                                   surrogate_chunk_size)
+from analysis_utils.sessions import (expand_session_files,
+                                     process_session_tasks)
+
+
+def add_cch_arguments(parser):
+    """
+    Adds the command line arguments shared by the CCH scripts to `parser`
+    (an `argparse.ArgumentParser`). The values are converted to the
+    arguments of the `main` function of the scripts with `cch_arguments`.
+    """
+    parser.add_argument('--output_path', type=str, required=True)
+    parser.add_argument('--bin_size', type=int, required=False, default=1)
+    parser.add_argument('--max_lag', type=int, required=False, default=200)
+    parser.add_argument('--n_surrogates', type=int, required=False,
+                        default=1000)
+    parser.add_argument('--surrogate_statistics', type=str, required=False,
+                        choices=['aggregate', 'streaming'],
+                        default='aggregate',
+                        help="'aggregate' stores the CCHs of all surrogates "
+                             "to compute their mean and SD; 'streaming' "
+                             "keeps only running sums and estimates")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip the pairs with results saved by a "
+                             "previous run with the same parameters")
+    parser.add_argument('--cch_method', type=str, required=False,
+                        choices=CCH_METHODS + ('auto',), default='fft',
+                        help="method to compute the surrogate CCHs: "
+                             "'direct' correlates each lag separately; "
+                             "'fft' uses FFTs of the full bin vectors; "
+                             "'sparse' uses only the bins with spikes; "
+                             "'auto' selects the fastest with a benchmark")
+    parser.add_argument('--symmetric', action='store_true',
+                        help="compute each unordered pair once, and derive "
+                             "the CCH of (j, i) by reversing the lags of "
+                             "(i, j)")
+    parser.add_argument('--backend', type=str, required=False,
+                        choices=BACKENDS, default='mpi',
+                        help="run with MPI processes (launched by "
+                             "`mpiexec`), a pool of local processes, or a "
+                             "single process")
+    parser.add_argument('--workers', type=int, required=False, default=None,
+                        help="number of processes of the pool backend "
+                             "(default: number of CPUs)")
+    parser.add_argument('--provenance_mode', type=str, required=False,
+                        choices=['per_call', 'batched'], default='batched',
+                        help="record the CCH computation of each trial as a "
+                             "separate execution, or the CCHs of all trials "
+                             "of a pair as one aggregate execution")
+    parser.add_argument('--merge_provenance', action='store_true',
+                        help="merge the provenance files of all processes "
+                             "into a single file per session")
+    parser.add_argument('--no_plots', action='store_true',
+                        help="only save the numeric results, to be plotted "
+                             "with `render_cchs.py`")
+    parser.add_argument('--surrogate_store', type=str, required=False,
+                        default=None,
+                        help="folder to store the generated surrogates, "
+                             "that are reused by any run or script with the "
+                             "same data, parameters and seed")
+    parser.add_argument('--memory_budget', type=str, required=False,
+                        default=None,
+                        help="peak memory allowed per process (e.g., '8G'). "
+                             "If the projected peak exceeds it, the "
+                             "surrogates of each pair are generated, and "
+                             "their CCHs computed, in chunks of surrogates")
+    parser.add_argument('--surrogate_chunk', type=int, required=False,
+                        default=None,
+                        help="generate the surrogates of each pair, and "
+                             "compute their CCHs, in chunks of this number "
+                             "of surrogates, instead of the size obtained "
+                             "from `--memory_budget`")
+    parser.add_argument('--estimate_memory', action='store_true',
+                        help="only log the projected memory, without "
+                             "computing the CCHs")
+    parser.add_argument('input', metavar='input', nargs='+',
+                        help="session files, or glob patterns matching "
+                             "them. The pairs of all sessions are processed "
+                             "by the same processes")
+    return parser
+
+
+def cch_arguments(args):
+    """
+    Converts the command line arguments added by `add_cch_arguments` to the
+    arguments of the `main` function of the CCH scripts, creating the
+    output folder.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments.
+
+    Returns
+    -------
+    dict
+        Keyword arguments of `main`.
+    """
+    output_dir = Path(args.output_path).expanduser().absolute()
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    memory_budget = None
+    if args.memory_budget is not None:
+        memory_budget = parse_memory_size(args.memory_budget)
+    surrogate_store_dir = None
+    if args.surrogate_store is not None:
+        surrogate_store_dir = \
+            Path(args.surrogate_store).expanduser().absolute()
+
+    return {'session_files': expand_session_files(args.input),
+            'output_dir': output_dir,
+            'bin_size': args.bin_size * pq.ms,
+            'max_lag': args.max_lag * pq.ms,
+            'n_surrogates': args.n_surrogates,
+            'surrogate_statistics': args.surrogate_statistics,
+            'resume': args.resume,
+            'symmetric': args.symmetric,
+            'cch_method': args.cch_method,
+            'backend': get_backend(args.backend, n_workers=args.workers),
+            'surrogate_store_dir': surrogate_store_dir,
+            'provenance_mode': args.provenance_mode,
+            'plot': not args.no_plots,
+            'merge_provenance': args.merge_provenance,
+            'memory_budget': memory_budget,
+            'surrogate_chunk': args.surrogate_chunk,
+            'estimate_only': args.estimate_memory}
+
+
+def session_folders(output_dir, session_name):
+    """
+    Creates the folder of a session in `output_dir`, named after the
+    session, and the folder where the results of each finished pair are
+    checkpointed, so that an interrupted run can be resumed.
+
+    Returns
+    -------
+    session_dir : Path
+    checkpoint_dir : Path
+    """
+    session_dir = output_dir / session_name
+    session_dir.mkdir(exist_ok=True)
+    checkpoint_dir = session_dir / "checkpoints"
+    checkpoint_dir.mkdir(exist_ok=True)
+    return session_dir, checkpoint_dir
+
+
+def select_pairs(unit_ids, symmetric=False):
+    """
+    Returns all ordered pairs of the units in `unit_ids`, and the pairs for
+    which the CCH is computed. If `symmetric` is True, only the pair (i, j)
+    is computed, and the results of (j, i) are derived from it.
+    """
+    all_pairs = list(itertools.permutations(unit_ids, 2))
+    if symmetric:
+        pairs = list(itertools.combinations(unit_ids, 2))
+    else:
+        pairs = all_pairs
+    return all_pairs, pairs
+
+
+def remaining_pairs(pairs, all_pairs, checkpoint_dir, checkpoint_parameters,
+                    symmetric=False):
+    """
+    Returns the pairs in `pairs` that were not finished by a previous run,
+    i.e., whose results (and the ones of the mirrored pair, if `symmetric`
+    is True) are not in `checkpoint_dir`. Checkpoints are only reused if
+    computed with the same `checkpoint_parameters`.
+    """
+    finished_pairs = completed_pairs(checkpoint_dir, all_pairs,
+                                     checkpoint_parameters)
+    pairs = [pair for pair in pairs
+             if pair not in finished_pairs or
+             (symmetric and pair[::-1] not in finished_pairs)]
+    logging.info(f"Resuming: {len(finished_pairs)} pairs "
+                 f"finished, {len(pairs)} pairs remaining")
+    return pairs
+
+
+def memory_parameters(suas, binned_suas, n_trials, n_surrogates, n_lags,
+                      surrogate_statistics, backend, n_pairs=None):
+    """
+    Returns the arguments of `analysis_utils.memory.estimate_cch_memory`
+    describing the data of a session. The memory used by the sessions
+    prepared before is part of the baseline.
+
+    Parameters
+    ----------
+    suas : TrialSpikeTrains
+        Spike trains of the selected units in each trial.
+    binned_suas : dict
+        Binned spike trains of each unit.
+    n_trials : int
+        Number of trials.
+    n_surrogates : int
+        Number of surrogates of each spike train.
+    n_lags : int
+        Number of lags on each side of the CCHs.
+    surrogate_statistics : {'aggregate', 'streaming'}
+        How the statistics of the surrogate CCHs are computed.
+    backend : SerialBackend or MPIBackend or ProcessPoolBackend
+        Backend used to run the analysis.
+    n_pairs : int, optional
+        Number of pairs of the session.
+        Default: None
+
+    Returns
+    -------
+    dict
+    """
+    spikes_per_trial = np.max(suas.spike_counts().mean(axis=1), initial=0)
+    n_bins = max((binned_sua.n_bins for binned_sua in binned_suas.values()),
+                 default=0)
+    return {'n_units': suas.n_units, 'n_trials': n_trials,
+            'n_bins': n_bins, 'n_surrogates': n_surrogates,
+            'n_cch_bins': 2 * n_lags + 1,
+            'spikes_per_trial': spikes_per_trial,
+            'surrogate_statistics': surrogate_statistics,
+            'n_processes': backend.size, 'n_pairs': n_pairs,
+            'baseline': peak_rss()}
+
+
+def plan_surrogate_chunk(parameters, surrogate_chunk=None,
+                         memory_budget=None):
+    """
+    Logs the projected peak memory of a process for a session. If it
+    exceeds `memory_budget`, returns the largest chunk of surrogates that
+    are generated, and whose CCHs are computed, at once for each pair
+    within the budget.
+
+    Parameters
+    ----------
+    parameters : dict
+        Arguments of `analysis_utils.memory.estimate_cch_memory` (see
+        `memory_parameters`).
+    surrogate_chunk : int, optional
+        Chunk of surrogates requested by the user, that is used instead.
+        Default: None
+    memory_budget : int, optional
+        Peak memory allowed per process, in bytes.
+        Default: None
+
+    Returns
+    -------
+    int or None
+        Number of surrogates per chunk, or None if the surrogates are
+        processed at once.
+
+    Raises
+    ------
+    ValueError
+        If the projected peak with `surrogate_chunk`, or with a single
+        surrogate per chunk, exceeds `memory_budget`.
+    """
+    memory_estimate = estimate_cch_memory(chunk_size=surrogate_chunk,
+                                          **parameters)
+    logging.info("Memory estimate:")
+    for line in describe_memory_estimate(memory_estimate):
+        logging.info(line)
+    if memory_budget is None or memory_estimate['peak'] <= memory_budget:
+        return surrogate_chunk
+    if surrogate_chunk is not None:
+        raise ValueError(
+            f"The projected peak with chunks of {surrogate_chunk} "
+            f"surrogates ({format_memory_size(memory_estimate['peak'])}) "
+            f"exceeds the memory budget "
+            f"({format_memory_size(memory_budget)})")
+    surrogate_chunk = surrogate_chunk_size(memory_budget, **parameters)
+    logging.info(f"The projected peak exceeds the memory budget "
+                 f"({format_memory_size(memory_budget)}). "
+                 f"Generating the surrogates of each pair, and computing "
+                 f"their CCHs, in chunks of {surrogate_chunk} surrogates")
+    return surrogate_chunk
+
+
+def process_units(unit_ids, pairs, backend):
+    """
+    Returns the units in `pairs` whose surrogates are generated by the
+    calling process. The units are split among all processes in the order
+    of `unit_ids`.
+    """
+    pair_units = set(itertools.chain.from_iterable(pairs))
+    units = [unit for unit in unit_ids if unit in pair_units]
+    return units[backend.rank::backend.size]
+
+
+def select_session_cch_method(cch_method, backend, pairs, cch_parameters,
+                              samples, sample_trial=None):
+    """
+    Returns the method used to compute the surrogate CCHs of a session.
+
+    If `cch_method` is 'auto', the fastest method is selected by rank 0
+    with a benchmark, and sent to all processes. The binned spike trains of
+    the units of the first pair in `samples` (a mapping from the unit id)
+    are used as sample, or the ones of the trial `sample_trial` if `samples`
+    has a list with the binned spike trains of each trial. Without pairs,
+    'fft' is used.
+    """
+    if cch_method != 'auto':
+        return cch_method
+
+    method = 'fft'
+    if backend.rank == 0 and pairs:
+        logging.info("Selecting CCH method")
+        sample_i, sample_j = (samples[unit] for unit in pairs[0])
+        if sample_trial is not None:
+            sample_i = sample_i[sample_trial]
+            sample_j = sample_j[sample_trial]
+        method, _ = select_cch_method(sample_i, sample_j, **cch_parameters)
+    return backend.bcast(method)
+
+
+def pair_computation_modes(provenance_mode, surrogate_statistics,
+                           surrogate_chunk=None):
+    """
+    Returns how the CCHs of the trials of a pair are computed.
+
+    In batched provenance mode, the CCHs of all trials are computed in a
+    single call, recorded as one execution. With streaming surrogate
+    statistics, the surrogate CCHs are still computed per trial, so that
+    only the CCHs of one trial are kept in memory. In chunked mode
+    (`surrogate_chunk` is not None), the surrogate CCHs are computed per
+    chunk of surrogates in all trials instead.
+
+    Returns
+    -------
+    per_trial_cchs : bool
+        Whether the CCH of each trial is computed by a separate call.
+    per_trial_surrogate_cchs : bool
+        Whether the surrogate CCHs of each trial are computed by a separate
+        call.
+    """
+    per_trial_cchs = provenance_mode != 'batched'
+    per_trial_surrogate_cchs = surrogate_chunk is None and \
+        (per_trial_cchs or surrogate_statistics == 'streaming')
+    return per_trial_cchs, per_trial_surrogate_cchs
+
+
+def surrogate_blocks(n_surrogates, surrogate_chunk):
+    """
+    Returns the slices selecting each chunk of `surrogate_chunk` surrogates
+    out of `n_surrogates`.
+    """
+    return [slice(first_surrogate, first_surrogate + surrogate_chunk)
+            for first_surrogate in range(0, n_surrogates, surrogate_chunk)]
+
+
+def save_pair_checkpoint(checkpoint_dir, unit_i, unit_j, parameters, cch,
+                         mean, sd):
+    """
+    Saves the CCH of the pair of units (i, j), and the mean and standard
+    deviation of its surrogate CCHs, as the checkpoint of the pair (see
+    `analysis_utils.checkpoint.save_pair_result`). The annotations of the
+    CCH are kept as JSON.
+    """
+    save_pair_result(checkpoint_dir, unit_i, unit_j, parameters,
+                     cch=cch.magnitude, mean=mean, sd=sd,
+                     annotations=json.dumps(cch.annotations, default=str))
+
+
+def run_session_pairs(backend, process_pairs, sessions,
+                      provenance_histories, **kwargs):
+    """
+    Computes the CCHs of the pairs of all sessions with the function
+    `process_pairs` of the script. The pairs are handed out on demand to
+    the available processes (see
+    `analysis_utils.sessions.process_session_tasks`).
+
+    Parameters
+    ----------
+    backend : SerialBackend or MPIBackend or ProcessPoolBackend
+        Backend used to run the analysis.
+    process_pairs : callable
+        Function that computes the CCHs of the pairs of a session. It takes
+        the pairs and the worker number, and the arguments of the session
+        and `kwargs`.
+    sessions : dict
+        Dictionary where the session name is the key and the value is a
+        dictionary with the pairs to compute (`pairs`) and the arguments of
+        `process_pairs` of the session (`arguments`).
+    provenance_histories : ProvenanceHistories
+        Provenance history of each session.
+    kwargs : dict
+        Arguments of `process_pairs` shared by all sessions.
+    """
+    tasks = [(session_name, pair)
+             for session_name, session in sessions.items()
+             for pair in session['pairs']]
+    backend.run(process_session_tasks, tasks,
+                process_function=process_pairs,
+                sessions={session_name: session['arguments']
+                          for session_name, session in sessions.items()},
+                provenance_histories=provenance_histories, **kwargs)
@@ -0,0 +1,66 @@
+"""
+Plotting of the cross-correlation histograms (CCHs) of a pair of units with
+the significance threshold obtained from their surrogates.
+
+Shared by the CCH scripts, that plot while computing, and by
+`render_cchs.py`, that plots from the saved numeric results.
+"""
+
+import quantities as pq
+
+import matplotlib.pyplot as plt
+from viziphant.spike_train_correlation import plot_cross_correlation_histogram
+
+
+def plot_cch_with_significance(cch, cch_mean, cch_sd,
+                               significance_threshold=3.0,
+                               max_lag=200 * pq.ms,
+                               title=None):
+    """
+    Plots a CCH together with the mean of the surrogate CCHs and the
+    significance threshold `cch_mean + significance_threshold * cch_sd`.
+
+    Parameters
+    ----------
+    cch : neo.AnalogSignal
+        CCH of the pair of units.
+    cch_mean : np.ndarray
+        Mean of the surrogate CCHs, with the same shape as `cch`.
+    cch_sd : np.ndarray
+        Standard deviation of the surrogate CCHs, with the same shape as
+        `cch`.
+    significance_threshold : float, optional
+        Number of standard deviations above the mean.
+        Default: 3.0
+    max_lag : pq.Quantity, optional
+        Maximum lag shown.
+        Default: 200 ms
+    title : str, optional
+        Title of the plot.
+        Default: None
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+    axes : matplotlib.axes.Axes
+    """
+    fig, axes = plt.subplots()
+
+    cch_threshold = cch_mean + significance_threshold * cch_sd
+
+    # Viziphant function expects each CCH to be a `neo.AnalogSignal`
+    # Duplicate using the original CCH to keep the annotations
+    cch_mean = cch.duplicate_with_new_data(cch_mean)
+    cch_threshold = cch.duplicate_with_new_data(cch_threshold)
+
+    kwargs = {}
+    if title is not None:
+        kwargs['title'] = title
+
+    axes = plot_cross_correlation_histogram(
+        [cch, cch_mean, cch_threshold], axes=axes, units='ms',
+        maxlag=max_lag,
+        legend=['Raw CCH', 'Mean surrogate CCH', 'Significance threshold'],
+        **kwargs)
+
+    return fig, axes
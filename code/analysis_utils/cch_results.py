@@ -0,0 +1,152 @@
+"""
+Storage of the numeric cross-correlation histogram results of a session.
+
+The aggregated CCH of every pair of units, together with the mean, standard
+deviation and significance threshold of the surrogate CCHs, are stored in a
+single NumPy `.npz` file. Each quantity is an array with shape
+`(n_pairs, n_bins)`, whose rows are indexed by the pair table `units` (with
+shape `(n_pairs, 2)`). The file also stores the bin size and maximum lag,
+and the annotations of the CCH objects, such that the CCHs can be plotted
+again (e.g., with a different significance threshold) without recomputing
+the surrogates.
+"""
+
+import json
+
+import numpy as np
+import quantities as pq
+
+from analysis_utils.checkpoint import load_pair_result, save_arrays_atomic
+
+
+CCH_RESULTS_FILE = "cch_results.npz"
+
+
+def significance_thresholds(means, sds, significance_threshold):
+    """
+    Returns the significance thresholds `mean + significance_threshold * SD`.
+    """
+    return means + significance_threshold * sds
+
+
+def collect_pair_results(checkpoint_dir, pairs, parameters):
+    """
+    Collects the checkpointed results of several pairs of units into arrays
+    with one row per pair.
+
+    The checkpoint of each pair must contain the arrays `cch`, `mean` and
+    `sd`, and may contain the annotations of the CCH object as a JSON string
+    (`annotations`).
+
+    Parameters
+    ----------
+    checkpoint_dir : str or Path-like
+        Folder where the checkpoints are stored.
+    pairs : list of tuple
+        Pairs of unit identifiers, in the order of the rows.
+    parameters : dict
+        Parameters expected for the results.
+
+    Returns
+    -------
+    cchs, means, sds : np.ndarray
+        Arrays with shape `(n_pairs, n_bins)` with the aggregated CCHs and
+        the mean and standard deviation of the surrogate CCHs.
+    annotations : dict
+        Annotations of the CCH of the first pair, that are the same for all
+        pairs. Empty if not saved in the checkpoints.
+
+    Raises
+    ------
+    ValueError
+        If the results of any pair are not available.
+    """
+    results = {'cch': [], 'mean': [], 'sd': []}
+    annotations = None
+    for unit_i, unit_j in pairs:
+        pair_result = load_pair_result(checkpoint_dir, unit_i, unit_j,
+                                       parameters)
+        if pair_result is None:
+            raise ValueError(f"No results for the pair ({unit_i}, {unit_j})")
+        for key, values in results.items():
+            values.append(np.ravel(pair_result[key]))
+        if annotations is None:
+            annotations = json.loads(str(pair_result.get('annotations',
+                                                         '{}')))
+    cchs, means, sds = (np.array(results[key], dtype=np.float64)
+                        for key in ('cch', 'mean', 'sd'))
+    return cchs, means, sds, annotations or {}
+
+
+def save_cch_results(file_name, pairs, cchs, means, sds, bin_size, max_lag,
+                     significance_threshold=3.0, annotations=None,
+                     parameters=None):
+    """
+    Saves the CCH results of all pairs of units of a session.
+
+    Parameters
+    ----------
+    file_name : str or Path-like
+        Destination file.
+    pairs : list of tuple
+        Pairs of unit identifiers, one for each row of the arrays.
+    cchs, means, sds : np.ndarray
+        Arrays with shape `(n_pairs, n_bins)` with the aggregated CCHs and
+        the mean and standard deviation of the surrogate CCHs.
+    bin_size, max_lag : pq.Quantity
+        Bin size and maximum lag of the CCHs.
+    significance_threshold : float, optional
+        Number of standard deviations above the mean of the surrogate CCHs
+        that defines the significance threshold.
+        Default: 3.0
+    annotations : dict, optional
+        Annotations of the CCH objects (e.g., the parameters of the CCH
+        function), used when plotting.
+        Default: None
+    parameters : dict, optional
+        Parameters used to compute the results.
+        Default: None
+    """
+    units = np.array(pairs, dtype=str).reshape(-1, 2)
+    if not (len(units) == len(cchs) == len(means) == len(sds)):
+        raise ValueError("The arrays must have one row per pair")
+
+    n_lags = (np.shape(cchs)[1] - 1) // 2
+    save_arrays_atomic(
+        file_name, units=units, lags=np.arange(-n_lags, n_lags + 1),
+        cch=cchs, mean=means, sd=sds,
+        threshold=significance_thresholds(means, sds,
+                                          significance_threshold),
+        significance_threshold=np.array(significance_threshold),
+        bin_size=np.array(bin_size.rescale(pq.ms).magnitude.item()),
+        max_lag=np.array(max_lag.rescale(pq.ms).magnitude.item()),
+        annotations=np.array(json.dumps(annotations or {}, default=str)),
+        parameters=np.array(json.dumps(parameters or {}, sort_keys=True,
+                                       default=str)))
+
+
+def load_cch_results(file_name):
+    """
+    Loads the CCH results saved by `save_cch_results`.
+
+    Returns
+    -------
+    dict
+        Dictionary with the pair table (`pairs`, list of tuple), the arrays
+        `lags`, `cch`, `mean`, `sd` and `threshold`, the
+        `significance_threshold`, the `bin_size` and `max_lag` (as
+        `pq.Quantity`), the `annotations` of the CCH objects, and the
+        `parameters` used to compute the results.
+    """
+    with np.load(file_name) as results_file:
+        results = {key: results_file[key] for key in results_file.files}
+
+    results['pairs'] = [tuple(pair) for pair in
+                        results.pop('units').tolist()]
+    results['significance_threshold'] = \
+        results['significance_threshold'].item()
+    results['bin_size'] = results['bin_size'].item() * pq.ms
+    results['max_lag'] = results['max_lag'].item() * pq.ms
+    results['annotations'] = json.loads(str(results['annotations']))
+    results['parameters'] = json.loads(str(results['parameters']))
+    return results
@@ -0,0 +1,154 @@
+"""
+Checkpointing of per-pair results, so that long analyses can be resumed
+after being interrupted.
+
+The results of each pair of units are stored in a separate NumPy `.npz`
+file, together with the parameters used to compute them. Files are written
+atomically: a checkpoint either contains the complete results, or does not
+exist.
+"""
+
+import json
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+
+PARAMETERS_KEY = '__parameters__'
+
+
+def _serialize_parameters(parameters):
+    # Parameters may contain objects such as `pq.Quantity`, that are stored
+    # with their string representation
+    return json.dumps(parameters, sort_keys=True, default=str)
+
+
+def save_arrays_atomic(file_name, **arrays):
+    """
+    Saves arrays into an uncompressed `.npz` file, such that the file is
+    never left partially written.
+
+    The data is written to a temporary file in the same folder, that
+    replaces `file_name` only after it was completely written to disk. The
+    file has the same format as `np.savez`, but the archive is closed even
+    if writing an array fails.
+
+    Parameters
+    ----------
+    file_name : str or Path-like
+        Destination file.
+    arrays : dict
+        Arrays to save. The keys are the names of the arrays in the file.
+    """
+    file_name = Path(file_name)
+    handle, temp_name = tempfile.mkstemp(dir=file_name.parent,
+                                         prefix=f".{file_name.name}.",
+                                         suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            with zipfile.ZipFile(temp_file, mode='w',
+                                 compression=zipfile.ZIP_STORED,
+                                 allowZip64=True) as archive:
+                for name, array in arrays.items():
+                    with archive.open(f"{name}.npy", mode='w',
+                                      force_zip64=True) as member:
+                        np.lib.format.write_array(member,
+                                                  np.asanyarray(array))
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
+def pair_checkpoint_file(checkpoint_dir, unit_i, unit_j):
+    """
+    Returns the name of the checkpoint file of a pair of units.
+    """
+    return Path(checkpoint_dir) / f"pair_{unit_i}_{unit_j}.npz"
+
+
+def save_pair_result(checkpoint_dir, unit_i, unit_j, parameters, **arrays):
+    """
+    Saves the results of a pair of units.
+
+    Parameters
+    ----------
+    checkpoint_dir : str or Path-like
+        Folder where the checkpoints are stored.
+    unit_i, unit_j : str
+        Identifiers of the units in the pair.
+    parameters : dict
+        Parameters used to compute the results. A checkpoint is only reused
+        if it was computed with the same parameters.
+    arrays : dict
+        Arrays with the results of the pair (e.g., the CCH and the mean and
+        standard deviation of the surrogate CCHs).
+    """
+    file_name = pair_checkpoint_file(checkpoint_dir, unit_i, unit_j)
+    arrays[PARAMETERS_KEY] = np.array(_serialize_parameters(parameters))
+    save_arrays_atomic(file_name, **arrays)
+
+
+def load_pair_result(checkpoint_dir, unit_i, unit_j, parameters):
+    """
+    Loads the results of a pair of units.
+
+    Parameters
+    ----------
+    checkpoint_dir : str or Path-like
+        Folder where the checkpoints are stored.
+    unit_i, unit_j : str
+        Identifiers of the units in the pair.
+    parameters : dict
+        Parameters expected for the results.
+
+    Returns
+    -------
+    dict or None
+        Dictionary with the arrays saved for the pair. None if there is no
+        checkpoint, if it cannot be read, or if it was computed with
+        different parameters.
+    """
+    file_name = pair_checkpoint_file(checkpoint_dir, unit_i, unit_j)
+    if not file_name.exists():
+        return None
+    try:
+        with np.load(file_name) as checkpoint:
+            arrays = {key: checkpoint[key] for key in checkpoint.files}
+    except (OSError, ValueError):
+        return None
+
+    saved_parameters = arrays.pop(PARAMETERS_KEY, None)
+    if saved_parameters is None or \
+            str(saved_parameters) != _serialize_parameters(parameters):
+        return None
+    return arrays
+
+
+def completed_pairs(checkpoint_dir, pairs, parameters):
+    """
+    Returns the pairs that have valid checkpoints.
+
+    Parameters
+    ----------
+    checkpoint_dir : str or Path-like
+        Folder where the checkpoints are stored.
+    pairs : list of tuple
+        Pairs of unit identifiers.
+    parameters : dict
+        Parameters expected for the results.
+
+    Returns
+    -------
+    set of tuple
+        Pairs in `pairs` whose results can be reused.
+    """
+    return {(unit_i, unit_j) for unit_i, unit_j in pairs
+            if load_pair_result(checkpoint_dir, unit_i, unit_j,
+                                parameters) is not None}
@@ -0,0 +1,409 @@
+"""
+Distribution of binned spike train data among MPI processes.
+
+Instead of broadcasting pickled `BinnedSpikeTrain` objects, the sparse
+matrices are packed into three flat NumPy buffers (bin counts, bin indices
+and row pointers), plus a small layout description. The buffers are placed
+in MPI-3 shared memory windows, so that a single copy exists per compute
+node, and are transferred between nodes with buffer-based broadcasts.
+Each process then rebuilds the `BinnedSpikeTrain` objects as lightweight
+objects whose sparse matrices are views of the shared buffers.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sps
+try:
+    from mpi4py import MPI
+except ImportError:
+    # MPI is only needed when running with multiple MPI processes
+    MPI = None
+
+from elephant.conversion import BinnedSpikeTrain
+
+
+# Names of the flat buffers with the data of the CSR matrices
+BUFFER_NAMES = ('data', 'indices', 'indptr')
+
+
+# Description of a single packed `BinnedSpikeTrain`. The offsets define
+# where its data starts in the flat buffers
+PackedBinnedSpikeTrain = namedtuple(
+    'PackedBinnedSpikeTrain',
+    ['shape', 't_start', 't_stop', 'bin_size', 'units', 'tolerance',
+     'has_sorted_indices', 'has_canonical_format', 'nnz_offset',
+     'indptr_offset'])
+
+
+def pack_binned_spiketrains(binned_spiketrains):
+    """
+    Packs the sparse matrices of `BinnedSpikeTrain` objects into flat
+    buffers.
+
+    Parameters
+    ----------
+    binned_spiketrains : dict or list or tuple
+        Structure containing `elephant.conversion.BinnedSpikeTrain` objects.
+        Dictionaries, lists and tuples can be nested.
+
+    Returns
+    -------
+    layout : dict or list or tuple
+        Structure equivalent to `binned_spiketrains`, where each
+        `BinnedSpikeTrain` is replaced by a `PackedBinnedSpikeTrain`
+        description. Dictionaries are converted to `dict`.
+    buffers : dict
+        Flat arrays with the concatenated data, indices and row pointers of
+        all the sparse matrices. The keys are the names in `BUFFER_NAMES`.
+    """
+    chunks = {name: [] for name in BUFFER_NAMES}
+    offsets = {'nnz': 0, 'indptr': 0}
+
+    def _pack(obj):
+        if isinstance(obj, BinnedSpikeTrain):
+            sparse_matrix = obj.sparse_matrix
+            packed = PackedBinnedSpikeTrain(
+                shape=sparse_matrix.shape, t_start=obj._t_start,
+                t_stop=obj._t_stop, bin_size=obj._bin_size,
+                units=obj.units, tolerance=obj.tolerance,
+                has_sorted_indices=sparse_matrix.has_sorted_indices,
+                has_canonical_format=sparse_matrix.has_canonical_format,
+                nnz_offset=offsets['nnz'],
+                indptr_offset=offsets['indptr'])
+            for name in BUFFER_NAMES:
+                chunks[name].append(getattr(sparse_matrix, name))
+            offsets['nnz'] += sparse_matrix.nnz
+            offsets['indptr'] += len(sparse_matrix.indptr)
+            return packed
+        if isinstance(obj, dict):
+            return {key: _pack(value) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(_pack(value) for value in obj)
+        raise TypeError(f"Cannot pack object of type {type(obj)}")
+
+    layout = _pack(binned_spiketrains)
+    buffers = {name: np.concatenate(arrays) if arrays else np.empty(0)
+               for name, arrays in chunks.items()}
+    return layout, buffers
+
+
+def unpack_binned_spiketrains(layout, buffers):
+    """
+    Rebuilds the `BinnedSpikeTrain` objects packed by
+    `pack_binned_spiketrains`.
+
+    The sparse matrices of the objects are views of `buffers`, therefore no
+    data is copied. The rebuilt objects have the same content as the
+    original ones.
+
+    Parameters
+    ----------
+    layout : dict or list or tuple
+        Layout returned by `pack_binned_spiketrains`.
+    buffers : dict
+        Flat arrays returned by `pack_binned_spiketrains`, or shared copies
+        of them.
+
+    Returns
+    -------
+    dict or list or tuple
+        Structure equivalent to `layout` with the `BinnedSpikeTrain`
+        objects.
+    """
+    def _unpack(obj):
+        if isinstance(obj, PackedBinnedSpikeTrain):
+            n_rows = obj.shape[0]
+            indptr = buffers['indptr'][
+                obj.indptr_offset:obj.indptr_offset + n_rows + 1]
+            nnz = indptr[-1] - indptr[0]
+            nnz_slice = slice(obj.nnz_offset, obj.nnz_offset + nnz)
+            data = buffers['data'][nnz_slice]
+            indices = buffers['indices'][nnz_slice]
+            sparse_matrix = sps.csr_matrix((data, indices, indptr),
+                                           shape=obj.shape, copy=False)
+
+            # SciPy copies small views of large arrays when creating the
+            # matrix. Restore the views to the buffers
+            sparse_matrix.data = data
+            sparse_matrix.indices = indices
+            sparse_matrix.has_sorted_indices = obj.has_sorted_indices
+            sparse_matrix.has_canonical_format = obj.has_canonical_format
+
+            # Create the object without binning again. The attributes are the
+            # same as set by `BinnedSpikeTrainView`, but the class is kept
+            binned_spiketrain = BinnedSpikeTrain.__new__(BinnedSpikeTrain)
+            binned_spiketrain.tolerance = obj.tolerance
+            binned_spiketrain._t_start = obj.t_start
+            binned_spiketrain._t_stop = obj.t_stop
+            binned_spiketrain.n_bins = obj.shape[1]
+            binned_spiketrain._bin_size = obj.bin_size
+            binned_spiketrain.units = obj.units.copy()
+            binned_spiketrain.sparse_matrix = sparse_matrix
+            return binned_spiketrain
+        if isinstance(obj, dict):
+            return {key: _unpack(value) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(_unpack(value) for value in obj)
+        raise TypeError(f"Invalid layout element of type {type(obj)}")
+
+    return _unpack(layout)
+
+
+def share_arrays(arrays, comm=None, root=0,
+                 use_shared_memory=True):
+    """
+    Makes NumPy arrays available in all processes of a communicator.
+
+    With shared memory, the arrays are stored in MPI-3 shared memory windows
+    allocated by one process in each compute node, and every process in the
+    node accesses the same memory. The data is transferred from `root` to
+    the other nodes with a buffer-based broadcast (no pickling). Without
+    shared memory, each process receives its own copy by a buffer-based
+    broadcast.
+
+    Arrays shared in memory must not be modified by the processes.
+
+    Parameters
+    ----------
+    arrays : dict or None
+        Dictionary with the one-dimensional arrays to share. Only used in
+        the process `root`, and can be None in the other processes.
+    comm : mpi4py.MPI.Comm, optional
+        Communicator of the processes that will access the arrays.
+        If None, `MPI.COMM_WORLD` is used.
+        Default: None
+    root : int, optional
+        Rank of the process that has the arrays.
+        Default: 0
+    use_shared_memory : bool, optional
+        If True, use shared memory windows inside each node.
+        Default: True
+
+    Returns
+    -------
+    shared : dict
+        Dictionary with the arrays in the calling process.
+    windows : list of mpi4py.MPI.Win
+        Shared memory windows that hold the arrays. They must be freed with
+        `free_shared_arrays` once the arrays are no longer used.
+    """
+    if comm is None:
+        comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    specs = None
+    if rank == root:
+        specs = {name: (array.dtype.str, array.size)
+                 for name, array in arrays.items()}
+    specs = comm.bcast(specs, root=root)
+
+    shared = {}
+    windows = []
+
+    if not use_shared_memory:
+        for name, (dtype, size) in specs.items():
+            array = arrays[name] if rank == root else \
+                np.empty(size, dtype=dtype)
+            comm.Bcast(array, root=root)
+            shared[name] = array
+        return shared, windows
+
+    # Group the processes by compute node. The process with the lowest rank
+    # in each node allocates the memory, and takes part in the broadcast
+    # between nodes. Ranks are ordered, so that `root` leads its node
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+    is_leader = node_comm.Get_rank() == 0
+    root_is_leader = comm.bcast(is_leader, root=root)
+    if not root_is_leader:
+        raise ValueError("The root process must have the lowest rank in "
+                         "its compute node")
+    leaders_comm = comm.Split(0 if is_leader else MPI.UNDEFINED, key=rank)
+    leaders_root = comm.bcast(
+        leaders_comm.Get_rank() if rank == root else None, root=root)
+
+    for name, (dtype, size) in specs.items():
+        dtype = np.dtype(dtype)
+        n_bytes = size * dtype.itemsize if is_leader else 0
+        window = MPI.Win.Allocate_shared(n_bytes, dtype.itemsize,
+                                         comm=node_comm)
+        buffer, _ = window.Shared_query(0)
+        array = np.ndarray(buffer=buffer, dtype=dtype, shape=(size,))
+
+        if is_leader:
+            if rank == root:
+                array[:] = arrays[name]
+            leaders_comm.Bcast(array, root=leaders_root)
+
+        shared[name] = array
+        windows.append(window)
+
+    # Wait until the data is in the memory of each node
+    node_comm.Barrier()
+
+    if leaders_comm != MPI.COMM_NULL:
+        leaders_comm.Free()
+    node_comm.Free()
+
+    return shared, windows
+
+
+def free_shared_arrays(windows):
+    """
+    Frees the shared memory windows created by `share_arrays`. This is a
+    collective operation, and all processes must call it.
+
+    Parameters
+    ----------
+    windows : list of mpi4py.MPI.Win
+        Windows returned by `share_arrays`.
+    """
+    for window in windows:
+        window.Free()
+
+
+def distribute_binned_spiketrains(binned_spiketrains, comm=None,
+                                  root=0, use_shared_memory=True):
+    """
+    Makes `BinnedSpikeTrain` objects available in all processes of a
+    communicator, without pickling their data.
+
+    The process `root` packs the objects into flat buffers, which are shared
+    among the processes with `share_arrays`. All processes, including
+    `root`, receive rebuilt objects whose data is stored in the shared
+    buffers.
+
+    Parameters
+    ----------
+    binned_spiketrains : dict or list or tuple or None
+        Structure containing `elephant.conversion.BinnedSpikeTrain` objects
+        (see `pack_binned_spiketrains`). Only used in the process `root`,
+        and can be None in the other processes.
+    comm : mpi4py.MPI.Comm, optional
+        Communicator of the processes that will access the objects.
+        If None, `MPI.COMM_WORLD` is used.
+        Default: None
+    root : int, optional
+        Rank of the process that has the objects.
+        Default: 0
+    use_shared_memory : bool, optional
+        If True, use shared memory windows inside each node.
+        Default: True
+
+    Returns
+    -------
+    binned_spiketrains : dict or list or tuple
+        Structure with the rebuilt `BinnedSpikeTrain` objects.
+    windows : list of mpi4py.MPI.Win
+        Shared memory windows that hold the data. They must be freed with
+        `free_shared_arrays` once the objects are no longer used.
+    """
+    if comm is None:
+        comm = MPI.COMM_WORLD
+    layout = buffers = None
+    if comm.Get_rank() == root:
+        layout, buffers = pack_binned_spiketrains(binned_spiketrains)
+    layout = comm.bcast(layout, root=root)
+    shared, windows = share_arrays(buffers, comm=comm, root=root,
+                                   use_shared_memory=use_shared_memory)
+    return unpack_binned_spiketrains(layout, shared), windows
+
+
+def _shift_layout(layout, nnz_shift, indptr_shift):
+    # Moves the offsets of all packed objects in `layout`
+    if isinstance(layout, PackedBinnedSpikeTrain):
+        return layout._replace(
+            nnz_offset=layout.nnz_offset + nnz_shift,
+            indptr_offset=layout.indptr_offset + indptr_shift)
+    if isinstance(layout, dict):
+        return {key: _shift_layout(value, nnz_shift, indptr_shift)
+                for key, value in layout.items()}
+    return type(layout)(_shift_layout(value, nnz_shift, indptr_shift)
+                        for value in layout)
+
+
+def allgather_binned_spiketrains(binned_spiketrains, comm=None,
+                                 root=0, use_shared_memory=True):
+    """
+    Collects the `BinnedSpikeTrain` objects computed by each process of a
+    communicator, and makes all of them available in every process.
+
+    Each process packs its objects into flat buffers, which are collected in
+    `root` with buffer-based gathers. The merged buffers are then shared
+    with `share_arrays`.
+
+    Parameters
+    ----------
+    binned_spiketrains : dict
+        Dictionary with the objects computed by the calling process (see
+        `pack_binned_spiketrains`). The keys must be unique across all
+        processes.
+    comm : mpi4py.MPI.Comm, optional
+        Communicator of the processes.
+        If None, `MPI.COMM_WORLD` is used.
+        Default: None
+    root : int, optional
+        Rank of the process that merges the data.
+        Default: 0
+    use_shared_memory : bool, optional
+        If True, use shared memory windows inside each node.
+        Default: True
+
+    Returns
+    -------
+    binned_spiketrains : dict
+        Dictionary with the rebuilt objects from all processes.
+    windows : list of mpi4py.MPI.Win
+        Shared memory windows that hold the data. They must be freed with
+        `free_shared_arrays` once the objects are no longer used.
+    """
+    if comm is None:
+        comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    layout, buffers = pack_binned_spiketrains(dict(binned_spiketrains))
+
+    # Agree on the type of each buffer, as processes without data have
+    # empty buffers of a default type
+    all_dtypes = comm.gather({name: buffer.dtype for name, buffer in
+                              buffers.items() if buffer.size}, root=root)
+    dtypes = None
+    if rank == root:
+        dtypes = {name: np.result_type(*[process_dtypes[name]
+                                         for process_dtypes in all_dtypes
+                                         if name in process_dtypes])
+                  for name in BUFFER_NAMES
+                  if any(name in process_dtypes
+                         for process_dtypes in all_dtypes)}
+    dtypes = comm.bcast(dtypes, root=root)
+    buffers = {name: buffer.astype(dtypes.get(name, buffer.dtype),
+                                   copy=False)
+               for name, buffer in buffers.items()}
+
+    # Merge the layouts in `root`, moving the offsets of each process after
+    # the data of the processes with lower rank
+    all_layouts = comm.gather(
+        (layout, {name: buffer.size for name, buffer in buffers.items()}),
+        root=root)
+
+    merged_layout = gathered = counts = None
+    if rank == root:
+        merged_layout = {}
+        counts = {name: [] for name in BUFFER_NAMES}
+        for process_layout, sizes in all_layouts:
+            nnz_shift = sum(counts['data'])
+            indptr_shift = sum(counts['indptr'])
+            merged_layout.update(
+                _shift_layout(process_layout, nnz_shift, indptr_shift))
+            for name in BUFFER_NAMES:
+                counts[name].append(sizes[name])
+        gathered = {name: np.empty(sum(counts[name]),
+                                   dtype=buffers[name].dtype)
+                    for name in BUFFER_NAMES}
+
+    for name in BUFFER_NAMES:
+        receive = [gathered[name], counts[name]] if rank == root else None
+        comm.Gatherv(buffers[name], receive, root=root)
+
+    merged_layout = comm.bcast(merged_layout, root=root)
+    shared, windows = share_arrays(gathered, comm=comm, root=root,
+                                   use_shared_memory=use_shared_memory)
+    return unpack_binned_spiketrains(merged_layout, shared), windows
@@ -0,0 +1,113 @@
+"""
+Interspike interval (ISI) histogram computations shared by the surrogate ISI
+histogram scripts.
+"""
+
+import numpy as np
+import quantities as pq
+
+
+def isi_histogram_edges(bin_size=5*pq.ms, max_time=200*pq.ms):
+    """
+    Returns the edges of the bins of an ISI histogram, starting at zero and
+    spaced by `bin_size` up to (but excluding) `max_time`.
+
+    Parameters
+    ----------
+    bin_size : pq.Quantity, optional
+        Width of the bins.
+        Default: 5 ms
+    max_time : pq.Quantity, optional
+        Upper bound of the edges.
+        Default: 200 ms
+
+    Returns
+    -------
+    np.ndarray
+        Edges in the units of `bin_size`.
+    """
+    upper_bound = max_time.rescale(bin_size.units).magnitude.item()
+    step = bin_size.magnitude.item()
+    return np.arange(0, upper_bound, step)
+
+
+def isi_histogram_batch(spiketrains, bin_size=5*pq.ms, max_time=200*pq.ms):
+    """
+    Computes the ISI histograms of several spike trains in a single
+    vectorized pass.
+
+    This is intended to compute the histograms of all surrogates of a spike
+    train at once. The spike times of all spike trains are concatenated into
+    a single buffer (with the number of spikes of each train as offsets),
+    the intervals are taken with one difference over the buffer, and the
+    intervals across the boundaries of the trains are discarded. The spike
+    times can also be given as an array with one spike train per row,
+    padded with NaN (e.g., as returned by
+    `analysis_utils.surrogates.dither_spike_times`), or as a list of its
+    rows. All intervals are then
+    counted with one `np.bincount`, offset by the row of their spike
+    train. The counts of each row are identical to those of
+    `np.histogram` with the edges of `isi_histogram_edges`, i.e., the last
+    bin includes its right edge and intervals beyond it are ignored.
+
+    Parameters
+    ----------
+    spiketrains : list of neo.SpikeTrain or pq.Quantity
+        Spike trains whose ISI histograms are computed, with sorted spike
+        times. If a 2D array, each row has the spike times of one spike
+        train, followed by NaN if it has fewer spikes than the others. The
+        elements of a list may be such rows.
+    bin_size : pq.Quantity, optional
+        Width of the bins.
+        Default: 5 ms
+    max_time : pq.Quantity, optional
+        Upper bound of the edges of the histograms.
+        Default: 200 ms
+
+    Returns
+    -------
+    counts : np.ndarray
+        Array of shape (number of spike trains, number of bins), where each
+        row is the histogram of one spike train.
+    edges : pq.Quantity
+        Edges of the bins, in the units of `bin_size`.
+    """
+    edges = isi_histogram_edges(bin_size, max_time)
+    n_bins = len(edges) - 1
+    n_rows = len(spiketrains)
+    if n_rows == 0:
+        raise ValueError("At least one spike train is required")
+
+    if isinstance(spiketrains, pq.Quantity) and spiketrains.ndim == 2:
+        # Intervals between consecutive spikes of each row, without the
+        # padding
+        units = spiketrains.units
+        isis = np.diff(spiketrains.magnitude, axis=1)
+        rows = np.repeat(np.arange(n_rows), isis.shape[1])
+        isis = isis.ravel()
+        within = ~np.isnan(isis)
+    else:
+        units = spiketrains[0].units
+        n_spikes = np.array([len(spiketrain) for spiketrain in spiketrains])
+        times = np.concatenate([spiketrain.rescale(units).magnitude
+                                for spiketrain in spiketrains])
+
+        # Intervals between consecutive spikes of the same spike train,
+        # without the padding
+        rows = np.repeat(np.arange(n_rows), n_spikes)
+        isis = np.diff(times)
+        within = (rows[1:] == rows[:-1]) & ~np.isnan(isis)
+        rows = rows[1:]
+
+    isis = pq.Quantity(isis[within], units)
+    isis = isis.rescale(bin_size.units).magnitude
+    rows = rows[within]
+
+    # Same bins as `np.histogram`, where the last bin is closed
+    bins = np.searchsorted(edges, isis, side='right') - 1
+    bins[isis == edges[-1]] = n_bins - 1
+    valid = (bins >= 0) & (bins < n_bins)
+
+    counts = np.bincount(rows[valid] * n_bins + bins[valid],
+                         minlength=n_rows * n_bins)
+    return counts.reshape(n_rows, n_bins), edges * bin_size.units
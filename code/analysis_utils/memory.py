@@ -0,0 +1,308 @@
+"""
+Estimation of the memory used by the surrogate CCH analyses.
+
+The binned surrogates grow as units x trials x surrogates, and the surrogate
+CCHs kept for the statistics of a pair as trials x surrogates x lags. Before
+the surrogates are generated, the peak memory of a process is projected from
+the size of the data, so that large sessions do not exhaust the memory of a
+node without warning.
+
+The peak is reached either while the CCHs are computed, or while the
+provenance is saved. Alpaca keeps a description of every surrogate spike
+train it tracks (including references to the binned data), and builds the
+RDF graph of all of them when saving. These parts do not depend on how the
+CCHs are computed.
+
+If the projection exceeds a memory budget, the surrogates of the units of
+each pair can be generated, and their CCHs computed, in blocks (chunks) of a
+fixed number of surrogates, whose CCHs are folded into running statistics.
+Then, only the surrogates of one block of a pair are kept, but the
+provenance of all surrogates is still recorded. The largest block that fits
+the budget is obtained with `surrogate_chunk_size`.
+
+The sizes are approximations, based on the layout of the objects used by the
+scripts (Neo spike trains, sparse `BinnedSpikeTrain` matrices, and the dense
+arrays of the FFT CCH method), and on the memory used by Alpaca for
+surrogate spike trains.
+"""
+
+import math
+import re
+import resource
+import sys
+
+
+# Approximate memory of a `neo.SpikeTrain` without its spike times (object,
+# quantities and annotations)
+SPIKETRAIN_OVERHEAD = 4096
+
+# Bytes per spike and per row of a `BinnedSpikeTrain` (32-bit bin counts,
+# indices and row pointers of its CSR matrix)
+BINNED_SPIKE_BYTES = 8
+BINNED_ROW_BYTES = 4
+
+# Bytes per bin and surrogate of the arrays used by the FFT CCH method
+# (dense 32-bit bin counts and 64-bit copies of both spike trains, and three
+# complex spectra)
+CCH_BIN_BYTES = 2 * 4 + 2 * 8 + 3 * 16
+
+# Bytes per surrogate spike train tracked by Alpaca, in the history kept
+# during the analysis, and while the provenance graph is serialized
+PROVENANCE_BYTES = 11 * 1024
+PROVENANCE_SERIALIZATION_BYTES = 120 * 1024
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# Components of an estimate that are used in each phase of the analysis
+_COMPUTATION = ('surrogate generation', 'CCH computation', 'surrogate CCHs')
+_SAVING = ('provenance serialization',)
+
+
+def parse_memory_size(size):
+    """
+    Converts a memory size, given as a number of bytes or with a binary
+    suffix (e.g., '512M', '8G' or '1.5GiB'), into bytes.
+
+    Parameters
+    ----------
+    size : str or int
+        Memory size.
+
+    Returns
+    -------
+    int
+        Number of bytes.
+
+    Raises
+    ------
+    ValueError
+        If `size` is not a valid memory size.
+    """
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([KMGT]?)(?:i?B)?\s*",
+                         str(size), flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid memory size: {size}")
+    value, unit = match.groups()
+    return int(float(value) * _UNITS[unit.upper()])
+
+
+def format_memory_size(n_bytes):
+    """
+    Returns a memory size in bytes as text with a binary unit (e.g.,
+    '1.5 GiB').
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(n_bytes) < 1024:
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} TiB"
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory of the calling process in bytes.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def estimate_cch_memory(n_units, n_trials, n_bins, n_surrogates, n_cch_bins,
+                        spikes_per_trial, surrogate_statistics='aggregate',
+                        n_processes=1, generation_trials=1,
+                        pair_generation=False, n_pairs=None,
+                        chunk_size=None, baseline=0):
+    """
+    Projects the peak memory of a process computing the surrogate CCHs of a
+    session.
+
+    Each process generates the surrogates of some units, that are tracked
+    by Alpaca, and the binned surrogates of all units are then shared with
+    all processes (with several processes, the peak of rank 0, that gathers
+    them, is projected). If `pair_generation` is True, each process instead
+    generates the surrogates of both units of each pair it processes, and
+    only keeps the ones of the pair (see
+    `analysis_utils.surrogate_provider`). The provenance of the surrogates
+    of each unit is recorded once by every process that uses them. If
+    `chunk_size` is given, the surrogates of each pair are generated in
+    blocks of `chunk_size` surrogates, as with `pair_generation`, and the
+    surrogate CCHs of each block are folded into running statistics.
+
+    Parameters
+    ----------
+    n_units : int
+        Number of units with surrogates.
+    n_trials : int
+        Number of trials.
+    n_bins : int
+        Number of bins of the spike train of a trial.
+    n_surrogates : int
+        Number of surrogates of each unit.
+    n_cch_bins : int
+        Number of lags of a CCH.
+    spikes_per_trial : float
+        Number of spikes of the spike train of a trial (e.g., the largest
+        mean across the units).
+    surrogate_statistics : {'aggregate', 'streaming'}, optional
+        Whether the surrogate CCHs of all trials are stored to compute their
+        statistics, or only running sums.
+        Default: 'aggregate'
+    n_processes : int, optional
+        Number of processes that generate the surrogates.
+        Default: 1
+    generation_trials : int, optional
+        Number of trials whose surrogates are generated by a single call,
+        before they are binned (e.g., all trials for trial shifting).
+        Default: 1
+    pair_generation : bool, optional
+        Whether the surrogates of the units of each pair are generated when
+        the pair is processed, instead of being shared by all processes.
+        Default: False
+    n_pairs : int, optional
+        Number of pairs, that are split evenly among the processes. With
+        `pair_generation`, this bounds the number of units used by a
+        process. If None, a process may use all units.
+        Default: None
+    chunk_size : int, optional
+        Number of surrogates generated, and whose CCHs are computed, at
+        once. If None, all surrogates are processed together.
+        Default: None
+    baseline : int, optional
+        Memory already used by the process (e.g., the interpreter and the
+        loaded data), in bytes.
+        Default: 0
+
+    Returns
+    -------
+    dict
+        Projected bytes of each component, of the phases in which the CCHs
+        are computed (`'computation peak'`) and the provenance is saved
+        (`'saving peak'`), and the largest of both (`'peak'`).
+    """
+    block = n_surrogates if chunk_size is None else \
+        min(chunk_size, n_surrogates)
+    if chunk_size is not None:
+        surrogate_statistics = 'streaming'
+        pair_generation = True
+
+    spiketrain_bytes = SPIKETRAIN_OVERHEAD + 8 * spikes_per_trial
+    binned_row_bytes = BINNED_ROW_BYTES + \
+        BINNED_SPIKE_BYTES * spikes_per_trial
+    if pair_generation:
+        # Units whose surrogates are tracked by the process: both units of
+        # each of its pairs, at most all units
+        tracked_units = n_units
+        if n_pairs is not None:
+            tracked_units = min(n_units,
+                                2 * math.ceil(n_pairs / n_processes))
+        binned_surrogates = 2 * n_trials * block
+        generated = block
+    else:
+        tracked_units = math.ceil(n_units / n_processes)
+        binned_surrogates = tracked_units * n_trials * n_surrogates
+        generated = n_surrogates
+    tracked = tracked_units * n_trials * n_surrogates
+    trial_cch_bytes = 8 * n_cch_bins * block
+
+    estimate = {'baseline': baseline}
+    estimate['spike trains'] = n_units * n_trials * (
+        spiketrain_bytes + binned_row_bytes)
+    estimate['binned surrogates'] = binned_surrogates * binned_row_bytes
+    if not pair_generation and n_processes > 1:
+        # Shared copy of the surrogates of all units, and buffer where rank
+        # 0 gathers them
+        estimate['shared surrogates'] = 2 * n_units * n_trials * \
+            n_surrogates * binned_row_bytes
+    estimate['provenance'] = tracked * PROVENANCE_BYTES
+    estimate['surrogate generation'] = generation_trials * generated * \
+        spiketrain_bytes
+    estimate['CCH computation'] = CCH_BIN_BYTES * n_bins * block
+    # The CCHs are stored for all trials and stacked for the aggregation,
+    # or summed into running totals
+    if surrogate_statistics == 'streaming':
+        estimate['surrogate CCHs'] = 2 * trial_cch_bytes
+    else:
+        estimate['surrogate CCHs'] = 2 * n_trials * trial_cch_bytes
+    estimate['provenance serialization'] = tracked * \
+        PROVENANCE_SERIALIZATION_BYTES
+
+    stored = sum(n_bytes for component, n_bytes in estimate.items()
+                 if component not in _COMPUTATION + _SAVING)
+    estimate['computation peak'] = stored + sum(
+        estimate[component] for component in _COMPUTATION)
+    estimate['saving peak'] = stored + sum(
+        estimate[component] for component in _SAVING)
+    estimate['peak'] = max(estimate['computation peak'],
+                           estimate['saving peak'])
+    return estimate
+
+
+def surrogate_chunk_size(memory_budget, n_surrogates, **parameters):
+    """
+    Returns the largest number of surrogates whose CCHs can be computed at
+    once within a memory budget.
+
+    Parameters
+    ----------
+    memory_budget : int
+        Peak memory allowed for a process, in bytes.
+    n_surrogates : int
+        Number of surrogates of each unit.
+    **parameters
+        Other parameters of `estimate_cch_memory`.
+
+    Returns
+    -------
+    int
+        Number of surrogates of each block, at most `n_surrogates`.
+
+    Raises
+    ------
+    ValueError
+        If the budget is exceeded with a single surrogate per block, e.g.,
+        by the provenance of the surrogates.
+    """
+    parameters.pop('chunk_size', None)
+    estimate_1 = estimate_cch_memory(n_surrogates=n_surrogates, chunk_size=1,
+                                     **parameters)
+    if estimate_1['peak'] > memory_budget:
+        largest = max((component for component in estimate_1
+                       if component != 'baseline' and
+                       not component.endswith('peak')),
+                      key=estimate_1.get)
+        raise ValueError(
+            f"The memory budget ({format_memory_size(memory_budget)}) is "
+            f"smaller than the projected peak with one surrogate per chunk "
+            f"({format_memory_size(estimate_1['peak'])}), mostly used by "
+            f"{largest} ({format_memory_size(estimate_1[largest])})")
+    if n_surrogates == 1:
+        return 1
+    # The memory used to compute the CCHs, and the surrogates kept while
+    # the provenance is saved, grow linearly with the size of the block
+    estimate_2 = estimate_cch_memory(n_surrogates=n_surrogates, chunk_size=2,
+                                     **parameters)
+    chunk_size = n_surrogates
+    for peak in ('computation peak', 'saving peak'):
+        per_surrogate = estimate_2[peak] - estimate_1[peak]
+        if per_surrogate > 0:
+            chunk_size = min(chunk_size, 1 + int(
+                (memory_budget - estimate_1[peak]) // per_surrogate))
+    return chunk_size
+
+
+def describe_memory_estimate(estimate):
+    """
+    Returns the lines of text describing the components and peaks of a
+    memory estimate (see `estimate_cch_memory`), e.g., to be logged.
+    """
+    lines = [f"  {component}: {format_memory_size(n_bytes)}"
+             for component, n_bytes in estimate.items()
+             if not component.endswith('peak')]
+    lines.append(f"Projected peak memory per process: "
+                 f"{format_memory_size(estimate['peak'])} (computing CCHs: "
+                 f"{format_memory_size(estimate['computation peak'])}, "
+                 f"saving provenance: "
+                 f"{format_memory_size(estimate['saving peak'])})")
+    return lines
@@ -0,0 +1,83 @@
+"""
+Distribution of independent tasks among MPI processes.
+"""
+
+try:
+    from mpi4py import MPI
+except ImportError:
+    # MPI is only needed when running with multiple MPI processes
+    MPI = None
+
+
+# Message tags used by the work queue
+TASK_REQUEST_TAG = 1
+TASK_ASSIGNMENT_TAG = 2
+
+# Index sent to a worker when there are no more tasks
+NO_MORE_TASKS = -1
+
+
+def _dispatch_tasks(n_tasks, comm):
+    # Sends the index of the next task to each worker that requests one,
+    # until all tasks were assigned and every worker was told to stop
+    n_workers = comm.Get_size() - 1
+    next_task = 0
+    status = MPI.Status()
+    while n_workers > 0:
+        comm.recv(source=MPI.ANY_SOURCE, tag=TASK_REQUEST_TAG, status=status)
+        worker = status.Get_source()
+        if next_task < n_tasks:
+            comm.send(next_task, dest=worker, tag=TASK_ASSIGNMENT_TAG)
+            next_task += 1
+        else:
+            comm.send(NO_MORE_TASKS, dest=worker, tag=TASK_ASSIGNMENT_TAG)
+            n_workers -= 1
+
+
+def mpi_work_queue(tasks, comm=None, root=0):
+    """
+    Distributes a sequence of tasks among the processes of an MPI
+    communicator, on demand.
+
+    The process `root` acts as a coordinator, and hands out the next task
+    whenever a worker process requests one. Therefore, any number of
+    processes can be used, and faster processes will take more tasks. If
+    the communicator has a single process, it executes all the tasks.
+
+    This is a generator that must be consumed by every process in `comm`.
+    `tasks` must be the same sequence in all processes, as only the task
+    indexes are communicated.
+
+    Parameters
+    ----------
+    tasks : sequence
+        Tasks to distribute.
+    comm : mpi4py.MPI.Comm, optional
+        Communicator of the processes that execute the tasks.
+        If None, `MPI.COMM_WORLD` is used.
+        Default: None
+    root : int, optional
+        Rank of the coordinator process.
+        Default: 0
+
+    Yields
+    ------
+    object
+        Each task assigned to the calling process.
+    """
+    if comm is None:
+        comm = MPI.COMM_WORLD
+    if comm.Get_size() == 1:
+        yield from tasks
+        return
+
+    if comm.Get_rank() == root:
+        _dispatch_tasks(len(tasks), comm)
+        return
+
+    while True:
+        comm.send(None, dest=root, tag=TASK_REQUEST_TAG)
+        task_idx = comm.recv(source=root, tag=TASK_ASSIGNMENT_TAG)
+        if task_idx == NO_MORE_TASKS:
+            break
+        yield tasks[task_idx]
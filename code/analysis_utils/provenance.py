@@ -0,0 +1,216 @@
+"""
+Helpers to reduce the amount of provenance captured for functions called in
+hot loops, and to separate the provenance of several sessions analysed by
+the same process.
+
+Alpaca records one function execution for every call of a tracked function.
+When a function is called for every element of a sequence (e.g., for every
+trial), this creates many nodes that inflate the memory used during the
+analysis, the time to save the provenance, and the size of the provenance
+files.
+
+With `batched_execution`, the loop is moved into a single function call, that
+is tracked as one aggregate execution. Its inputs and outputs are
+collections with the elements of each call, and its parameters are the ones
+shared by all calls, together with the number of calls (`n_calls`) and the
+name of the function executed (`batched_function`). The aggregate function
+can be annotated with the same NEAO step class as the original function.
+
+Alpaca also records all the executions of a process in a single history,
+that is saved to one file. When a run analyses several sessions, the
+executions are recorded in a separate history for each session with
+`ProvenanceHistories`, such that each session has its own provenance files.
+
+Objects that are computed again, after their provenance was recorded (e.g.,
+surrogates regenerated for each pair that uses them), are recomputed inside
+`suspended_tracking`, so that the same executions are not recorded again.
+The objects are identified by the hash of their contents, and therefore the
+recomputed objects are linked to the recorded executions.
+
+Each process of a run saves the provenance it captured for a session to its
+own file in the session folder (`save_provenance_file`), and the files of
+all processes are merged into the file of the main process at the end of
+the run (`merge_run_provenance`).
+"""
+
+import contextlib
+import inspect
+import logging
+
+from alpaca import Provenance, save_provenance
+from alpaca.utils import get_file_name
+
+from analysis_utils.provenance_merge import merge_process_provenance
+
+
+def batched_execution(function, batched_arguments, output=None):
+    """
+    Creates a function that calls `function` once for each element of the
+    sequences passed to the arguments in `batched_arguments`.
+
+    The returned function has the same arguments as `function`, where the
+    arguments in `batched_arguments` take sequences with one element per
+    call, and the other arguments are passed unchanged to all calls. The
+    number of calls must be passed with the keyword-only argument `n_calls`.
+
+    Parameters
+    ----------
+    function : callable
+        Function to execute.
+    batched_arguments : list of str
+        Names of the arguments of `function` that change in each call.
+    output : int, optional
+        If `function` returns a tuple, the index of the element that is kept
+        from each call. If None, the full result of each call is kept.
+        Default: None
+
+    Returns
+    -------
+    callable
+        Function that returns a list with the results of each call. Its name
+        is the name of `function` prefixed by `batched_`.
+
+    Raises
+    ------
+    ValueError
+        If `batched_arguments` are not arguments of `function`.
+        If the sequences passed to the returned function do not have
+        `n_calls` elements.
+    """
+    signature = inspect.signature(function)
+    invalid_arguments = set(batched_arguments) - set(signature.parameters)
+    if invalid_arguments:
+        raise ValueError(f"Arguments not defined by {function.__name__}: "
+                         f"{', '.join(sorted(invalid_arguments))}")
+    function_name = f"{function.__module__}.{function.__qualname__}"
+
+    def batched_function(*args, n_calls, batched_function=function_name,
+                         **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        for name in batched_arguments:
+            if len(arguments.arguments[name]) != n_calls:
+                raise ValueError(f"'{name}' must have {n_calls} elements")
+
+        results = []
+        for call in range(n_calls):
+            call_arguments = arguments.arguments.copy()
+            for name in batched_arguments:
+                call_arguments[name] = arguments.arguments[name][call]
+            call_arguments = inspect.BoundArguments(signature,
+                                                    call_arguments)
+            result = function(*call_arguments.args, **call_arguments.kwargs)
+            results.append(result if output is None else result[output])
+        return results
+
+    # Expose the arguments of `function`, followed by the ones of the
+    # aggregate execution, so that they are captured as parameters
+    parameters = list(signature.parameters.values())
+    position = len(parameters)
+    if parameters and parameters[-1].kind == inspect.Parameter.VAR_KEYWORD:
+        position -= 1
+    parameters[position:position] = [
+        inspect.Parameter('n_calls', inspect.Parameter.KEYWORD_ONLY),
+        inspect.Parameter('batched_function', inspect.Parameter.KEYWORD_ONLY,
+                          default=function_name)]
+    batched_function.__signature__ = signature.replace(
+        parameters=parameters, return_annotation=inspect.Signature.empty)
+    batched_function.__name__ = f"batched_{function.__name__}"
+    batched_function.__qualname__ = batched_function.__name__
+    batched_function.__doc__ = (f"Calls `{function_name}` for each element "
+                                f"of the arguments "
+                                f"{', '.join(batched_arguments)}.")
+    return batched_function
+
+
+@contextlib.contextmanager
+def suspended_tracking(suspend=True):
+    """
+    Context manager where the calls of tracked functions are not recorded,
+    if `suspend` is True. Tracking is restored when the block exits.
+    """
+    active = Provenance.active
+    if suspend:
+        Provenance.active = False
+    try:
+        yield
+    finally:
+        Provenance.active = active
+
+
+class ProvenanceHistories:
+    """
+    Separate Alpaca histories for the analyses (e.g., sessions) run by a
+    process.
+
+    After `switch` is called with the key of an analysis, the executions of
+    the tracked functions are added to the history of that analysis, until
+    another one is selected. The provenance saved with
+    `alpaca.save_provenance` is the one of the selected analysis.
+    """
+
+    def __init__(self):
+        self._histories = {}
+
+    def switch(self, key):
+        """
+        Selects the history of the analysis `key`, that is created if it
+        does not exist yet.
+        """
+        Provenance.history = self._histories.setdefault(key, [])
+
+    def discard(self, key):
+        """
+        Removes the history of the analysis `key` (e.g., after it was
+        saved), releasing the objects it refers to. If it is selected, the
+        executions that follow are added to a new history.
+        """
+        history = self._histories.pop(key, None)
+        if history is not None and history is Provenance.history:
+            Provenance.history = []
+
+
+def get_provenance_file(script_file, session_dir, process_id,
+                        resume_id=None):
+    """
+    Returns the name of the Turtle file in `session_dir` with the provenance
+    captured in a process by the script `script_file`. The files of
+    processes other than the main one (`process_id == 0`) have the process
+    number as suffix. The provenance of a resumed run is saved to new files,
+    identified by `resume_id`, to keep the records of the previous runs.
+    """
+    prov_file_suffix = f"_{process_id}" if process_id > 0 else ""
+    if resume_id is not None:
+        prov_file_suffix = f"_resume_{resume_id}{prov_file_suffix}"
+    prov_file_suffix = prov_file_suffix or None
+    return get_file_name(script_file, output_dir=session_dir,
+                         extension="ttl", suffix=prov_file_suffix)
+
+
+def save_provenance_file(script_file, session_dir, process_id,
+                         resume_id=None):
+    """
+    Saves the provenance captured in the current process as a Turtle file
+    in `session_dir` (see `get_provenance_file`).
+    """
+    prov_file = get_provenance_file(script_file, session_dir, process_id,
+                                    resume_id)
+
+    logging.info(f"Saving provenance to {prov_file}")
+
+    save_provenance(prov_file, file_format="ttl", show_progress=True)
+
+
+def merge_run_provenance(script_file, session_dir, backend, resume_id=None):
+    """
+    Merges the provenance files saved by all processes of the run into the
+    file of the main process, removing duplicated nodes and triples (e.g.,
+    the data shared by all processes). The files of the other processes are
+    removed.
+    """
+    prov_file = get_provenance_file(script_file, session_dir, 0, resume_id)
+    if backend.rank == 0:
+        logging.info(f"Merging provenance of all processes to {prov_file}")
+
+    merge_process_provenance(
+        backend, lambda process_id: get_provenance_file(
+            script_file, session_dir, process_id, resume_id), prov_file)
@@ -0,0 +1,306 @@
+"""
+Merge of the provenance files saved by the processes of a parallel analysis.
+
+Each process of an analysis (e.g., each MPI rank or pool worker) saves the
+provenance it captured to its own Turtle file. The files overlap, as the
+entities shared by all processes (e.g., the loaded data, or the binned
+surrogates broadcast by rank 0) are described in each of them. The merge
+reads the files in parallel, and writes a single file with the union of
+the graphs, where each triple is stored only once.
+
+The triples read from each file are saved to a temporary file next to it,
+instead of being sent to the merging process. The merging process adds them
+to the union one file at a time, and removes each temporary file once it
+is added. Therefore, its memory holds the union and the triples of a single
+file, instead of the triples of all files.
+
+Alpaca describes the attributes and annotations of an entity with blank
+nodes, that have different identifiers in each file. Before the union, each
+blank node is renamed by a hash of its parent nodes and its content, such
+that identical blank nodes from different files are also merged.
+"""
+
+import concurrent.futures
+import hashlib
+import multiprocessing
+import pickle
+from pathlib import Path
+
+from rdflib import BNode, Graph
+
+
+def _bnode_content(graph, node, visited):
+    # Describes the triples of a blank node, including the ones of any
+    # blank node nested in it
+    content = []
+    for predicate, obj in graph.predicate_objects(node):
+        if isinstance(obj, BNode):
+            obj = ("[]" if obj in visited else
+                   _bnode_content(graph, obj, visited | {obj}))
+        else:
+            obj = obj.n3()
+        content.append(f"{predicate.n3()} {obj}")
+    return "[" + " ; ".join(sorted(content)) + "]"
+
+
+def _bnode_identifier(graph, node, identifiers, descendants=frozenset()):
+    # Hashes the parents and the content of a blank node. A parent that is
+    # also a blank node is described by its own identifier, such that
+    # nested blank nodes with the same content under different parents are
+    # kept separate. `descendants` are the blank nodes whose identifier is
+    # being computed, to stop at cycles
+    if node in identifiers:
+        return identifiers[node]
+    descendants = descendants | {node}
+    parents = []
+    for subject, predicate in graph.subject_predicates(node):
+        if isinstance(subject, BNode):
+            subject = ("[]" if subject in descendants else "_:" +
+                       _bnode_identifier(graph, subject, identifiers,
+                                         descendants))
+        else:
+            subject = subject.n3()
+        parents.append(f"{subject} {predicate.n3()}")
+    parents.sort()
+    description = "\n".join(parents + [_bnode_content(graph, node, {node})])
+    identifiers[node] = hashlib.sha1(description.encode()).hexdigest()
+    return identifiers[node]
+
+
+def canonical_triples(file_name, file_format='turtle'):
+    """
+    Reads the provenance graph in `file_name`, renaming the blank nodes by
+    a hash of their parent nodes and content.
+
+    Parameters
+    ----------
+    file_name : str or Path-like
+        Provenance file.
+    file_format : str, optional
+        RDF format of the file.
+        Default: 'turtle'
+
+    Returns
+    -------
+    namespaces : list of tuple
+        Prefixes and namespaces bound in the file.
+    triples : set of tuple
+        Triples of the graph.
+    """
+    graph = Graph()
+    graph.parse(file_name, format=file_format)
+
+    bnodes = {node for node in graph.all_nodes() if isinstance(node, BNode)}
+    identifiers = {}
+    renamed = {node: BNode(_bnode_identifier(graph, node, identifiers))
+               for node in bnodes}
+
+    triples = {tuple(renamed.get(node, node) for node in triple)
+               for triple in graph}
+    namespaces = [(prefix, str(namespace))
+                  for prefix, namespace in graph.namespaces()]
+    return namespaces, triples
+
+
+def save_canonical_triples(file_name, file_format='turtle'):
+    """
+    Reads the provenance graph in `file_name` with `canonical_triples`, and
+    saves the result to a temporary file next to it, to be added to a
+    merged graph by `load_canonical_triples`.
+
+    Parameters
+    ----------
+    file_name : str or Path-like
+        Provenance file.
+    file_format : str, optional
+        RDF format of the file.
+        Default: 'turtle'
+
+    Returns
+    -------
+    Path
+        Name of the temporary file.
+    """
+    file_name = Path(file_name)
+    canonical_file = file_name.with_name(file_name.name + ".canonical")
+    with open(canonical_file, 'wb') as canonical:
+        pickle.dump(canonical_triples(file_name, file_format), canonical,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    return canonical_file
+
+
+def load_canonical_triples(canonical_files):
+    """
+    Reads the files saved by `save_canonical_triples` one at a time, and
+    removes each file after reading it. The remaining files are also
+    removed if the iteration stops early.
+
+    Parameters
+    ----------
+    canonical_files : list of Path-like
+        Temporary files.
+
+    Yields
+    ------
+    tuple
+        Namespaces and triples of each graph.
+    """
+    canonical_files = [Path(file_name) for file_name in canonical_files]
+    try:
+        for canonical_file in canonical_files:
+            with open(canonical_file, 'rb') as canonical:
+                graph = pickle.load(canonical)
+            canonical_file.unlink()
+            yield graph
+    finally:
+        remove_files(canonical_files)
+
+
+def save_merged_provenance(graphs, output_file, file_format='turtle'):
+    """
+    Saves the union of several provenance graphs.
+
+    The graphs are added to the union one at a time, such that only the
+    current one needs to be in memory if `graphs` is an iterator.
+
+    Parameters
+    ----------
+    graphs : iterable of tuple
+        Namespaces and triples of each graph, as returned by
+        `canonical_triples`.
+    output_file : str or Path-like
+        Destination file.
+    file_format : str, optional
+        RDF format of the file.
+        Default: 'turtle'
+
+    Returns
+    -------
+    int
+        Number of triples in the merged graph.
+    """
+    merged = Graph()
+    for namespaces, triples in graphs:
+        for prefix, namespace in namespaces:
+            merged.bind(prefix, namespace, override=False)
+        for triple in triples:
+            merged.add(triple)
+
+    # Write to a temporary file first, as the destination may be one of
+    # the merged files
+    output_file = Path(output_file)
+    temp_file = output_file.with_name(output_file.name + ".tmp")
+    merged.serialize(temp_file, format=file_format)
+    temp_file.replace(output_file)
+    return len(merged)
+
+
+def merge_provenance_files(file_names, output_file, n_workers=None,
+                           remove_inputs=False, file_format='turtle'):
+    """
+    Merges several provenance files into a single file.
+
+    The files are read in parallel by a pool of local processes, and
+    added to the merged graph one at a time.
+
+    Parameters
+    ----------
+    file_names : list of str or Path-like
+        Provenance files to merge.
+    output_file : str or Path-like
+        Destination file. It can be one of the files in `file_names`.
+    n_workers : int, optional
+        Number of processes that read the files. If None, the number of
+        CPUs is used.
+        Default: None
+    remove_inputs : bool, optional
+        If True, the files in `file_names` are removed after the merged
+        file is saved.
+        Default: False
+    file_format : str, optional
+        RDF format of the files.
+        Default: 'turtle'
+
+    Returns
+    -------
+    int
+        Number of triples in the merged graph.
+    """
+    file_names = [Path(file_name) for file_name in file_names]
+    n_workers = min(n_workers or multiprocessing.cpu_count(),
+                    len(file_names))
+
+    if n_workers > 1:
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers, mp_context=context) as executor:
+            canonical_files = list(executor.map(
+                save_canonical_triples, file_names,
+                [file_format] * len(file_names)))
+        graphs = load_canonical_triples(canonical_files)
+    else:
+        graphs = (canonical_triples(file_name, file_format)
+                  for file_name in file_names)
+
+    n_triples = save_merged_provenance(graphs, output_file, file_format)
+
+    if remove_inputs:
+        remove_files(file_names, keep=output_file)
+    return n_triples
+
+
+def merge_process_provenance(backend, process_file, output_file,
+                             file_format='turtle'):
+    """
+    Merges the provenance files saved by the processes of an analysis run
+    with an execution backend (see `analysis_utils.backends`), and removes
+    the files of the single processes.
+
+    This must be called by every process of the backend, after each one
+    saved its provenance. With MPI, each rank reads its own file, and rank
+    0 adds them to the merged graph one rank at a time and saves it.
+    Otherwise, the files of the calling process and of the pool workers
+    are read by a pool of local processes.
+
+    Parameters
+    ----------
+    backend : SerialBackend or MPIBackend or ProcessPoolBackend
+        Backend used to run the analysis.
+    process_file : callable
+        Function that returns the name of the provenance file saved by a
+        process, given the process number (the MPI rank, or 0 for the
+        calling process and the worker number for the pool workers).
+    output_file : str or Path-like
+        Destination file. It can be the file of one of the processes.
+    file_format : str, optional
+        RDF format of the files.
+        Default: 'turtle'
+    """
+    if backend.name == 'mpi':
+        rank_file = process_file(backend.rank)
+        canonical_files = backend.gather(
+            save_canonical_triples(rank_file, file_format))
+        rank_files = backend.gather(rank_file)
+        if backend.rank == 0:
+            save_merged_provenance(load_canonical_triples(canonical_files),
+                                   output_file, file_format)
+            remove_files(rank_files, keep=output_file)
+        return
+
+    file_names = [process_file(process_id)
+                  for process_id in (0,) + tuple(backend.worker_ids)]
+    file_names = [file_name for file_name in file_names
+                  if Path(file_name).exists()]
+    merge_provenance_files(file_names, output_file,
+                           n_workers=len(backend.worker_ids) or 1,
+                           remove_inputs=True, file_format=file_format)
+
+
+def remove_files(file_names, keep=None):
+    """
+    Removes the files in `file_names`, except `keep`.
+    """
+    keep = Path(keep).absolute() if keep is not None else None
+    for file_name in file_names:
+        if Path(file_name).absolute() != keep:
+            Path(file_name).unlink(missing_ok=True)
@@ -0,0 +1,158 @@
+"""
+Derivation of random seeds for reproducible parallel computations.
+
+Seeds are derived from a base seed and a set of keys identifying a unit of
+work (e.g., the unit ID, trial and surrogate number, or the index of a
+generated spike train). Each unit of work uses an independent child of the
+`np.random.SeedSequence` of the base seed. Therefore, the random numbers
+used in each unit of work do not depend on the order of execution, or on how
+the work is distributed among processes.
+
+`RandomStreams` seeds the global generators used by the Elephant functions
+for each unit of work. It also supports the sequential seeding of the
+original analysis scripts, where the generators are seeded once and the
+results depend on the order of all calls.
+"""
+
+import hashlib
+import random
+
+import numpy as np
+
+
+def _key_to_int(key):
+    # Converts a key into a non-negative integer that can be used as
+    # entropy by `np.random.SeedSequence`
+    if isinstance(key, (int, np.integer)):
+        if key < 0:
+            raise ValueError(f"Integer keys must be non-negative: {key}")
+        return int(key)
+    if isinstance(key, str):
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], byteorder='little')
+    raise TypeError(f"Keys must be integers or strings, not {type(key)}")
+
+
+SEEDING_MODES = ('sequential', 'keyed')
+
+
+def seed_sequence(base_seed, *keys):
+    """
+    Returns the child of the `np.random.SeedSequence` of `base_seed`
+    identified by a sequence of keys.
+
+    Parameters
+    ----------
+    base_seed : int
+        Seed of the analysis.
+    keys : int or str
+        Keys identifying the unit of work (e.g., unit ID and trial number).
+
+    Returns
+    -------
+    np.random.SeedSequence
+    """
+    spawn_key = tuple(_key_to_int(key) for key in keys)
+    return np.random.SeedSequence(_key_to_int(base_seed),
+                                  spawn_key=spawn_key)
+
+
+def derive_seed(base_seed, *keys):
+    """
+    Derives a 32-bit seed from a base seed and a sequence of keys.
+
+    The same base seed and keys always produce the same seed, and different
+    keys produce independent seeds.
+
+    Parameters
+    ----------
+    base_seed : int
+        Seed of the analysis.
+    keys : int or str
+        Keys identifying the unit of work (e.g., unit ID and trial number).
+
+    Returns
+    -------
+    int
+        The derived seed.
+    """
+    return int(seed_sequence(base_seed, *keys).generate_state(1)[0])
+
+
+def seed_global_generators(seed):
+    """
+    Seeds the global random number generators of the `random` module and of
+    NumPy, which are used by the Elephant functions.
+
+    Parameters
+    ----------
+    seed : int
+        The seed.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+class RandomStreams:
+    """
+    Seeds the random number generators of an analysis.
+
+    In `keyed` mode, the global generators are seeded before each unit of
+    work (`seed`), with a seed derived from the base seed and the keys that
+    identify the unit of work. The results are the same for any execution
+    order, and for serial, process pool or MPI execution. As the global
+    generators are shared by all threads, threaded code must use
+    independent generators instead (`generator`).
+
+    In `sequential` mode, the global generators are seeded once with the
+    base seed (`start`), and `seed` has no effect. This reproduces the
+    results of the original scripts, but only if all units of work are
+    executed in the same order by a single process.
+
+    Parameters
+    ----------
+    base_seed : int
+        Seed of the analysis.
+    mode : {'keyed', 'sequential'}, optional
+        Seeding mode.
+        Default: 'keyed'
+
+    Raises
+    ------
+    ValueError
+        If `mode` is not valid.
+    """
+
+    def __init__(self, base_seed, mode='keyed'):
+        if mode not in SEEDING_MODES:
+            raise ValueError(f"Invalid seeding mode: {mode}. Valid modes "
+                             f"are: {', '.join(SEEDING_MODES)}")
+        self.base_seed = base_seed
+        self.mode = mode
+
+    @property
+    def keyed(self):
+        return self.mode == 'keyed'
+
+    def start(self):
+        """
+        Seeds the global generators with the base seed, in `sequential`
+        mode. This must be called once, before any unit of work.
+        """
+        if not self.keyed:
+            seed_global_generators(self.base_seed)
+
+    def seed(self, *keys):
+        """
+        Seeds the global generators for the unit of work identified by
+        `keys`, in `keyed` mode.
+        """
+        if self.keyed:
+            seed_global_generators(derive_seed(self.base_seed, *keys))
+
+    def generator(self, *keys):
+        """
+        Returns an independent `np.random.Generator` for the unit of work
+        identified by `keys`, that does not use the global state.
+        """
+        return np.random.default_rng(seed_sequence(self.base_seed, *keys))
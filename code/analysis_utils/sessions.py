@@ -0,0 +1,112 @@
+"""
+Selection of the session files processed by an analysis script.
+
+The scripts take one or more session files, that are processed by a single
+run. Each input is either the path to a file, or a glob pattern (e.g.,
+`data/*_no_raw.nix`). The patterns are expanded by the script, so that they
+can also be passed quoted, e.g., by a job scheduler.
+
+The units or pairs of all sessions are distributed to the processes of the
+run as tasks, that are grouped by session when a process computes them
+(`process_session_tasks`).
+"""
+
+import glob
+import itertools
+import os
+import re
+from pathlib import Path
+
+
+def expand_session_files(inputs):
+    """
+    Returns the session files given by paths or glob patterns.
+
+    Parameters
+    ----------
+    inputs : list of str or Path-like
+        Paths to the session files, or glob patterns matching them.
+
+    Returns
+    -------
+    list of Path
+        Absolute paths to the session files, in the order of `inputs`, where
+        the files matched by each pattern are sorted. Files given more than
+        once are only included the first time.
+
+    Raises
+    ------
+    FileNotFoundError
+        If a pattern does not match any file.
+    """
+    session_files = []
+    for pattern in inputs:
+        pattern = str(Path(pattern).expanduser())
+        if glob.escape(pattern) == pattern:
+            # Not a pattern. A missing file is reported when it is read
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError(f"No session files match: {pattern}")
+        for match in matches:
+            # Symbolic links (e.g., to a data repository) are kept
+            session_file = Path(os.path.abspath(match))
+            if session_file not in session_files:
+                session_files.append(session_file)
+    return session_files
+
+
+def check_session_names(session_names):
+    """
+    Checks that the sessions of a run, whose outputs are saved in folders
+    named after them, have different names.
+
+    Raises
+    ------
+    ValueError
+        If two sessions have the same name.
+    """
+    duplicated = sorted({name for name in session_names
+                         if session_names.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"Several session files with the same name: "
+                         f"{', '.join(duplicated)}")
+
+
+def get_session_name(session_file):
+    """
+    Returns the name of the session of the file `session_file` (e.g.,
+    'i140703-001' for 'i140703-001_no_raw.nix').
+    """
+    return re.match(r"^([a-z]\d{6}-\d{3}).*$",
+                    str(Path(session_file).stem)).group(1)
+
+
+def process_session_tasks(tasks, worker, process_function, sessions,
+                          provenance_histories, session_start=None,
+                          **kwargs):
+    """
+    Computes the tasks in `tasks`, where each task is a tuple
+    `(session_name, task)` (e.g., a unit or a pair of units), with the
+    function `process_function` of the script. It takes the tasks of a
+    session and the worker number, and the arguments of the session in
+    `sessions` and the ones in `kwargs`, shared by all sessions.
+
+    The tasks of a session are consecutive, and are handed out in order.
+    Therefore, each process finishes the tasks of a session before starting
+    the next one. The computations are recorded in the provenance history
+    of the session, or saved to the provenance files of the worker in the
+    session folder. If given, `session_start` is called without arguments
+    before the tasks of each session (e.g., to seed the random number
+    generators).
+    """
+    for session_name, session_tasks in itertools.groupby(
+            tasks, key=lambda task: task[0]):
+        if worker is None:
+            provenance_histories.switch(session_name)
+        if session_start is not None:
+            session_start()
+        session_tasks = (task for _, task in session_tasks)
+        process_function(session_tasks, worker, **sessions[session_name],
+                         **kwargs)
@@ -0,0 +1,140 @@
+"""
+Generation of the spike train surrogates of the units of a pair, when the
+pair is processed.
+
+Instead of generating the surrogates of all units up front and sharing them
+with every process, each process generates the surrogates of both units of
+a pair while it computes their CCHs, for one block of surrogates at a time.
+Only the surrogates of one block of a pair are kept, so that the memory used
+does not depend on the number of units or surrogates. The surrogates of a
+unit are generated again for every pair that uses it.
+
+The surrogates must be generated deterministically, such that the results do
+not depend on which process computes a pair, or on the size of the blocks,
+e.g., by seeding the generation of surrogate `k` of a unit from the pair
+`(unit, k)` (see `surrogate_seeds`). Surrogates seeded once per unit are
+generated in blocks by continuing the random numbers of the unit where the
+previous block stopped (see `SurrogateStreams`), and are then the same as
+the surrogates generated by a single call.
+"""
+
+import contextlib
+import random
+
+import numpy as np
+
+from analysis_utils.seeding import derive_seed
+
+
+def surrogate_seeds(base_seed, unit, n_surrogates, first_surrogate=0):
+    """
+    Returns the seeds used to generate each surrogate of a unit.
+
+    Parameters
+    ----------
+    base_seed : int
+        Seed of the analysis.
+    unit : int or str
+        Identifier of the unit.
+    n_surrogates : int
+        Number of surrogates.
+    first_surrogate : int, optional
+        Number of the first surrogate, for a block of surrogates.
+        Default: 0
+
+    Returns
+    -------
+    list of int
+        Seed of each surrogate `k`, derived from `(base_seed, unit, k)`.
+    """
+    return [derive_seed(base_seed, unit, surrogate)
+            for surrogate in range(first_surrogate,
+                                   first_surrogate + n_surrogates)]
+
+
+def skip_draws(n_draws, max_draws=2 ** 20):
+    """
+    Advances the global NumPy generator by `n_draws` uniform numbers, as if
+    they were drawn by `np.random.random_sample`, drawing at most
+    `max_draws` numbers at once.
+    """
+    while n_draws > 0:
+        np.random.random_sample(min(n_draws, max_draws))
+        n_draws -= max_draws
+
+
+class SurrogateStreams:
+    """
+    States of the global random number generators where the generation of
+    the surrogates of the units of a pair continues.
+
+    The generators are seeded for a unit (`start`) as for the generation of
+    all its surrogates by a single call. Each block of surrogates is then
+    generated inside `resume`, that restores the state where the previous
+    block stopped, and stores the state after the block.
+
+    If the surrogates of each trial are generated by a separate call (e.g.,
+    `elephant.spike_train_surrogates.dither_spikes`), the numbers of all
+    surrogates of a trial are drawn before the ones of the next trial. The
+    state at the start of each trial is then obtained by skipping the
+    numbers drawn by NumPy for all surrogates of the previous trials.
+
+    Parameters
+    ----------
+    random_streams : analysis_utils.seeding.RandomStreams
+        Seeds the generators for each unit.
+    """
+
+    def __init__(self, random_streams):
+        self.random_streams = random_streams
+        self._states = {}
+
+    def start(self, unit, n_surrogates=None, trial_draws=None):
+        """
+        Seeds the generators for `unit`, and stores their state.
+
+        Parameters
+        ----------
+        unit : int or str
+            Identifier of the unit.
+        n_surrogates : int, optional
+            Number of surrogates of the unit, if generated per trial.
+            Default: None
+        trial_draws : list of int, optional
+            Numbers drawn by NumPy for each surrogate of each trial (e.g.,
+            the number of spikes). If given, the state at the start of each
+            trial is stored, with the key `(unit, trial)`.
+            Default: None
+        """
+        self.random_streams.seed(unit)
+        if trial_draws is None:
+            self._states[(unit,)] = _global_state()
+            return
+        for trial, n_draws in enumerate(trial_draws):
+            self._states[(unit, trial)] = _global_state()
+            skip_draws(n_surrogates * n_draws)
+
+    def clear(self):
+        """
+        Removes the states of all units (e.g., after a pair is processed).
+        """
+        self._states.clear()
+
+    @contextlib.contextmanager
+    def resume(self, *key):
+        """
+        Context manager where the generators continue from the state stored
+        for `key` (the unit, or the unit and the trial).
+        """
+        _set_global_state(self._states[key])
+        yield
+        self._states[key] = _global_state()
+
+
+def _global_state():
+    return random.getstate(), np.random.get_state()
+
+
+def _set_global_state(state):
+    random.setstate(state[0])
+    np.random.set_state(state[1])
@@ -0,0 +1,338 @@
+"""
+Content-addressed on-disk store of spike train surrogates.
+
+Surrogate generation functions (e.g., `dither_spikes` or `trial_shifting`)
+are wrapped with `SurrogateStore.cached`. When the wrapped function is
+called, a key is computed from:
+
+* the context set by the script (e.g., the hash of the session file and the
+  unit id);
+* the generation function;
+* all the arguments (the contents of the input spike trains and the
+  parameters);
+* the state of the random number generators (i.e., the seed and all the
+  numbers drawn since seeding).
+
+If surrogates were stored for the key, they are loaded instead of generated,
+and the random number generators are set to the state they would have after
+the generation. Otherwise, the function is called and the surrogates are
+saved. Therefore, results are identical with or without the store, and any
+change in the inputs, parameters or seeding results in a new key.
+
+Each entry is a folder with the spike times of all surrogates in a single
+NumPy file, that is memory-mapped when loading. Besides (nested lists of)
+spike trains, the surrogates can be an array of spike times, as returned by
+the functions in `analysis_utils.surrogates`. Entries are written to a
+temporary folder that is renamed when complete, so that interrupted runs or
+concurrent processes never leave partial entries. The store can be shared by
+all analysis scripts and runs.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import random
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import quantities as pq
+
+import neo
+
+
+TIMES_FILE = "times.npy"
+OFFSETS_FILE = "offsets.npy"
+BOUNDS_FILE = "bounds.npy"
+NUMPY_STATE_FILE = "numpy_state.npy"
+METADATA_FILE = "metadata.json"
+
+
+def hash_file(file_name, chunk_size=2 ** 20):
+    """
+    Returns the SHA256 hash of the contents of a file.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_name, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _update_hash(sha256, value):
+    # Adds the contents of an argument to the hash. Spike trains are hashed
+    # by their data, and containers recursively
+    if isinstance(value, neo.SpikeTrain):
+        sha256.update(b"SpikeTrain")
+        sha256.update(np.ascontiguousarray(value.magnitude).tobytes())
+        sha256.update(str((value.units.dimensionality.string,
+                           float(value.t_start.magnitude),
+                           float(value.t_stop.magnitude))).encode('utf-8'))
+    elif isinstance(value, (list, tuple)):
+        sha256.update(f"{type(value).__name__}{len(value)}".encode('utf-8'))
+        for element in value:
+            _update_hash(sha256, element)
+    elif isinstance(value, pq.Quantity):
+        sha256.update(str((value.magnitude.tolist(),
+                           value.dimensionality.string)).encode('utf-8'))
+    else:
+        sha256.update(repr(value).encode('utf-8'))
+
+
+def _random_state_hash():
+    # Hash of the state of the global random number generators of NumPy
+    # and of the `random` module
+    sha256 = hashlib.sha256()
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    sha256.update(str((name, position, has_gauss,
+                       cached_gaussian)).encode('utf-8'))
+    sha256.update(keys.tobytes())
+    sha256.update(repr(random.getstate()).encode('utf-8'))
+    return sha256.hexdigest()
+
+
+def _is_spike_time_array(surrogates):
+    # Whether the surrogates are an array of spike times, instead of spike
+    # train objects
+    return isinstance(surrogates, pq.Quantity) and \
+        not isinstance(surrogates, neo.SpikeTrain)
+
+
+def _flatten(surrogates):
+    # Returns the spike trains in a (possibly nested) list, and the lengths
+    # of the lists to restore the structure
+    if isinstance(surrogates, neo.SpikeTrain):
+        return [surrogates], None
+    spiketrains = []
+    structure = []
+    for element in surrogates:
+        element_spiketrains, element_structure = _flatten(element)
+        spiketrains.extend(element_spiketrains)
+        structure.append(element_structure)
+    return spiketrains, structure
+
+
+def _unflatten(spiketrains, structure):
+    # Restores the structure of the list returned by `_flatten`
+    iterator = iter(spiketrains)
+
+    def _build(element_structure):
+        if element_structure is None:
+            return next(iterator)
+        return [_build(element) for element in element_structure]
+
+    return _build(structure)
+
+
+class SurrogateStore:
+    """
+    Content-addressed on-disk store of spike train surrogates.
+
+    Parameters
+    ----------
+    store_dir : str or Path-like, optional
+        Folder where the surrogates are stored. If None, the store is
+        disabled, and the wrapped functions are always called. It can be
+        set later with `open`.
+        Default: None
+    """
+
+    def __init__(self, store_dir=None):
+        self.store_dir = None
+        self.context = {}
+        self.hits = 0
+        self.misses = 0
+        if store_dir is not None:
+            self.open(store_dir)
+
+    @property
+    def enabled(self):
+        return self.store_dir is not None
+
+    def open(self, store_dir):
+        """
+        Enables the store, using the folder `store_dir`.
+        """
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+    def set_context(self, **context):
+        """
+        Sets information identifying the data being processed (e.g.,
+        `session` with the hash of the session file, and `unit` with the
+        unit id), that is added to the key of the entries.
+        """
+        self.context = context
+
+    def key(self, function, args, kwargs):
+        """
+        Returns the key of the call `function(*args, **kwargs)`, in the
+        current context and state of the random number generators.
+        """
+        signature = inspect.signature(function)
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+
+        sha256 = hashlib.sha256()
+        sha256.update(json.dumps(self.context, sort_keys=True,
+                                 default=str).encode('utf-8'))
+        sha256.update(f"{function.__module__}.{function.__qualname__}"
+                      .encode('utf-8'))
+        for name, value in arguments.arguments.items():
+            sha256.update(name.encode('utf-8'))
+            _update_hash(sha256, value)
+        sha256.update(_random_state_hash().encode('utf-8'))
+        return sha256.hexdigest()
+
+    def _entry_dir(self, key):
+        return self.store_dir / key[:2] / key
+
+    def save(self, key, surrogates):
+        """
+        Saves the surrogates of an entry, together with the current state of
+        the random number generators.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+        surrogates : neo.SpikeTrain or list or pq.Quantity
+            Surrogate spike train, (nested) list of surrogate spike trains,
+            or array of spike times, as returned by the generation function.
+        """
+        if _is_spike_time_array(surrogates):
+            arrays = {TIMES_FILE: np.asarray(surrogates.magnitude,
+                                             dtype=np.float64)}
+            metadata = {'structure': 'array',
+                        'units': surrogates.dimensionality.string}
+        else:
+            spiketrains, structure = _flatten(surrogates)
+            if not spiketrains:
+                raise ValueError("There are no surrogates to store")
+            units = spiketrains[0].units
+            times = [np.asarray(st.rescale(units).magnitude,
+                                dtype=np.float64)
+                     for st in spiketrains]
+            offsets = np.zeros(len(times) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(st_times) for st_times in times])
+            bounds = np.array([[st.t_start.rescale(units).magnitude.item(),
+                                st.t_stop.rescale(units).magnitude.item()]
+                               for st in spiketrains], dtype=np.float64)
+            sampling_rate = spiketrains[0].sampling_rate
+            arrays = {TIMES_FILE: np.concatenate(times),
+                      OFFSETS_FILE: offsets,
+                      BOUNDS_FILE: bounds}
+            metadata = {
+                'structure': structure,
+                'units': units.dimensionality.string,
+                'dtype': spiketrains[0].dtype.str,
+                'sampling_rate': None if sampling_rate is None else
+                [sampling_rate.magnitude.item(),
+                 sampling_rate.dimensionality.string],
+            }
+        numpy_state = np.random.get_state()
+        metadata['numpy_state'] = [numpy_state[0]] + list(numpy_state[2:])
+        metadata['random_state'] = random.getstate()
+
+        entry_dir = self._entry_dir(key)
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = Path(tempfile.mkdtemp(dir=entry_dir.parent,
+                                         prefix=f".{key}."))
+        try:
+            for file_name, array in arrays.items():
+                np.save(temp_dir / file_name, array)
+            np.save(temp_dir / NUMPY_STATE_FILE, numpy_state[1])
+            with open(temp_dir / METADATA_FILE, 'w') as metadata_file:
+                json.dump(metadata, metadata_file)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # The entry may have been saved by a concurrent process
+            if not entry_dir.exists():
+                raise
+        finally:
+            # The temporary folder is left only if the entry was not
+            # renamed, after any failure
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def load(self, key):
+        """
+        Loads the surrogates of an entry, and sets the random number
+        generators to the state saved with the entry.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+
+        Returns
+        -------
+        neo.SpikeTrain or list or pq.Quantity or None
+            Surrogates with the same structure as saved. None if the entry
+            does not exist. An array of spike times is a read-only view of
+            the memory-mapped file, without copies.
+        """
+        entry_dir = self._entry_dir(key)
+        if not entry_dir.exists():
+            return None
+
+        with open(entry_dir / METADATA_FILE) as metadata_file:
+            metadata = json.load(metadata_file)
+        times = np.load(entry_dir / TIMES_FILE, mmap_mode='r')
+        units = pq.Quantity(1, metadata['units'])
+
+        if metadata['structure'] == 'array':
+            # Quantity of the memory-mapped array, without copies
+            surrogates = pq.Quantity(times, units.units)
+        else:
+            offsets = np.load(entry_dir / OFFSETS_FILE)
+            bounds = np.load(entry_dir / BOUNDS_FILE)
+            sampling_rate = metadata['sampling_rate']
+            if sampling_rate is not None:
+                sampling_rate = pq.Quantity(*sampling_rate)
+            spiketrains = [
+                neo.SpikeTrain(times[start:stop], units=units.units,
+                               t_start=t_start, t_stop=t_stop,
+                               sampling_rate=sampling_rate,
+                               dtype=metadata['dtype'])
+                for start, stop, (t_start, t_stop) in
+                zip(offsets[:-1], offsets[1:], bounds)]
+            surrogates = _unflatten(spiketrains, metadata['structure'])
+
+        numpy_state = metadata['numpy_state']
+        np.random.set_state((numpy_state[0],
+                             np.load(entry_dir / NUMPY_STATE_FILE),
+                             *numpy_state[1:]))
+        random_state = metadata['random_state']
+        random.setstate((random_state[0], tuple(random_state[1]),
+                         random_state[2]))
+
+        return surrogates
+
+    def cached(self, function):
+        """
+        Wraps a surrogate generation function, so that its results are taken
+        from the store when available, and saved otherwise. The wrapped
+        function has the same name and signature as `function`, such that it
+        can be annotated and tracked as the original function.
+        """
+
+        @functools.wraps(function)
+        def wrapped(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+
+            key = self.key(function, args, kwargs)
+            surrogates = self.load(key)
+            if surrogates is not None:
+                self.hits += 1
+                return surrogates
+
+            self.misses += 1
+            surrogates = function(*args, **kwargs)
+            self.save(key, surrogates)
+            return surrogates
+
+        return wrapped
@@ -0,0 +1,224 @@
+"""
+Generation of spike train surrogates as NumPy arrays.
+
+The Elephant surrogate functions return each surrogate as a `neo.SpikeTrain`
+object. When the surrogates are immediately reduced (e.g., to interspike
+intervals), creating these objects takes most of the time and memory of the
+generation. The functions in this module return the spike times of all
+surrogates in a single array instead, drawing the same random numbers as the
+Elephant functions. Therefore, the surrogates are identical for the same
+state of the random number generators.
+
+Trial shifting surrogates are generated one trial at a time: the random
+shifts of all surrogates and trials are drawn first (`draw_trial_shifts`),
+relative to the amount of dithering, and applied to the spike times of a
+trial (`shift_trial_spike_times`). `trial_shifting_spike_times` applies them
+to all trials of a unit, and returns the surrogates with the same structure
+as Elephant's `trial_shifting`, such that they are tracked by a single
+generation of the unit.
+
+To track each surrogate as a separate object in the provenance, as those of
+the Elephant functions, the generation functions can be wrapped with
+`split_surrogates`, such that they return the rows of the array in a list.
+"""
+
+import functools
+import random
+
+import numpy as np
+import quantities as pq
+
+
+def dither_spike_times(spiketrain, dither, n_surrogates=1, edges=True):
+    """
+    Generates surrogates of a spike train by uniform spike time dithering,
+    and returns the spike times of all surrogates in a single array.
+
+    This is the same as `elephant.spike_train_surrogates.dither_spikes`
+    (without rounding or refractory period): each spike is displaced by a
+    random time drawn uniformly from [-`dither`, `dither`), using the global
+    NumPy generator.
+
+    Parameters
+    ----------
+    spiketrain : neo.SpikeTrain
+        Spike train from which the surrogates are generated.
+    dither : pq.Quantity
+        Amount of dithering.
+    n_surrogates : int, optional
+        Number of surrogates.
+        Default: 1
+    edges : bool, optional
+        If True, the spikes dithered outside the interval (`t_start`,
+        `t_stop`) of `spiketrain` are removed. If False, they are moved to
+        the closest end of the interval.
+        Default: True
+
+    Returns
+    -------
+    pq.Quantity
+        Array of shape (`n_surrogates`, number of spikes of `spiketrain`),
+        in the units of `spiketrain`, where each row has the sorted spike
+        times of one surrogate. The removed spikes (if `edges` is True) are
+        NaN, at the end of the rows.
+    """
+    units = spiketrain.units
+    n_spikes = len(spiketrain)
+    if n_spikes == 0:
+        return pq.Quantity(np.empty((n_surrogates, 0)), units)
+
+    dither = dither.rescale(units).magnitude.item()
+    t_start = spiketrain.t_start.rescale(units).magnitude.item()
+    t_stop = spiketrain.t_stop.rescale(units).magnitude.item()
+
+    times = spiketrain.magnitude.reshape((1, n_spikes)) \
+        + 2 * dither * np.random.random_sample((n_surrogates, n_spikes)) \
+        - dither
+    times.sort(axis=1)
+
+    if edges:
+        # NaN values are sorted to the end of each row
+        times[~((t_start < times) & (times < t_stop))] = np.nan
+        times.sort(axis=1)
+    else:
+        times = np.minimum(np.maximum(times, t_start), t_stop)
+
+    return pq.Quantity(times, units)
+
+
+def draw_trial_shifts(spiketrains, n_surrogates=1):
+    """
+    Draws the random shifts of each trial of trial shifting surrogates,
+    relative to the amount of dithering.
+
+    The shifts are drawn uniformly from [-1, 1) with the global generator of
+    the `random` module, in the same order as
+    `elephant.spike_train_surrogates.trial_shifting` (all trials of a
+    surrogate before the next surrogate). They are scaled by the amount of
+    dithering when the surrogates are generated by
+    `shift_trial_spike_times`.
+
+    Parameters
+    ----------
+    spiketrains : list of neo.SpikeTrain
+        Spike trains of the same unit, where each element corresponds to
+        one trial.
+    n_surrogates : int, optional
+        Number of surrogates.
+        Default: 1
+
+    Returns
+    -------
+    pq.Quantity
+        Dimensionless array of shape (`n_surrogates`, number of trials),
+        with the relative shift of each trial in each surrogate.
+    """
+    n_shifts = n_surrogates * len(spiketrains)
+    draws = np.array([random.random() for _ in range(n_shifts)])
+    shifts = 2 * draws - 1
+    return pq.Quantity(shifts.reshape((n_surrogates, len(spiketrains))),
+                       pq.dimensionless)
+
+
+def shift_trial_spike_times(spiketrain, dither, shifts):
+    """
+    Generates trial shifting surrogates of the spike train of one trial,
+    and returns the spike times of all surrogates in a single array.
+
+    Each surrogate is the spike train shifted by its shift, scaled by
+    `dither`, with the spikes beyond the end of the trial wrapped around to
+    its start. With the shifts of the trial drawn by `draw_trial_shifts`,
+    the surrogates are the same as those of
+    `elephant.spike_train_surrogates.trial_shifting`.
+
+    Parameters
+    ----------
+    spiketrain : neo.SpikeTrain
+        Spike train of the trial.
+    dither : pq.Quantity
+        Amount of dithering.
+    shifts : pq.Quantity or np.ndarray
+        Shift of the trial in each surrogate, relative to `dither`.
+
+    Returns
+    -------
+    pq.Quantity
+        Array of shape (number of shifts, number of spikes of
+        `spiketrain`), in the units of `spiketrain`, where each row has the
+        sorted spike times of one surrogate.
+    """
+    dither = dither.simplified.magnitude
+    t_start = spiketrain.t_start.simplified.magnitude
+    t_stop = spiketrain.t_stop.simplified.magnitude
+
+    times = spiketrain.simplified.magnitude[np.newaxis, :] + \
+        dither * np.asarray(shifts)[:, np.newaxis]
+    times = np.remainder(times - t_start, t_stop - t_start) + t_start
+    times.sort(axis=1)
+
+    return pq.Quantity(times, pq.s).rescale(spiketrain.units)
+
+
+def trial_shifting_spike_times(spiketrains, dither, shifts):
+    """
+    Generates trial shifting surrogates of the spike trains of all trials of
+    a unit, with the shifts drawn by `draw_trial_shifts`.
+
+    The spike times of all surrogates of a trial are generated in a single
+    array by `shift_trial_spike_times`. As with
+    `elephant.spike_train_surrogates.trial_shifting`, the surrogates are
+    returned as a list with the trials of each surrogate, whose elements
+    are views of the rows of these arrays, without copies.
+
+    Parameters
+    ----------
+    spiketrains : list of neo.SpikeTrain
+        Spike trains of the same unit, where each element corresponds to
+        one trial.
+    dither : pq.Quantity
+        Amount of dithering.
+    shifts : pq.Quantity or np.ndarray
+        Array of shape (number of surrogates, number of trials), with the
+        shift of each trial in each surrogate, relative to `dither`.
+
+    Returns
+    -------
+    list of list of pq.Quantity
+        Spike times of each trial (inner lists) of each surrogate, in the
+        units of the spike train of the trial.
+    """
+    trial_times = [shift_trial_spike_times(spiketrain, dither=dither,
+                                           shifts=shifts[:, trial])
+                   for trial, spiketrain in enumerate(spiketrains)]
+    return [[times[surrogate] for times in trial_times]
+            for surrogate in range(len(shifts))]
+
+
+def split_surrogates(function):
+    """
+    Wraps a function of this module that returns the spike times of several
+    surrogates in a single array, so that it returns a list with the spike
+    times of each surrogate instead.
+
+    The elements of the list are views of the rows of the array, without
+    copies. As they are kept alive by the list, each surrogate can be
+    identified as a separate object when tracking the provenance of the
+    wrapped function (e.g., with `container_output=True` in Alpaca). The
+    wrapped function has the same name and signature as `function`.
+
+    Parameters
+    ----------
+    function : callable
+        Function returning a 2D `pq.Quantity`, with one surrogate per row.
+
+    Returns
+    -------
+    callable
+        Function returning a list of 1D `pq.Quantity`, one per surrogate.
+    """
+
+    @functools.wraps(function)
+    def wrapped(*args, **kwargs):
+        return list(function(*args, **kwargs))
+
+    return wrapped
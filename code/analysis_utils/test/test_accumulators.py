@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+
+from analysis_utils.accumulators import (RunningMeanVariance,
+                                         SurrogateCCHAccumulator,
+                                         SurrogateISIHAccumulator)
+
+
+class RunningMeanVarianceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = np.random.default_rng(0).poisson(5., size=(40, 11))
+
+    def test_add(self):
+        statistics = RunningMeanVariance(11)
+        for sample in self.samples:
+            statistics.add(sample)
+        self.assertEqual(statistics.count, 40)
+        np.testing.assert_allclose(statistics.mean,
+                                   np.mean(self.samples, axis=0))
+        np.testing.assert_allclose(statistics.std(),
+                                   np.std(self.samples, axis=0, ddof=1))
+
+    def test_add_batch(self):
+        statistics = RunningMeanVariance(11)
+        statistics.add_batch(self.samples[:15])
+        statistics.add(self.samples[15])
+        statistics.add_batch(self.samples[16:])
+        np.testing.assert_allclose(statistics.mean,
+                                   np.mean(self.samples, axis=0))
+        np.testing.assert_allclose(statistics.variance(ddof=0),
+                                   np.var(self.samples, axis=0))
+
+    def test_not_enough_samples(self):
+        statistics = RunningMeanVariance(3)
+        statistics.add(np.ones(3))
+        self.assertTrue(np.all(np.isnan(statistics.std(ddof=1))))
+
+
+class SurrogateCCHAccumulatorTestCase(unittest.TestCase):
+
+    def test_mean_and_sd(self):
+        # Trials x lags x surrogates
+        cchs = np.random.default_rng(1).poisson(3., size=(6, 21, 30))
+        accumulator = SurrogateCCHAccumulator(21)
+        for trial_cchs in cchs:
+            accumulator.add_trial(trial_cchs)
+        accumulator.finish_surrogates()
+        self.assertEqual(accumulator.n_surrogates, 30)
+
+        aggregated = np.sum(cchs, axis=0)
+        mean, sd = accumulator.mean_and_sd()
+        np.testing.assert_allclose(mean, np.mean(aggregated, axis=1))
+        np.testing.assert_allclose(sd, np.std(aggregated, axis=1, ddof=1))
+
+    def test_different_number_of_surrogates(self):
+        accumulator = SurrogateCCHAccumulator(5)
+        accumulator.add_trial(np.zeros((5, 3)))
+        with self.assertRaises(ValueError):
+            accumulator.add_trial(np.zeros((5, 4)))
+
+
+class SurrogateISIHAccumulatorTestCase(unittest.TestCase):
+
+    def test_mean_and_sd(self):
+        # Trials x surrogates x bins
+        histograms = np.random.default_rng(1).poisson(3, size=(6, 30, 39))
+        accumulator = SurrogateISIHAccumulator(30, 39)
+        for trial_histograms in histograms:
+            accumulator.add_trial(trial_histograms)
+        self.assertEqual(accumulator.n_trials, 6)
+
+        # Same as stacking the aggregated histogram of each surrogate
+        aggregated = np.vstack([np.sum(surrogate_histograms, axis=0)
+                                for surrogate_histograms in
+                                histograms.transpose(1, 0, 2)])
+        mean, sd = accumulator.mean_and_sd()
+        np.testing.assert_array_equal(mean, np.mean(aggregated, axis=0))
+        np.testing.assert_array_equal(sd, np.std(aggregated, axis=0))
+
+    def test_different_shape(self):
+        accumulator = SurrogateISIHAccumulator(3, 5)
+        with self.assertRaises(ValueError):
+            accumulator.add_trial(np.zeros((4, 5), dtype=int))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from mpi4py import MPI
+
+from analysis_utils.backends import (SerialBackend, MPIBackend,
+                                     ProcessPoolBackend, get_backend)
+
+
+def _write_tasks(tasks, worker, output_dir):
+    # Saves the tasks processed by each worker to a separate file
+    processed = [str(task) for task in tasks]
+    file_name = Path(output_dir) / f"worker_{worker}.txt"
+    file_name.write_text("\n".join(processed))
+
+
+class BackendsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self._temp_dir.name)
+        self.tasks = list(range(20))
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _processed_tasks(self):
+        processed = []
+        for file_name in self.output_dir.iterdir():
+            processed.extend(int(task) for task in
+                             file_name.read_text().split())
+        return sorted(processed)
+
+    def test_serial(self):
+        backend = SerialBackend()
+        self.assertEqual((backend.rank, backend.size), (0, 1))
+        self.assertEqual(backend.bcast("data"), "data")
+        self.assertEqual(backend.gather("data"), ["data"])
+        backend.run(_write_tasks, self.tasks, output_dir=self.output_dir)
+        self.assertTrue((self.output_dir / "worker_None.txt").exists())
+        self.assertEqual(self._processed_tasks(), self.tasks)
+
+    def test_mpi(self):
+        backend = MPIBackend(MPI.COMM_SELF)
+        self.assertEqual((backend.rank, backend.size), (0, 1))
+        self.assertEqual(backend.bcast("data"), "data")
+        self.assertEqual(backend.gather("data"), ["data"])
+        backend.run(_write_tasks, self.tasks, output_dir=self.output_dir)
+        self.assertEqual(self._processed_tasks(), self.tasks)
+
+    def test_pool(self):
+        backend = ProcessPoolBackend(n_workers=3)
+        self.assertEqual(backend.worker_ids, (1, 2, 3))
+        backend.run(_write_tasks, self.tasks, output_dir=self.output_dir)
+        self.assertEqual(len(list(self.output_dir.iterdir())), 3)
+        self.assertEqual(self._processed_tasks(), self.tasks)
+
+    def test_get_backend(self):
+        self.assertIsInstance(get_backend('serial'), SerialBackend)
+        self.assertEqual(get_backend('pool', n_workers=2).n_workers, 2)
+        with self.assertRaises(ValueError):
+            get_backend('threads')
+
+
+if __name__ == "__main__":
+    unittest.main()
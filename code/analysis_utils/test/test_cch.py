@@ -0,0 +1,130 @@
+import unittest
+
+import numpy as np
+import quantities as pq
+
+import neo
+from elephant.conversion import BinnedSpikeTrain
+from elephant.spike_train_correlation import cross_correlation_histogram
+from elephant.spike_train_surrogates import dither_spikes
+
+from analysis_utils.cch import (cross_correlation_histogram_batch,
+                                select_cch_method)
+
+
+def _random_spiketrain(rng, rate=30, t_stop=0.8):
+    n_spikes = rng.poisson(rate * t_stop)
+    times = np.sort(rng.uniform(0, t_stop, n_spikes))
+    return neo.SpikeTrain(times * pq.s, t_stop=t_stop * pq.s)
+
+
+class CrossCorrelationHistogramBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(689)
+        rng = np.random.default_rng(689)
+        self.bin_size = 1 * pq.ms
+        self.window = [-200, 200]
+        self.spiketrain_i = _random_spiketrain(rng)
+        self.spiketrain_j = _random_spiketrain(rng, rate=15)
+        self.surrogates_i = dither_spikes(self.spiketrain_i, dither=25 * pq.ms,
+                                          n_surrogates=20, edges=True)
+        self.surrogates_j = dither_spikes(self.spiketrain_j, dither=25 * pq.ms,
+                                          n_surrogates=20, edges=True)
+
+    def _compare_with_elephant(self, border_correction, method='fft'):
+        binned_i = BinnedSpikeTrain(self.surrogates_i, bin_size=self.bin_size)
+        binned_j = BinnedSpikeTrain(self.surrogates_j, bin_size=self.bin_size)
+
+        cch, lags = cross_correlation_histogram_batch(
+            binned_i, binned_j, window=self.window,
+            border_correction=border_correction, method=method)
+
+        self.assertEqual(cch.shape, (401, 20))
+        for surrogate in range(len(self.surrogates_i)):
+            expected, expected_lags = cross_correlation_histogram(
+                binned_i[surrogate], binned_j[surrogate], window=self.window,
+                border_correction=border_correction)
+            np.testing.assert_array_equal(cch.magnitude[:, surrogate],
+                                          expected.magnitude[:, 0])
+            np.testing.assert_array_equal(lags, expected_lags)
+            self.assertEqual(cch.t_start, expected.t_start)
+            self.assertEqual(cch.sampling_period, expected.sampling_period)
+            self.assertEqual(cch.annotations, expected.annotations)
+
+    def test_same_as_elephant(self):
+        self._compare_with_elephant(border_correction=False)
+
+    def test_same_as_elephant_border_correction(self):
+        self._compare_with_elephant(border_correction=True)
+
+    def test_sparse_same_as_elephant(self):
+        self._compare_with_elephant(border_correction=False, method='sparse')
+
+    def test_sparse_same_as_elephant_border_correction(self):
+        self._compare_with_elephant(border_correction=True, method='sparse')
+
+    def test_direct_same_as_elephant(self):
+        self._compare_with_elephant(border_correction=True, method='direct')
+
+    def test_sparse_multiple_spikes_per_bin(self):
+        binned_i = BinnedSpikeTrain(self.surrogates_i, bin_size=20 * pq.ms)
+        binned_j = BinnedSpikeTrain(self.surrogates_j, bin_size=20 * pq.ms)
+        self.assertGreater(binned_i.sparse_matrix.data.max(), 1)
+        fft_cch, _ = cross_correlation_histogram_batch(
+            binned_i, binned_j, window=[-10, 10], border_correction=True)
+        sparse_cch, _ = cross_correlation_histogram_batch(
+            binned_i, binned_j, window=[-10, 10], border_correction=True,
+            method='sparse')
+        np.testing.assert_array_equal(sparse_cch.magnitude,
+                                      fft_cch.magnitude)
+
+    def test_invalid_method(self):
+        binned_i = BinnedSpikeTrain(self.surrogates_i, bin_size=self.bin_size)
+        binned_j = BinnedSpikeTrain(self.surrogates_j, bin_size=self.bin_size)
+        with self.assertRaises(ValueError):
+            cross_correlation_histogram_batch(binned_i, binned_j,
+                                              window=self.window,
+                                              method='gpu')
+        for method in ('direct', 'sparse'):
+            with self.assertRaises(ValueError):
+                cross_correlation_histogram_batch(binned_i, binned_j,
+                                                  window=[-10, 50],
+                                                  method=method)
+
+    def test_select_method(self):
+        binned_i = BinnedSpikeTrain(self.surrogates_i, bin_size=self.bin_size)
+        binned_j = BinnedSpikeTrain(self.surrogates_j, bin_size=self.bin_size)
+        method, timings = select_cch_method(binned_i, binned_j,
+                                            window=self.window,
+                                            border_correction=True, repeats=1)
+        self.assertEqual(set(timings.keys()), {'direct', 'fft', 'sparse'})
+        self.assertEqual(timings[method], min(timings.values()))
+
+        # Only FFT supports asymmetric windows
+        method, timings = select_cch_method(binned_i, binned_j,
+                                            window=[-10, 50], repeats=1)
+        self.assertEqual(method, 'fft')
+        self.assertEqual(list(timings.keys()), ['fft'])
+
+    def test_different_shapes(self):
+        binned_i = BinnedSpikeTrain(self.surrogates_i, bin_size=self.bin_size)
+        binned_j = BinnedSpikeTrain(self.surrogates_j[:10],
+                                    bin_size=self.bin_size)
+        with self.assertRaises(ValueError):
+            cross_correlation_histogram_batch(binned_i, binned_j,
+                                              window=self.window)
+
+    def test_invalid_window(self):
+        binned_i = BinnedSpikeTrain(self.surrogates_i, bin_size=self.bin_size)
+        binned_j = BinnedSpikeTrain(self.surrogates_j, bin_size=self.bin_size)
+        with self.assertRaises(ValueError):
+            cross_correlation_histogram_batch(binned_i, binned_j,
+                                              window=[200, -200])
+        with self.assertRaises(ValueError):
+            cross_correlation_histogram_batch(binned_i, binned_j,
+                                              window=[-900, 900])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+import argparse
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import quantities as pq
+
+import neo
+
+from analysis_utils.backends import SerialBackend
+from analysis_utils.cch_analysis import (add_cch_arguments, cch_arguments,
+                                         pair_computation_modes,
+                                         plan_surrogate_chunk, process_units,
+                                         remaining_pairs, run_session_pairs,
+                                         save_pair_checkpoint, select_pairs,
+                                         select_session_cch_method,
+                                         surrogate_blocks)
+from analysis_utils.checkpoint import load_pair_result
+from analysis_utils.memory import estimate_cch_memory
+
+
+class _Backend(SerialBackend):
+    # Backend seen by the process with the given rank
+
+    def __init__(self, rank, size):
+        super().__init__()
+        self.rank = rank
+        self.size = size
+
+
+class _Histories:
+    # Records the sessions switched to
+
+    def __init__(self):
+        self.sessions = []
+
+    def switch(self, session_name):
+        self.sessions.append(session_name)
+
+
+class CCHAnalysisTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir = Path(self._temp_dir.name)
+        self.unit_ids = ['Unit 1', 'Unit 2', 'Unit 3']
+        self.parameters = {'bin_size': 1 * pq.ms}
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _save_checkpoint(self, unit_i, unit_j):
+        cch = neo.AnalogSignal(np.arange(5.) * pq.dimensionless,
+                               sampling_period=1 * pq.ms,
+                               window=[-2, 2])
+        save_pair_checkpoint(self.temp_dir, unit_i, unit_j, self.parameters,
+                             cch, np.zeros((5, 1)), np.ones((5, 1)))
+
+    def test_arguments(self):
+        parser = add_cch_arguments(argparse.ArgumentParser())
+        output_dir = self.temp_dir / "output"
+        session_file = self.temp_dir / "session.nix"
+        session_file.touch()
+        args = parser.parse_args(['--output_path', str(output_dir),
+                                  '--backend', 'serial', '--max_lag', '50',
+                                  '--memory_budget', '1K', '--no_plots',
+                                  str(session_file)])
+        arguments = cch_arguments(args)
+        self.assertTrue(output_dir.is_dir())
+        self.assertEqual(arguments['session_files'], [session_file])
+        self.assertEqual(arguments['max_lag'], 50 * pq.ms)
+        self.assertEqual(arguments['bin_size'], 1 * pq.ms)
+        self.assertEqual(arguments['memory_budget'], 1024)
+        self.assertFalse(arguments['plot'])
+        self.assertIsNone(arguments['surrogate_store_dir'])
+        self.assertEqual(arguments['backend'].name, 'serial')
+
+    def test_select_pairs(self):
+        all_pairs, pairs = select_pairs(self.unit_ids)
+        self.assertEqual(len(all_pairs), 6)
+        self.assertEqual(pairs, all_pairs)
+
+        all_pairs, pairs = select_pairs(self.unit_ids, symmetric=True)
+        self.assertEqual(len(all_pairs), 6)
+        self.assertEqual(pairs, [('Unit 1', 'Unit 2'), ('Unit 1', 'Unit 3'),
+                                 ('Unit 2', 'Unit 3')])
+
+    def test_remaining_pairs(self):
+        self._save_checkpoint('Unit 1', 'Unit 2')
+        self._save_checkpoint('Unit 2', 'Unit 1')
+        self._save_checkpoint('Unit 1', 'Unit 3')
+
+        all_pairs, pairs = select_pairs(self.unit_ids)
+        self.assertEqual(
+            remaining_pairs(pairs, all_pairs, self.temp_dir,
+                            self.parameters),
+            [('Unit 2', 'Unit 3'), ('Unit 3', 'Unit 1'),
+             ('Unit 3', 'Unit 2')])
+
+        # In symmetric mode, a pair is finished only with its mirrored pair
+        all_pairs, pairs = select_pairs(self.unit_ids, symmetric=True)
+        self.assertEqual(
+            remaining_pairs(pairs, all_pairs, self.temp_dir,
+                            self.parameters, symmetric=True),
+            [('Unit 1', 'Unit 3'), ('Unit 2', 'Unit 3')])
+
+        # Checkpoints with other parameters are not reused
+        self.assertEqual(
+            remaining_pairs(pairs, all_pairs, self.temp_dir,
+                            {'bin_size': 5 * pq.ms}, symmetric=True),
+            pairs)
+
+    def test_save_pair_checkpoint(self):
+        self._save_checkpoint('Unit 1', 'Unit 2')
+        result = load_pair_result(self.temp_dir, 'Unit 1', 'Unit 2',
+                                  self.parameters)
+        np.testing.assert_array_equal(result['cch'], np.arange(5.)[:, None])
+        self.assertEqual(str(result['annotations']), '{"window": [-2, 2]}')
+
+    def test_process_units(self):
+        pairs = [('Unit 1', 'Unit 3'), ('Unit 3', 'Unit 1')]
+        self.assertEqual(process_units(self.unit_ids, pairs, _Backend(0, 1)),
+                         ['Unit 1', 'Unit 3'])
+        self.assertEqual(process_units(self.unit_ids, pairs, _Backend(0, 2)),
+                         ['Unit 1'])
+        self.assertEqual(process_units(self.unit_ids, pairs, _Backend(1, 2)),
+                         ['Unit 3'])
+        self.assertEqual(process_units(self.unit_ids, pairs, _Backend(2, 3)),
+                         [])
+
+    def test_select_session_cch_method(self):
+        backend = SerialBackend()
+        self.assertEqual(select_session_cch_method('sparse', backend, [],
+                                                   {}, {}), 'sparse')
+        self.assertEqual(select_session_cch_method('auto', backend, [],
+                                                   {}, {}), 'fft')
+
+    def test_pair_computation_modes(self):
+        self.assertEqual(pair_computation_modes('batched', 'aggregate'),
+                         (False, False))
+        self.assertEqual(pair_computation_modes('batched', 'streaming'),
+                         (False, True))
+        self.assertEqual(pair_computation_modes('per_call', 'aggregate'),
+                         (True, True))
+        self.assertEqual(pair_computation_modes('per_call', 'streaming',
+                                                surrogate_chunk=10),
+                         (True, False))
+
+    def test_surrogate_blocks(self):
+        self.assertEqual(surrogate_blocks(10, 4),
+                         [slice(0, 4), slice(4, 8), slice(8, 12)])
+        self.assertEqual(np.arange(10)[surrogate_blocks(10, 4)[-1]].tolist(),
+                         [8, 9])
+        self.assertEqual(surrogate_blocks(0, 4), [])
+
+    def test_plan_surrogate_chunk(self):
+        session = {'n_units': 40, 'n_trials': 100, 'n_bins': 800,
+                   'n_surrogates': 1000, 'n_cch_bins': 401,
+                   'spikes_per_trial': 20, 'n_pairs': 1560}
+        peak = estimate_cch_memory(**session)['peak']
+        self.assertIsNone(plan_surrogate_chunk(session))
+        self.assertIsNone(plan_surrogate_chunk(session, memory_budget=peak))
+        self.assertEqual(plan_surrogate_chunk(session, surrogate_chunk=100),
+                         100)
+
+        # Generating the surrogates of each pair in chunks does not keep
+        # the surrogates of all units
+        chunk_peak = estimate_cch_memory(chunk_size=100, **session)['peak']
+        self.assertLess(chunk_peak, peak)
+        self.assertEqual(plan_surrogate_chunk(session,
+                                              memory_budget=chunk_peak), 100)
+
+        # The chunks requested are checked against the budget
+        self.assertEqual(plan_surrogate_chunk(session, surrogate_chunk=100,
+                                              memory_budget=chunk_peak), 100)
+        with self.assertRaisesRegex(ValueError, "chunks of 200"):
+            plan_surrogate_chunk(session, surrogate_chunk=200,
+                                 memory_budget=chunk_peak)
+
+    def test_run_session_pairs(self):
+        processed = []
+
+        def process_pairs(pairs, worker, session, scale):
+            processed.extend((session, pair, scale) for pair in pairs)
+
+        sessions = {
+            'session_1': {'pairs': [('Unit 1', 'Unit 2')],
+                          'arguments': {'session': 1}},
+            'session_2': {'pairs': [],
+                          'arguments': {'session': 2}},
+            'session_3': {'pairs': [('Unit 1', 'Unit 2'),
+                                    ('Unit 2', 'Unit 1')],
+                          'arguments': {'session': 3}}}
+        histories = _Histories()
+        run_session_pairs(SerialBackend(), process_pairs, sessions,
+                          histories, scale=2)
+        self.assertEqual(processed, [(1, ('Unit 1', 'Unit 2'), 2),
+                                     (3, ('Unit 1', 'Unit 2'), 2),
+                                     (3, ('Unit 2', 'Unit 1'), 2)])
+        self.assertEqual(histories.sessions, ['session_1', 'session_3'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import quantities as pq
+
+from analysis_utils.checkpoint import save_pair_result
+from analysis_utils.cch_results import (collect_pair_results,
+                                        save_cch_results, load_cch_results,
+                                        significance_thresholds)
+
+
+class CCHResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir = Path(self._temp_dir.name)
+        self.parameters = {'bin_size': 1 * pq.ms, 'n_surrogates': 10}
+        self.pairs = [("Unit 1", "Unit 2"), ("Unit 2", "Unit 1")]
+        self.annotations = {'cch_parameters': {'window': [-2, 2]}}
+
+        # Checkpoints as saved by the CCH scripts, where the surrogate
+        # statistics have one channel
+        for index, (unit_i, unit_j) in enumerate(self.pairs):
+            values = np.arange(5.) + index
+            save_pair_result(self.temp_dir, unit_i, unit_j, self.parameters,
+                             cch=values, mean=values[:, np.newaxis] / 2,
+                             sd=np.ones((5, 1)),
+                             annotations=json.dumps(self.annotations))
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_collect_pair_results(self):
+        cchs, means, sds, annotations = collect_pair_results(
+            self.temp_dir, self.pairs, self.parameters)
+        self.assertEqual(cchs.shape, (2, 5))
+        self.assertEqual(means.shape, (2, 5))
+        self.assertEqual(sds.shape, (2, 5))
+        np.testing.assert_array_equal(cchs[1], np.arange(5.) + 1)
+        np.testing.assert_array_equal(means[1], (np.arange(5.) + 1) / 2)
+        self.assertEqual(annotations, self.annotations)
+
+    def test_collect_missing_pair(self):
+        with self.assertRaises(ValueError):
+            collect_pair_results(self.temp_dir,
+                                 self.pairs + [("Unit 1", "Unit 3")],
+                                 self.parameters)
+        with self.assertRaises(ValueError):
+            collect_pair_results(self.temp_dir, self.pairs,
+                                 {'bin_size': 2 * pq.ms})
+
+    def test_save_and_load(self):
+        cchs, means, sds, annotations = collect_pair_results(
+            self.temp_dir, self.pairs, self.parameters)
+        file_name = self.temp_dir / "cch_results.npz"
+        save_cch_results(file_name, self.pairs, cchs, means, sds,
+                         bin_size=1 * pq.ms, max_lag=0.002 * pq.s,
+                         significance_threshold=2.0,
+                         annotations=annotations,
+                         parameters=self.parameters)
+
+        results = load_cch_results(file_name)
+        self.assertEqual(results['pairs'], self.pairs)
+        np.testing.assert_array_equal(results['lags'], np.arange(-2, 3))
+        np.testing.assert_array_equal(results['cch'], cchs)
+        np.testing.assert_array_equal(results['sd'], sds)
+        np.testing.assert_array_equal(results['threshold'], means + 2 * sds)
+        self.assertEqual(results['significance_threshold'], 2.0)
+        self.assertEqual(results['bin_size'], 1 * pq.ms)
+        self.assertEqual(results['max_lag'], 2 * pq.ms)
+        self.assertEqual(results['annotations'], self.annotations)
+        self.assertEqual(results['parameters']['n_surrogates'], 10)
+
+    def test_invalid_number_of_pairs(self):
+        with self.assertRaises(ValueError):
+            save_cch_results(self.temp_dir / "cch_results.npz",
+                             self.pairs[:1], np.zeros((2, 5)),
+                             np.zeros((2, 5)), np.zeros((2, 5)),
+                             bin_size=1 * pq.ms, max_lag=2 * pq.ms)
+
+    def test_significance_thresholds(self):
+        np.testing.assert_array_equal(
+            significance_thresholds(np.array([1., 2.]), np.array([.5, 1.]),
+                                    3.0),
+            [2.5, 5.])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import quantities as pq
+
+from analysis_utils.checkpoint import (save_pair_result, load_pair_result,
+                                       completed_pairs, pair_checkpoint_file,
+                                       save_arrays_atomic)
+
+
+class _Unpicklable:
+    # Fails while writing the file
+
+    def __reduce__(self):
+        raise ValueError("Object cannot be pickled")
+
+
+class CheckpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = Path(self._temp_dir.name)
+        self.parameters = {'bin_size': 1 * pq.ms, 'n_surrogates': 10}
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_save_and_load(self):
+        cch = np.arange(5.)
+        save_pair_result(self.checkpoint_dir, "Unit 1", "Unit 2",
+                         self.parameters, cch=cch, mean=cch / 2)
+        result = load_pair_result(self.checkpoint_dir, "Unit 1", "Unit 2",
+                                  self.parameters)
+        self.assertEqual(set(result.keys()), {'cch', 'mean'})
+        np.testing.assert_array_equal(result['cch'], cch)
+        np.testing.assert_array_equal(result['mean'], cch / 2)
+
+        # No temporary files are left
+        self.assertEqual(len(list(self.checkpoint_dir.iterdir())), 1)
+
+    def test_different_parameters(self):
+        save_pair_result(self.checkpoint_dir, "Unit 1", "Unit 2",
+                         self.parameters, cch=np.zeros(3))
+        parameters = {'bin_size': 2 * pq.ms, 'n_surrogates': 10}
+        self.assertIsNone(load_pair_result(self.checkpoint_dir, "Unit 1",
+                                           "Unit 2", parameters))
+
+    def test_missing_and_corrupt(self):
+        self.assertIsNone(load_pair_result(self.checkpoint_dir, "Unit 1",
+                                           "Unit 2", self.parameters))
+        pair_checkpoint_file(self.checkpoint_dir, "Unit 2",
+                             "Unit 1").write_bytes(b"incomplete")
+        self.assertIsNone(load_pair_result(self.checkpoint_dir, "Unit 2",
+                                           "Unit 1", self.parameters))
+
+    def test_completed_pairs(self):
+        pairs = [("Unit 1", "Unit 2"), ("Unit 2", "Unit 1")]
+        save_pair_result(self.checkpoint_dir, "Unit 2", "Unit 1",
+                         self.parameters, cch=np.zeros(3))
+        self.assertEqual(completed_pairs(self.checkpoint_dir, pairs,
+                                         self.parameters),
+                         {("Unit 2", "Unit 1")})
+
+    def test_atomic_save_failure(self):
+        file_name = self.checkpoint_dir / "result.npz"
+        save_arrays_atomic(file_name, data=np.ones(3))
+        with self.assertRaises(ValueError):
+            save_arrays_atomic(file_name, data=np.zeros(3),
+                               other=np.array([_Unpicklable()]))
+        # The previous file is kept, and no temporary files are left
+        np.testing.assert_array_equal(np.load(file_name)['data'], np.ones(3))
+        self.assertEqual(len(list(self.checkpoint_dir.iterdir())), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+import numpy as np
+import quantities as pq
+
+import neo
+from mpi4py import MPI
+from elephant.conversion import BinnedSpikeTrain
+
+from analysis_utils.distribution import (pack_binned_spiketrains,
+                                         unpack_binned_spiketrains,
+                                         distribute_binned_spiketrains,
+                                         allgather_binned_spiketrains,
+                                         free_shared_arrays)
+
+
+class BinnedSpikeTrainDistributionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(689)
+        spiketrains = [
+            neo.SpikeTrain(np.sort(rng.uniform(0, 0.8, 20)) * pq.s,
+                           t_stop=0.8 * pq.s)
+            for _ in range(6)]
+        self.binned = (
+            {'unit_1': BinnedSpikeTrain(spiketrains[:2], bin_size=1 * pq.ms)},
+            {'unit_1': [BinnedSpikeTrain(spiketrains[2:4], bin_size=1 * pq.ms),
+                        BinnedSpikeTrain(spiketrains[4:], bin_size=5 * pq.ms)]}
+        )
+
+    def _assert_same(self, rebuilt, original):
+        self.assertIsInstance(rebuilt, BinnedSpikeTrain)
+        self.assertEqual(rebuilt.shape, original.shape)
+        self.assertEqual(rebuilt.bin_size, original.bin_size)
+        self.assertEqual(rebuilt.t_start, original.t_start)
+        self.assertEqual(rebuilt.t_stop, original.t_stop)
+        np.testing.assert_array_equal(rebuilt.to_array(),
+                                      original.to_array())
+
+    def _assert_structure(self, rebuilt):
+        self.assertIsInstance(rebuilt, tuple)
+        self._assert_same(rebuilt[0]['unit_1'], self.binned[0]['unit_1'])
+        for rebuilt_bst, bst in zip(rebuilt[1]['unit_1'],
+                                    self.binned[1]['unit_1']):
+            self._assert_same(rebuilt_bst, bst)
+
+    def test_pack_unpack(self):
+        layout, buffers = pack_binned_spiketrains(self.binned)
+        self.assertEqual(set(buffers.keys()), {'data', 'indices', 'indptr'})
+        self.assertEqual(buffers['indptr'].size, 3 * 3)
+
+        rebuilt = unpack_binned_spiketrains(layout, buffers)
+        self._assert_structure(rebuilt)
+
+        # Data is not copied
+        sparse_matrix = rebuilt[1]['unit_1'][1].sparse_matrix
+        self.assertTrue(np.shares_memory(sparse_matrix.data,
+                                         buffers['data']))
+
+    def test_pack_invalid_object(self):
+        with self.assertRaises(TypeError):
+            pack_binned_spiketrains({'unit_1': np.zeros(5)})
+
+    def test_distribute_single_process(self):
+        for use_shared_memory in (True, False):
+            with self.subTest(use_shared_memory=use_shared_memory):
+                rebuilt, windows = distribute_binned_spiketrains(
+                    self.binned, comm=MPI.COMM_SELF,
+                    use_shared_memory=use_shared_memory)
+                self._assert_structure(rebuilt)
+                del rebuilt
+                free_shared_arrays(windows)
+
+    def test_allgather_single_process(self):
+        binned_surrogates = self.binned[1]
+        rebuilt, windows = allgather_binned_spiketrains(
+            binned_surrogates, comm=MPI.COMM_SELF)
+        self.assertEqual(list(rebuilt.keys()), ['unit_1'])
+        for rebuilt_bst, bst in zip(rebuilt['unit_1'],
+                                    binned_surrogates['unit_1']):
+            self._assert_same(rebuilt_bst, bst)
+        del rebuilt
+        free_shared_arrays(windows)
+
+
+if __name__ == "__main__":
+    unittest.main()
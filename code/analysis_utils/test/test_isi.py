@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+import quantities as pq
+
+import neo
+from elephant.statistics import isi
+from elephant.spike_train_surrogates import dither_spikes
+
+from analysis_utils.isi import isi_histogram_batch, isi_histogram_edges
+from analysis_utils.surrogates import dither_spike_times
+
+
+def _histogram(spiketrain, bin_size, max_time):
+    # ISI histogram computed as in the surrogate ISIH scripts
+    edges = isi_histogram_edges(bin_size, max_time)
+    times = isi(spiketrain).rescale(bin_size.units).magnitude
+    counts, _ = np.histogram(times, bins=edges)
+    return counts
+
+
+class ISIHistogramBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(689)
+        rng = np.random.default_rng(689)
+        times = np.sort(rng.uniform(0, 2, 60))
+        self.spiketrain = neo.SpikeTrain(times * pq.s, t_stop=2 * pq.s)
+        self.surrogates = dither_spikes(self.spiketrain, dither=25 * pq.ms,
+                                        n_surrogates=20, edges=True)
+
+    def test_same_as_histogram(self):
+        for bin_size, max_time in ((5 * pq.ms, 200 * pq.ms),
+                                   (1 * pq.ms, 0.1 * pq.s)):
+            counts, edges = isi_histogram_batch(
+                self.surrogates, bin_size=bin_size, max_time=max_time)
+            self.assertEqual(counts.shape, (20, len(edges) - 1))
+            self.assertEqual(edges.units, bin_size.units)
+            for surrogate, row in zip(self.surrogates, counts):
+                np.testing.assert_array_equal(
+                    row, _histogram(surrogate, bin_size, max_time))
+
+    def test_bin_edges(self):
+        # Intervals on the edges, beyond the last edge, and spike trains
+        # without intervals
+        spiketrains = [
+            neo.SpikeTrain([0, 5, 15, 20, 215, 420] * pq.ms, t_stop=1 * pq.s),
+            neo.SpikeTrain([0.1] * pq.s, t_stop=1 * pq.s),
+            neo.SpikeTrain([] * pq.s, t_stop=1 * pq.s),
+            neo.SpikeTrain([0.3, 0.3, 0.495] * pq.s, t_stop=1 * pq.s)]
+        counts, edges = isi_histogram_batch(spiketrains)
+        self.assertEqual(counts.shape, (4, 39))
+        np.testing.assert_array_equal(counts.sum(axis=1), [4, 0, 0, 2])
+        for spiketrain, row in zip(spiketrains, counts):
+            np.testing.assert_array_equal(
+                row, _histogram(spiketrain, 5 * pq.ms, 200 * pq.ms))
+
+
+    def test_spike_time_array(self):
+        # Same histograms from the padded array of the same surrogates
+        np.random.seed(689)
+        times = dither_spike_times(self.spiketrain, dither=25 * pq.ms,
+                                   n_surrogates=20, edges=True)
+        self.assertTrue(np.isnan(times.magnitude).any())
+        expected, _ = isi_histogram_batch(self.surrogates)
+        counts, _ = isi_histogram_batch(times)
+        np.testing.assert_array_equal(counts, expected)
+
+        # Same histograms from the list of the padded rows
+        counts, _ = isi_histogram_batch(list(times))
+        np.testing.assert_array_equal(counts, expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+
+from analysis_utils.memory import (describe_memory_estimate,
+                                   estimate_cch_memory, format_memory_size,
+                                   parse_memory_size, peak_rss,
+                                   surrogate_chunk_size)
+
+
+SESSION = {'n_units': 40, 'n_trials': 100, 'n_bins': 800,
+           'n_surrogates': 1000, 'n_cch_bins': 401, 'spikes_per_trial': 20}
+
+# Few long trials, where computing the CCHs takes more memory than saving
+# the provenance
+LONG_TRIALS = dict(SESSION, n_units=2, n_trials=10, n_bins=10 ** 6)
+
+
+class MemorySizeTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_memory_size("512"), 512)
+        self.assertEqual(parse_memory_size(512), 512)
+        self.assertEqual(parse_memory_size("4K"), 4096)
+        self.assertEqual(parse_memory_size("8G"), 8 * 1024 ** 3)
+        self.assertEqual(parse_memory_size("1.5GiB"), 3 * 1024 ** 3 // 2)
+        self.assertEqual(parse_memory_size("100mb"), 100 * 1024 ** 2)
+
+    def test_invalid(self):
+        for size in ("", "G", "8X", "-1G"):
+            with self.assertRaises(ValueError):
+                parse_memory_size(size)
+
+    def test_format(self):
+        self.assertEqual(format_memory_size(100), "100.0 B")
+        self.assertEqual(format_memory_size(3 * 1024 ** 3 // 2), "1.5 GiB")
+
+    def test_peak_rss(self):
+        self.assertGreater(peak_rss(), 1024 ** 2)
+
+
+class EstimateCCHMemoryTestCase(unittest.TestCase):
+
+    def test_components(self):
+        estimate = estimate_cch_memory(baseline=100, **SESSION)
+        self.assertEqual(estimate['baseline'], 100)
+        self.assertEqual(estimate['peak'],
+                         max(estimate['computation peak'],
+                             estimate['saving peak']))
+        self.assertEqual(estimate['computation peak'],
+                         sum(n_bytes for component, n_bytes in
+                             estimate.items()
+                             if not component.endswith('peak') and
+                             component != 'provenance serialization'))
+        self.assertNotIn('shared surrogates', estimate)
+
+    def test_scaling(self):
+        estimate = estimate_cch_memory(**SESSION)
+        double = estimate_cch_memory(**dict(SESSION, n_units=80))
+        self.assertEqual(double['binned surrogates'],
+                         2 * estimate['binned surrogates'])
+        self.assertEqual(double['provenance'], 2 * estimate['provenance'])
+
+        # The surrogate CCHs of all trials are only kept in aggregate mode
+        streaming = estimate_cch_memory(surrogate_statistics='streaming',
+                                        **SESSION)
+        self.assertLess(streaming['computation peak'],
+                        estimate['computation peak'])
+
+    def test_processes(self):
+        estimate = estimate_cch_memory(**SESSION)
+        mpi = estimate_cch_memory(n_processes=4, **SESSION)
+        # Each process generates the surrogates of a quarter of the units,
+        # and rank 0 gathers the surrogates of all of them
+        self.assertEqual(4 * mpi['provenance'], estimate['provenance'])
+        self.assertEqual(mpi['shared surrogates'],
+                         2 * estimate['binned surrogates'])
+        lazy = estimate_cch_memory(n_processes=4, pair_generation=True,
+                                   **SESSION)
+        self.assertNotIn('shared surrogates', lazy)
+
+    def test_pair_generation(self):
+        estimate = estimate_cch_memory(n_processes=4, **SESSION)
+        pairs = estimate_cch_memory(n_processes=4, pair_generation=True,
+                                    n_pairs=20, **SESSION)
+        # Only the surrogates of a pair are kept, but each process tracks
+        # the surrogates of the units of its pairs
+        self.assertEqual(pairs['binned surrogates'],
+                         2 * estimate['binned surrogates'] / 10)
+        self.assertEqual(pairs['provenance'], estimate['provenance'])
+        many_pairs = estimate_cch_memory(n_processes=4, pair_generation=True,
+                                         n_pairs=1560, **SESSION)
+        self.assertEqual(many_pairs['provenance'],
+                         4 * estimate['provenance'])
+
+    def test_chunked(self):
+        estimate = estimate_cch_memory(surrogate_statistics='streaming',
+                                       **SESSION)
+        chunked = estimate_cch_memory(chunk_size=100, **SESSION)
+        # Only the surrogates of a block of the pair are generated, and
+        # their CCHs computed, at once
+        self.assertEqual(10 * chunked['CCH computation'],
+                         estimate['CCH computation'])
+        self.assertEqual(10 * chunked['surrogate CCHs'],
+                         estimate['surrogate CCHs'])
+        self.assertEqual(10 * chunked['surrogate generation'],
+                         estimate['surrogate generation'])
+        # Binned surrogates of 2 out of 40 units, in blocks of 100 out of
+        # 1000 surrogates
+        self.assertEqual(20 * 10 * chunked['binned surrogates'],
+                         estimate['binned surrogates'])
+        self.assertEqual(chunked['provenance'], estimate['provenance'])
+        self.assertEqual(estimate_cch_memory(chunk_size=5000, **SESSION),
+                         estimate_cch_memory(pair_generation=True,
+                                             surrogate_statistics='streaming',
+                                             **SESSION))
+
+    def test_describe(self):
+        estimate = estimate_cch_memory(**SESSION)
+        lines = describe_memory_estimate(estimate)
+        self.assertEqual(len(lines), len(estimate) - 2)
+        self.assertEqual(lines[0], "  baseline: 0.0 B")
+        self.assertTrue(lines[-1].startswith(
+            f"Projected peak memory per process: "
+            f"{format_memory_size(estimate['peak'])}"))
+
+
+class SurrogateChunkSizeTestCase(unittest.TestCase):
+
+    def test_largest_chunk(self):
+        budget = estimate_cch_memory(chunk_size=250, **LONG_TRIALS)['peak']
+        self.assertEqual(surrogate_chunk_size(budget, **LONG_TRIALS), 250)
+        self.assertEqual(surrogate_chunk_size(budget - 1, **LONG_TRIALS),
+                         249)
+
+    def test_all_surrogates(self):
+        budget = estimate_cch_memory(**SESSION)['peak']
+        self.assertEqual(surrogate_chunk_size(budget, **SESSION), 1000)
+
+    def test_budget_too_small(self):
+        with self.assertRaisesRegex(ValueError, "provenance"):
+            surrogate_chunk_size(1024 ** 2, **SESSION)
+
+
+if __name__ == "__main__":
+    unittest.main()
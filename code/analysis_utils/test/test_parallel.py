@@ -0,0 +1,99 @@
+import unittest
+from collections import defaultdict
+
+from mpi4py import MPI
+
+from analysis_utils.parallel import NO_MORE_TASKS, mpi_work_queue
+
+
+class CoordinatorComm:
+    """
+    Communicator seen by the coordinator, where the other ranks request
+    tasks in turn until they are told to stop.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.requests = list(range(1, size))
+        self.assigned = defaultdict(list)
+        self.stopped = []
+
+    def Get_size(self):
+        return self.size
+
+    def Get_rank(self):
+        return 0
+
+    def recv(self, source=None, tag=None, status=None):
+        status.Set_source(self.requests.pop(0))
+
+    def send(self, obj, dest=None, tag=None):
+        if obj == NO_MORE_TASKS:
+            self.stopped.append(dest)
+        else:
+            self.assigned[dest].append(obj)
+            self.requests.append(dest)
+
+
+class WorkerComm:
+    """
+    Communicator seen by a worker, that receives the given task indexes.
+    """
+
+    def __init__(self, size, rank, task_indexes):
+        self.size = size
+        self.rank = rank
+        self.task_indexes = iter(list(task_indexes) + [NO_MORE_TASKS])
+        self.n_requests = 0
+
+    def Get_size(self):
+        return self.size
+
+    def Get_rank(self):
+        return self.rank
+
+    def send(self, obj, dest=None, tag=None):
+        self.n_requests += 1
+
+    def recv(self, source=None, tag=None):
+        return next(self.task_indexes)
+
+
+class MPIWorkQueueTestCase(unittest.TestCase):
+
+    def test_single_process(self):
+        tasks = [('Unit 1', 'Unit 2'), ('Unit 1', 'Unit 3')]
+        self.assertEqual(list(mpi_work_queue(tasks, comm=MPI.COMM_SELF)),
+                         tasks)
+
+    def test_no_tasks(self):
+        self.assertEqual(list(mpi_work_queue([], comm=MPI.COMM_SELF)), [])
+
+        comm = CoordinatorComm(size=3)
+        self.assertEqual(list(mpi_work_queue([], comm=comm)), [])
+        self.assertEqual(sorted(comm.stopped), [1, 2])
+        self.assertEqual(len(comm.assigned), 0)
+
+    def test_more_ranks_than_tasks(self):
+        # The coordinator hands out each task once, and stops every worker
+        comm = CoordinatorComm(size=5)
+        self.assertEqual(list(mpi_work_queue(['a', 'b'], comm=comm)), [])
+        assigned = [index for indexes in comm.assigned.values()
+                    for index in indexes]
+        self.assertEqual(sorted(assigned), [0, 1])
+        self.assertEqual(sorted(comm.stopped), [1, 2, 3, 4])
+
+        # A worker without tasks stops after its first request
+        comm = WorkerComm(size=5, rank=4, task_indexes=[])
+        self.assertEqual(list(mpi_work_queue(['a', 'b'], comm=comm)), [])
+        self.assertEqual(comm.n_requests, 1)
+
+    def test_worker_tasks(self):
+        comm = WorkerComm(size=3, rank=1, task_indexes=[2, 0])
+        self.assertEqual(list(mpi_work_queue(['a', 'b', 'c'], comm=comm)),
+                         ['c', 'a'])
+        self.assertEqual(comm.n_requests, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
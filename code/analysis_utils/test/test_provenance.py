@@ -0,0 +1,145 @@
+import inspect
+import tempfile
+import unittest
+from pathlib import Path
+
+from alpaca import Provenance, activate, deactivate
+
+from analysis_utils.provenance import (ProvenanceHistories, batched_execution,
+                                       get_provenance_file,
+                                       suspended_tracking)
+
+
+def scale_and_shift(values, factor, offset=0, **kwargs):
+    return [value * factor + offset for value in values], factor
+
+
+@Provenance(inputs=['value'])
+def double(value):
+    return 2 * value
+
+
+class BatchedExecutionTestCase(unittest.TestCase):
+
+    def test_results(self):
+        batched = batched_execution(scale_and_shift, ['values', 'factor'])
+        results = batched([[1, 2], [3]], [2, 10], n_calls=2, offset=1)
+        self.assertEqual(results, [([3, 5], 2), ([31], 10)])
+
+    def test_output(self):
+        batched = batched_execution(scale_and_shift, ['values'], output=0)
+        results = batched(values=[[1], [2], [3]], factor=3, n_calls=3)
+        self.assertEqual(results, [[3], [6], [9]])
+
+    def test_signature(self):
+        batched = batched_execution(scale_and_shift, ['values'])
+        self.assertEqual(batched.__name__, "batched_scale_and_shift")
+        parameters = inspect.signature(batched).parameters
+        self.assertEqual(list(parameters),
+                         ['values', 'factor', 'offset', 'n_calls',
+                          'batched_function', 'kwargs'])
+        self.assertEqual(parameters['batched_function'].default,
+                         f"{__name__}.scale_and_shift")
+
+    def test_invalid_number_of_calls(self):
+        batched = batched_execution(scale_and_shift, ['values'])
+        with self.assertRaises(ValueError):
+            batched([[1], [2]], 1, n_calls=3)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            batched_execution(scale_and_shift, ['values', 'scale'])
+
+
+class ProvenanceHistoriesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._history = Provenance.history
+
+    def tearDown(self):
+        deactivate()
+        Provenance.history = self._history
+
+    def test_switch(self):
+        histories = ProvenanceHistories()
+        activate()
+
+        histories.switch("session 1")
+        double(1)
+        histories.switch("session 2")
+        double(2)
+        double(3)
+        self.assertEqual(len(Provenance.history), 2)
+
+        # Executions are added to the existing history
+        histories.switch("session 1")
+        double(4)
+        self.assertEqual(len(Provenance.history), 2)
+
+    def test_discard(self):
+        histories = ProvenanceHistories()
+        activate()
+        histories.switch("session 1")
+        double(1)
+        histories.discard("session 1")
+        self.assertEqual(Provenance.history, [])
+
+        histories.switch("session 1")
+        self.assertEqual(Provenance.history, [])
+        histories.discard("session 2")
+
+
+class SuspendedTrackingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._history = Provenance.history
+
+    def tearDown(self):
+        deactivate()
+        Provenance.history = self._history
+
+    def test_suspended(self):
+        activate(clear=True)
+        with suspended_tracking():
+            self.assertEqual(double(1), 2)
+        self.assertEqual(Provenance.history, [])
+        self.assertTrue(Provenance.active)
+        with suspended_tracking(suspend=False):
+            double(2)
+        self.assertEqual(len(Provenance.history), 1)
+
+    def test_restored_after_error(self):
+        activate(clear=True)
+        with self.assertRaises(ValueError):
+            with suspended_tracking():
+                raise ValueError
+        double(1)
+        self.assertEqual(len(Provenance.history), 1)
+
+
+
+class ProvenanceFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir = Path(self._temp_dir.name)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_get_provenance_file(self):
+        script_file = "/code/analyses/cchs/surrogate_1/compute_cchs.py"
+        self.assertEqual(
+            Path(get_provenance_file(script_file, self.temp_dir, 0)),
+            self.temp_dir / "compute_cchs.ttl")
+        self.assertEqual(
+            Path(get_provenance_file(script_file, self.temp_dir, 2)),
+            self.temp_dir / "compute_cchs_2.ttl")
+        self.assertEqual(
+            Path(get_provenance_file(script_file, self.temp_dir, 2,
+                                     resume_id="20240101T000000")),
+            self.temp_dir / "compute_cchs_resume_20240101T000000_2.ttl")
+
+
+if __name__ == "__main__":
+    unittest.main()
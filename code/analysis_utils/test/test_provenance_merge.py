@@ -0,0 +1,165 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from rdflib import BNode, Graph, Literal, Namespace, RDF
+
+from analysis_utils.backends import ProcessPoolBackend, SerialBackend
+from analysis_utils.provenance_merge import (canonical_triples,
+                                             load_canonical_triples,
+                                             merge_provenance_files,
+                                             merge_process_provenance,
+                                             save_canonical_triples)
+
+
+ALPACA = Namespace("http://purl.org/alpaca#")
+EX = Namespace("urn:example:")
+
+
+class _MPIBackend(SerialBackend):
+    # Backend seen by the only rank of an MPI run
+    name = 'mpi'
+
+
+def _write_graph(file_name, entities):
+    # Saves entities with an attribute described by a blank node, as
+    # done by Alpaca
+    graph = Graph()
+    graph.bind("alpaca", ALPACA)
+    for entity, value in entities:
+        attribute = BNode()
+        graph.add((EX[entity], RDF.type, ALPACA.DataObjectEntity))
+        graph.add((EX[entity], ALPACA.hasAttribute, attribute))
+        graph.add((attribute, RDF.type, ALPACA.NameValuePair))
+        graph.add((attribute, ALPACA.pairName, Literal("shape")))
+        graph.add((attribute, ALPACA.pairValue, Literal(value)))
+    graph.serialize(file_name, format='turtle')
+
+
+class ProvenanceMergeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir = Path(self._temp_dir.name)
+
+        # The entity `shared` is saved by all processes
+        self.files = [self.temp_dir / f"prov_{process}.ttl"
+                      for process in range(3)]
+        for process, file_name in enumerate(self.files):
+            _write_graph(file_name, [("shared", "(10,)"),
+                                     (f"entity_{process}", "(5,)")])
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _check_merged(self, file_name):
+        graph = Graph().parse(file_name)
+        # 4 entities, each with 2 triples and 3 triples of the attribute
+        self.assertEqual(len(graph), 20)
+        self.assertEqual(len(set(graph.objects(EX.shared,
+                                               ALPACA.hasAttribute))), 1)
+        self.assertEqual(len(set(graph.subjects(RDF.type,
+                                                ALPACA.NameValuePair))), 4)
+        self.assertEqual(str(dict(graph.namespaces())['alpaca']),
+                         str(ALPACA))
+
+    def test_canonical_triples(self):
+        _, triples_0 = canonical_triples(self.files[0])
+        _, triples_1 = canonical_triples(self.files[1])
+        shared_0 = {triple for triple in triples_0
+                    if triple[0] == EX.shared}
+        shared_1 = {triple for triple in triples_1
+                    if triple[0] == EX.shared}
+        self.assertEqual(shared_0, shared_1)
+        attributes = {obj for _, _, obj in shared_0 if isinstance(obj, BNode)}
+        self.assertEqual(len(attributes), 1)
+
+    def test_different_parents(self):
+        # Identical attributes of different entities are kept separate
+        _, triples = canonical_triples(self.files[0])
+        attributes = {obj for _, predicate, obj in triples
+                      if predicate == ALPACA.hasAttribute}
+        self.assertEqual(len(attributes), 2)
+
+    def test_nested_different_parents(self):
+        # Identical blank nodes nested in the attributes of different
+        # entities are also kept separate
+        graph = Graph()
+        for entity in ("entity_a", "entity_b"):
+            attribute, value = BNode(), BNode()
+            graph.add((EX[entity], ALPACA.hasAttribute, attribute))
+            graph.add((attribute, ALPACA.pairName, Literal("annotations")))
+            graph.add((attribute, ALPACA.pairValue, value))
+            graph.add((value, ALPACA.pairName, Literal("id")))
+            graph.add((value, ALPACA.pairValue, Literal(1)))
+        file_name = self.temp_dir / "nested.ttl"
+        graph.serialize(file_name, format='turtle')
+
+        _, triples = canonical_triples(file_name)
+        self.assertEqual(len(triples), 10)
+        values = {obj for _, predicate, obj in triples
+                  if predicate == ALPACA.pairValue and
+                  isinstance(obj, BNode)}
+        self.assertEqual(len(values), 2)
+
+        # Parsing again, with new blank node ids, gives the same triples
+        _, triples_again = canonical_triples(file_name)
+        self.assertEqual(triples, triples_again)
+
+    def test_canonical_files(self):
+        canonical_files = [save_canonical_triples(file_name)
+                           for file_name in self.files]
+        graphs = load_canonical_triples(canonical_files)
+        self.assertEqual(next(graphs), canonical_triples(self.files[0]))
+        self.assertFalse(canonical_files[0].exists())
+        self.assertTrue(canonical_files[1].exists())
+
+        # The files not read are removed when the iteration stops
+        graphs.close()
+        self.assertFalse(any(file_name.exists()
+                             for file_name in canonical_files))
+
+    def test_merge_files(self):
+        output_file = self.temp_dir / "merged.ttl"
+        n_triples = merge_provenance_files(self.files, output_file,
+                                           n_workers=2)
+        self.assertEqual(n_triples, 20)
+        self._check_merged(output_file)
+        self.assertTrue(all(file_name.exists() for file_name in self.files))
+
+    def test_merge_and_remove(self):
+        merge_provenance_files(self.files, self.files[0], n_workers=1,
+                               remove_inputs=True)
+        self._check_merged(self.files[0])
+        self.assertFalse(self.files[1].exists())
+        self.assertFalse(self.files[2].exists())
+
+    def test_merge_process_provenance(self):
+        backend = ProcessPoolBackend(n_workers=2)
+        merge_process_provenance(backend, lambda process: self.files[process],
+                                 self.files[0])
+        self._check_merged(self.files[0])
+        self.assertEqual(list(self.temp_dir.iterdir()), [self.files[0]])
+
+    def test_merge_mpi_process_provenance(self):
+        merge_process_provenance(_MPIBackend(),
+                                 lambda process: self.files[process],
+                                 self.temp_dir / "merged.ttl")
+        graph = Graph().parse(self.temp_dir / "merged.ttl")
+        self.assertEqual(len(graph), 10)
+        self.assertEqual(sorted(self.temp_dir.iterdir()),
+                         sorted([self.temp_dir / "merged.ttl"] +
+                                self.files[1:]))
+
+    def test_merge_serial_process_provenance(self):
+        merge_process_provenance(SerialBackend(),
+                                 lambda process: self.files[process],
+                                 self.temp_dir / "merged.ttl")
+        graph = Graph().parse(self.temp_dir / "merged.ttl")
+        self.assertEqual(len(graph), 10)
+        self.assertFalse(self.files[0].exists())
+        self.assertTrue(self.files[1].exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import numpy as np
+
+from analysis_utils.seeding import (RandomStreams, derive_seed,
+                                    seed_global_generators, seed_sequence)
+
+
+class DeriveSeedTestCase(unittest.TestCase):
+
+    def test_reproducible(self):
+        self.assertEqual(derive_seed(689, "Unit 1"),
+                         derive_seed(689, "Unit 1"))
+        self.assertEqual(derive_seed(689, "Unit 1", 3),
+                         derive_seed(689, "Unit 1", 3))
+
+    def test_different_keys(self):
+        seeds = {derive_seed(689, "Unit 1"), derive_seed(689, "Unit 2"),
+                 derive_seed(689, "Unit 1", 0), derive_seed(690, "Unit 1")}
+        self.assertEqual(len(seeds), 4)
+
+    def test_valid_seed(self):
+        seed = derive_seed(689, "Unit 1")
+        self.assertIsInstance(seed, int)
+        self.assertTrue(0 <= seed < 2 ** 32)
+
+    def test_invalid_keys(self):
+        with self.assertRaises(TypeError):
+            derive_seed(689, 1.5)
+        with self.assertRaises(ValueError):
+            derive_seed(689, -1)
+
+    def test_seed_global_generators(self):
+        seed_global_generators(derive_seed(689, "Unit 1"))
+        first = np.random.random_sample(5)
+        seed_global_generators(derive_seed(689, "Unit 1"))
+        np.testing.assert_array_equal(first, np.random.random_sample(5))
+
+    def test_seed_sequence(self):
+        self.assertEqual(seed_sequence(689, "Unit 1", 3).generate_state(1)[0],
+                         derive_seed(689, "Unit 1", 3))
+
+
+class RandomStreamsTestCase(unittest.TestCase):
+
+    def test_keyed_reproducible(self):
+        streams = RandomStreams(689)
+        streams.seed("Unit 1", 0)
+        first = np.random.random_sample(5)
+        streams.seed("Unit 2", 0)
+        other = np.random.random_sample(5)
+
+        # The numbers of a unit of work do not depend on the order
+        streams.seed("Unit 2", 0)
+        np.testing.assert_array_equal(other, np.random.random_sample(5))
+        streams.seed("Unit 1", 0)
+        np.testing.assert_array_equal(first, np.random.random_sample(5))
+        self.assertFalse(np.array_equal(first, other))
+
+    def test_sequential(self):
+        streams = RandomStreams(689, mode='sequential')
+        streams.start()
+        streams.seed("Unit 1")
+        first = np.random.random_sample(5)
+        seed_global_generators(689)
+        np.testing.assert_array_equal(first, np.random.random_sample(5))
+
+    def test_generator(self):
+        streams = RandomStreams(689)
+        np.testing.assert_array_equal(
+            streams.generator("Unit 1").random(5),
+            streams.generator("Unit 1").random(5))
+        self.assertFalse(np.array_equal(
+            streams.generator("Unit 1").random(5),
+            streams.generator("Unit 2").random(5)))
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            RandomStreams(689, mode='random')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from analysis_utils.sessions import (check_session_names,
+                                     expand_session_files, get_session_name,
+                                     process_session_tasks)
+
+
+class ExpandSessionFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self._temp_dir.name)
+        for name in ("l101210-001_no_raw.nix", "i140703-001_no_raw.nix",
+                     "i140703-001.nix"):
+            (self.data_dir / name).touch()
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_pattern(self):
+        session_files = expand_session_files(
+            [str(self.data_dir / "*_no_raw.nix")])
+        self.assertEqual(session_files,
+                         [self.data_dir / "i140703-001_no_raw.nix",
+                          self.data_dir / "l101210-001_no_raw.nix"])
+
+    def test_files_and_patterns(self):
+        session_files = expand_session_files(
+            [self.data_dir / "l101210-001_no_raw.nix",
+             str(self.data_dir / "i*.nix"),
+             str(self.data_dir / "i140703-001.nix"),
+             self.data_dir / ".." / self.data_dir.name / "i140703-001.nix"])
+        self.assertEqual(session_files,
+                         [self.data_dir / "l101210-001_no_raw.nix",
+                          self.data_dir / "i140703-001.nix",
+                          self.data_dir / "i140703-001_no_raw.nix"])
+
+    def test_missing_file(self):
+        # Files are not checked, only patterns
+        missing = self.data_dir / "missing.nix"
+        self.assertEqual(expand_session_files([missing]), [missing])
+        with self.assertRaises(FileNotFoundError):
+            expand_session_files([str(self.data_dir / "missing*.nix")])
+
+    def test_check_session_names(self):
+        check_session_names(["i140703-001", "l101210-001"])
+        with self.assertRaisesRegex(ValueError, "i140703-001$"):
+            check_session_names(["i140703-001", "l101210-001",
+                                 "i140703-001"])
+
+
+    def test_get_session_name(self):
+        self.assertEqual(get_session_name("data/i140703-001_no_raw.nix"),
+                         "i140703-001")
+        self.assertEqual(get_session_name(Path("l101210-001.nix")),
+                         "l101210-001")
+
+
+class _Histories:
+    # Records the sessions switched to
+
+    def __init__(self):
+        self.sessions = []
+
+    def switch(self, session_name):
+        self.sessions.append(session_name)
+
+
+class ProcessSessionTasksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.processed = []
+        self.tasks = [('session_1', 'Unit 1'), ('session_1', 'Unit 2'),
+                      ('session_2', 'Unit 1')]
+        self.sessions = {'session_1': {'session': 1},
+                         'session_2': {'session': 2}}
+
+    def process_units(self, units, worker, session, scale):
+        self.processed.extend((session, unit, scale) for unit in units)
+
+    def test_sessions(self):
+        histories = _Histories()
+        starts = []
+        process_session_tasks(iter(self.tasks), None, self.process_units,
+                              self.sessions, histories,
+                              session_start=lambda: starts.append(1),
+                              scale=2)
+        self.assertEqual(self.processed, [(1, 'Unit 1', 2), (1, 'Unit 2', 2),
+                                          (2, 'Unit 1', 2)])
+        self.assertEqual(histories.sessions, ['session_1', 'session_2'])
+        self.assertEqual(len(starts), 2)
+
+    def test_worker(self):
+        # Workers save the provenance of each session to their own files
+        histories = _Histories()
+        process_session_tasks(iter(self.tasks), 1, self.process_units,
+                              self.sessions, histories, scale=1)
+        self.assertEqual(len(self.processed), 3)
+        self.assertEqual(histories.sessions, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+
+import numpy as np
+import quantities as pq
+
+import neo
+from elephant.spike_train_surrogates import dither_spikes, trial_shifting
+
+from analysis_utils.seeding import RandomStreams, derive_seed
+from analysis_utils.surrogate_provider import (SurrogateStreams, skip_draws,
+                                               surrogate_seeds)
+
+
+class SurrogateSeedsTestCase(unittest.TestCase):
+
+    def test_seeds(self):
+        seeds = surrogate_seeds(689, "Unit 1", 3)
+        self.assertEqual(seeds, [derive_seed(689, "Unit 1", k)
+                                 for k in range(3)])
+        self.assertEqual(len(set(seeds)), 3)
+
+    def test_prefix(self):
+        # Surrogate k has the same seed for any number of surrogates
+        self.assertEqual(surrogate_seeds(689, "Unit 1", 5)[:2],
+                         surrogate_seeds(689, "Unit 1", 2))
+        self.assertNotEqual(surrogate_seeds(689, "Unit 1", 2),
+                            surrogate_seeds(689, "Unit 2", 2))
+
+    def test_blocks(self):
+        # The seeds of the blocks are the ones of all surrogates
+        seeds = surrogate_seeds(689, "Unit 1", 5)
+        self.assertEqual(surrogate_seeds(689, "Unit 1", 3) +
+                         surrogate_seeds(689, "Unit 1", 2, first_surrogate=3),
+                         seeds)
+
+
+class SkipDrawsTestCase(unittest.TestCase):
+
+    def test_skip(self):
+        np.random.seed(3)
+        np.random.random_sample(25)
+        expected = np.random.random_sample(4)
+        np.random.seed(3)
+        skip_draws(25, max_draws=10)
+        np.testing.assert_array_equal(np.random.random_sample(4), expected)
+
+
+class SurrogateStreamsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.trials = {
+            unit: [neo.SpikeTrain(np.sort(rng.uniform(0, 800, n_spikes)) *
+                                  pq.ms, t_stop=800 * pq.ms)
+                   for n_spikes in counts]
+            for unit, counts in (("Unit 1", (12, 0, 30)),
+                                 ("Unit 2", (4, 9, 1)))}
+        self.random_streams = RandomStreams(689)
+
+    def _assert_same(self, surrogates, expected):
+        self.assertEqual(len(surrogates), len(expected))
+        for surrogate, expected_surrogate in zip(surrogates, expected):
+            np.testing.assert_array_equal(surrogate.magnitude,
+                                          expected_surrogate.magnitude)
+
+    def test_blocks_of_all_trials(self):
+        expected = {}
+        for unit, trials in self.trials.items():
+            self.random_streams.seed(unit)
+            expected[unit] = trial_shifting(trials, dither=15 * pq.ms,
+                                            n_surrogates=7)
+
+        streams = SurrogateStreams(self.random_streams)
+        for unit in self.trials:
+            streams.start(unit)
+        # The blocks of both units are interleaved, as in a pair
+        blocks = {unit: [] for unit in self.trials}
+        for n_surrogates in (3, 3, 1):
+            for unit, trials in self.trials.items():
+                with streams.resume(unit):
+                    blocks[unit].extend(trial_shifting(
+                        trials, dither=15 * pq.ms,
+                        n_surrogates=n_surrogates))
+        for unit in self.trials:
+            for surrogate, expected_surrogate in zip(blocks[unit],
+                                                     expected[unit]):
+                self._assert_same(surrogate, expected_surrogate)
+
+    def test_blocks_of_each_trial(self):
+        trials = self.trials["Unit 1"]
+        self.random_streams.seed("Unit 1")
+        expected = [dither_spikes(spiketrain, dither=25 * pq.ms,
+                                  n_surrogates=7)
+                    for spiketrain in trials]
+
+        streams = SurrogateStreams(self.random_streams)
+        streams.start("Unit 1", n_surrogates=7,
+                      trial_draws=[len(spiketrain) for spiketrain in trials])
+        blocks = [[] for _ in trials]
+        for n_surrogates in (4, 2, 1):
+            for trial, spiketrain in enumerate(trials):
+                with streams.resume("Unit 1", trial):
+                    blocks[trial].extend(dither_spikes(
+                        spiketrain, dither=25 * pq.ms,
+                        n_surrogates=n_surrogates))
+        for block, expected_trial in zip(blocks, expected):
+            self._assert_same(block, expected_trial)
+
+    def test_clear(self):
+        streams = SurrogateStreams(self.random_streams)
+        streams.start("Unit 1")
+        streams.clear()
+        with self.assertRaises(KeyError):
+            with streams.resume("Unit 1"):
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
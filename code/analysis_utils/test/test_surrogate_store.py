@@ -0,0 +1,135 @@
+import random
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import quantities as pq
+
+import neo
+from elephant.spike_train_surrogates import dither_spikes, trial_shifting
+
+from analysis_utils.surrogate_store import SurrogateStore, hash_file
+from analysis_utils.surrogates import dither_spike_times
+
+
+class SurrogateStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.spiketrain = neo.SpikeTrain(
+            np.sort(np.random.default_rng(1).uniform(0, 1000, 50)) * pq.ms,
+            t_start=0 * pq.ms, t_stop=1000 * pq.ms,
+            sampling_rate=30 * pq.kHz)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _dither(self, store, seed=0, **kwargs):
+        np.random.seed(seed)
+        surrogates = store.cached(dither_spikes)(
+            self.spiketrain, dither=15 * pq.ms, n_surrogates=5, **kwargs)
+        return surrogates, np.random.random_sample()
+
+    def assertSpikeTrainsEqual(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for st1, st2 in zip(first, second):
+            np.testing.assert_array_equal(st1.magnitude, st2.magnitude)
+            self.assertEqual(st1.units, st2.units)
+            self.assertEqual(st1.t_start, st2.t_start)
+            self.assertEqual(st1.t_stop, st2.t_stop)
+            self.assertEqual(st1.sampling_rate, st2.sampling_rate)
+
+    def test_disabled(self):
+        store = SurrogateStore()
+        self.assertFalse(store.enabled)
+        surrogates, _ = self._dither(store)
+        self.assertEqual(len(surrogates), 5)
+        self.assertEqual(store.hits + store.misses, 0)
+
+    def test_same_results(self):
+        expected, expected_next = self._dither(SurrogateStore())
+
+        store = SurrogateStore(self.temp_dir.name)
+        stored, stored_next = self._dither(store)
+        loaded, loaded_next = self._dither(store)
+        self.assertEqual((store.hits, store.misses), (1, 1))
+
+        self.assertSpikeTrainsEqual(stored, expected)
+        self.assertSpikeTrainsEqual(loaded, expected)
+        # The random generator continues as if surrogates were generated
+        self.assertEqual(stored_next, expected_next)
+        self.assertEqual(loaded_next, expected_next)
+
+    def test_shared_between_instances(self):
+        self._dither(SurrogateStore(self.temp_dir.name))
+        store = SurrogateStore(self.temp_dir.name)
+        self._dither(store)
+        self.assertEqual((store.hits, store.misses), (1, 0))
+
+    def test_key_changes(self):
+        store = SurrogateStore(self.temp_dir.name)
+        self._dither(store)
+        self._dither(store, seed=1)
+        self._dither(store, edges=False)
+        store.set_context(unit="Unit 1")
+        self._dither(store)
+        self.assertEqual((store.hits, store.misses), (0, 4))
+
+    def test_nested_structure(self):
+        trials = [self.spiketrain, self.spiketrain.time_slice(0 * pq.ms,
+                                                              800 * pq.ms)]
+        cached_trial_shifting = SurrogateStore(
+            self.temp_dir.name).cached(trial_shifting)
+
+        results = []
+        for _ in range(2):
+            random.seed(0)
+            np.random.seed(0)
+            results.append(cached_trial_shifting(
+                trials, dither=15 * pq.ms, n_surrogates=3))
+        self.assertEqual(len(results[1]), 3)
+        for first, second in zip(*results):
+            self.assertEqual(len(second), 2)
+            self.assertSpikeTrainsEqual(first, second)
+
+    def test_spike_time_array(self):
+        cached_dither = SurrogateStore(
+            self.temp_dir.name).cached(dither_spike_times)
+
+        results = []
+        for _ in range(2):
+            np.random.seed(0)
+            results.append((cached_dither(self.spiketrain, dither=15 * pq.ms,
+                                          n_surrogates=3),
+                            np.random.random_sample()))
+        (stored, stored_next), (loaded, loaded_next) = results
+        self.assertEqual(loaded.units, stored.units)
+        np.testing.assert_array_equal(loaded.magnitude, stored.magnitude)
+        self.assertEqual(loaded_next, stored_next)
+
+        # The loaded array is a read-only view of the memory-mapped file
+        self.assertFalse(loaded.flags.writeable)
+        self.assertFalse(loaded.flags.owndata)
+
+    def test_failed_save(self):
+        # No temporary folders are left in the store after a failure
+        store = SurrogateStore(self.temp_dir.name)
+        with mock.patch('json.dump', side_effect=TypeError):
+            with self.assertRaises(TypeError):
+                self._dither(store)
+        self.assertEqual(
+            [path.name for path in Path(self.temp_dir.name).rglob("*")
+             if path.is_dir() and path.name.startswith(".")], [])
+
+    def test_hash_file(self):
+        file_name = f"{self.temp_dir.name}/data.bin"
+        with open(file_name, 'wb') as data_file:
+            data_file.write(b"spikes")
+        self.assertEqual(hash_file(file_name), hash_file(file_name,
+                                                         chunk_size=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+import random
+import unittest
+
+import numpy as np
+import quantities as pq
+
+import neo
+from elephant.spike_train_surrogates import dither_spikes, trial_shifting
+
+from alpaca import Provenance, activate, deactivate
+
+from analysis_utils.surrogates import (dither_spike_times, draw_trial_shifts,
+                                       shift_trial_spike_times,
+                                       split_surrogates,
+                                       trial_shifting_spike_times)
+
+
+# Generations tracking each surrogate, as in the surrogate ISIH scripts
+tracked_dither_spike_times = Provenance(
+    inputs=['spiketrain'],
+    container_output=True)(split_surrogates(dither_spike_times))
+tracked_trial_shifting_spike_times = Provenance(
+    inputs=['shifts'], container_input=['spiketrains'],
+    container_output=(1, 1))(trial_shifting_spike_times)
+
+
+class DitherSpikeTimesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        times = np.sort(rng.uniform(0, 1, 80))
+        # Spikes close to the ends are dithered outside the spike train
+        times[0], times[-1] = 0.002, 0.995
+        self.spiketrain = neo.SpikeTrain(times * pq.s, t_stop=1 * pq.s)
+
+    def _compare(self, spiketrain, **kwargs):
+        np.random.seed(42)
+        expected = dither_spikes(spiketrain, dither=15 * pq.ms,
+                                 n_surrogates=10, **kwargs)
+        expected_next = np.random.random_sample()
+
+        np.random.seed(42)
+        times = dither_spike_times(spiketrain, dither=15 * pq.ms,
+                                   n_surrogates=10, **kwargs)
+        self.assertEqual(np.random.random_sample(), expected_next)
+
+        self.assertEqual(times.shape, (10, len(spiketrain)))
+        self.assertEqual(times.units, spiketrain.units)
+        for surrogate, row in zip(expected, times.magnitude):
+            row_times = row[~np.isnan(row)]
+            np.testing.assert_array_equal(row_times, surrogate.magnitude)
+            # The removed spikes are at the end of the row
+            self.assertTrue(np.isnan(row[len(row_times):]).all())
+        return times
+
+    def test_same_as_dither_spikes(self):
+        times = self._compare(self.spiketrain)
+        self.assertTrue(np.isnan(times.magnitude).any())
+
+    def test_no_edges(self):
+        times = self._compare(self.spiketrain, edges=False)
+        self.assertFalse(np.isnan(times.magnitude).any())
+
+    def test_empty(self):
+        self._compare(neo.SpikeTrain([] * pq.s, t_stop=1 * pq.s))
+
+
+
+class TrialShiftingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.trials = [
+            neo.SpikeTrain(np.sort(rng.uniform(100, 2000, n_spikes)) * pq.ms,
+                           t_start=100 * pq.ms, t_stop=2000 * pq.ms)
+            for n_spikes in (30, 0, 55, 1)]
+
+    def test_same_as_trial_shifting(self):
+        random.seed(0)
+        expected = trial_shifting(self.trials, dither=30 * pq.ms,
+                                  n_surrogates=8)
+        expected_next = random.random()
+
+        random.seed(0)
+        shifts = draw_trial_shifts(self.trials, n_surrogates=8)
+        self.assertEqual(random.random(), expected_next)
+        self.assertEqual(shifts.shape, (8, 4))
+
+        for trial, spiketrain in enumerate(self.trials):
+            times = shift_trial_spike_times(spiketrain, dither=30 * pq.ms,
+                                            shifts=shifts[:, trial])
+            self.assertEqual(times.shape, (8, len(spiketrain)))
+            self.assertEqual(times.units, pq.ms)
+            for surrogate, row in zip(expected, times.magnitude):
+                np.testing.assert_array_equal(row,
+                                              surrogate[trial].magnitude)
+
+    def test_all_trials(self):
+        random.seed(0)
+        expected = trial_shifting(self.trials, dither=30 * pq.ms,
+                                  n_surrogates=8)
+
+        random.seed(0)
+        shifts = draw_trial_shifts(self.trials, n_surrogates=8)
+        surrogates = trial_shifting_spike_times(self.trials,
+                                                dither=30 * pq.ms,
+                                                shifts=shifts)
+        self.assertEqual(len(surrogates), 8)
+        for surrogate, expected_surrogate in zip(surrogates, expected):
+            self.assertEqual(len(surrogate), len(self.trials))
+            for times, spiketrain in zip(surrogate, expected_surrogate):
+                np.testing.assert_array_equal(times.magnitude,
+                                              spiketrain.magnitude)
+
+
+class SplitSurrogatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._history = Provenance.history
+        rng = np.random.default_rng(5)
+        times = np.sort(rng.uniform(0, 1, 40))
+        self.spiketrain = neo.SpikeTrain(times * pq.s, t_stop=1 * pq.s)
+
+    def tearDown(self):
+        deactivate()
+        Provenance.history = self._history
+
+    def test_split(self):
+        generate = split_surrogates(dither_spike_times)
+        self.assertEqual(generate.__name__, "dither_spike_times")
+
+        np.random.seed(8)
+        expected = dither_spike_times(self.spiketrain, dither=15 * pq.ms,
+                                      n_surrogates=6)
+        np.random.seed(8)
+        surrogates = generate(self.spiketrain, dither=15 * pq.ms,
+                              n_surrogates=6)
+        self.assertEqual(len(surrogates), 6)
+        for surrogate, row in zip(surrogates, expected):
+            self.assertEqual(surrogate.units, pq.s)
+            np.testing.assert_array_equal(surrogate.magnitude,
+                                          row.magnitude)
+
+    def test_tracked_surrogates(self):
+        # Each surrogate is a separate output of the generation
+        Provenance.history = []
+        activate()
+        tracked_dither_spike_times(self.spiketrain, dither=15 * pq.ms,
+                                   n_surrogates=6)
+        deactivate()
+
+        self.assertEqual(len(Provenance.history), 1)
+        outputs = Provenance.history[0].output
+        self.assertEqual(len(outputs), 6)
+        self.assertEqual(len({output.hash for output in outputs.values()}),
+                         6)
+
+    def test_tracked_trial_shifting_surrogates(self):
+        # The surrogates of all trials are outputs of a single generation,
+        # that uses the amount of dithering
+        trials = [self.spiketrain, self.spiketrain[:20]]
+        shifts = draw_trial_shifts(trials, n_surrogates=6)
+        Provenance.history = []
+        activate()
+        tracked_trial_shifting_spike_times(trials, dither=30 * pq.ms,
+                                           shifts=shifts)
+        deactivate()
+
+        # The trials of each surrogate are members of its output
+        executions = [execution for execution in Provenance.history
+                      if execution.function.name ==
+                      "trial_shifting_spike_times"]
+        self.assertEqual(len(executions), 1)
+        execution = executions[0]
+        self.assertEqual(execution.params['dither'], 30 * pq.ms)
+        self.assertEqual(len(execution.output), 6)
+        self.assertEqual(len(Provenance.history), 1 + 6 * len(trials))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import pickle
+import unittest
+
+import numpy as np
+import quantities as pq
+
+import neo
+
+from analysis_utils.trial_data import TrialSpikeTrains
+
+
+class TrialSpikeTrainsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.spiketrains = {
+            'Unit 1': [
+                neo.SpikeTrain([1, 2, 3] * pq.ms, t_stop=10 * pq.ms,
+                               sampling_rate=30 * pq.kHz, sua=True, SNR=6.),
+                neo.SpikeTrain([4] * pq.ms, t_stop=9 * pq.ms,
+                               sampling_rate=30 * pq.kHz, sua=True, SNR=6.)],
+            'Unit 2': [
+                neo.SpikeTrain([] * pq.s, t_stop=0.01 * pq.s),
+                neo.SpikeTrain([0.005] * pq.s, t_start=0.001 * pq.s,
+                               t_stop=0.009 * pq.s)]}
+        self.container = TrialSpikeTrains.from_spiketrains(self.spiketrains)
+
+    def test_from_spiketrains(self):
+        container = self.container
+        self.assertEqual(container.unit_ids, ['Unit 1', 'Unit 2'])
+        self.assertEqual((container.n_units, container.n_trials), (2, 2))
+        np.testing.assert_array_equal(container.times, [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(container.offsets,
+                                      [[0, 3, 4], [4, 4, 5]])
+        np.testing.assert_array_equal(container.spike_counts(),
+                                      [[3, 1], [0, 1]])
+        self.assertEqual(container.units['sua'].tolist(), [True, False])
+        self.assertEqual(container.units['SNR'][0], 6.)
+        self.assertTrue(np.isnan(container.units['SNR'][1]))
+
+    def test_trial_views(self):
+        times = self.container.trial_times('Unit 1', 0)
+        np.testing.assert_array_equal(times, [1, 2, 3])
+        self.assertTrue(np.shares_memory(times, self.container.times))
+        with self.assertRaises(ValueError):
+            times[0] = 0
+
+    def test_spiketrains(self):
+        for unit_id, expected in self.spiketrains.items():
+            spiketrains = self.container.spiketrains(unit_id)
+            self.assertEqual(len(spiketrains), 2)
+            for spiketrain, original in zip(spiketrains, expected):
+                if len(original):
+                    self.assertTrue(np.shares_memory(spiketrain,
+                                                     self.container.times))
+                self.assertEqual(spiketrain.units, pq.ms)
+                np.testing.assert_array_equal(
+                    spiketrain.magnitude,
+                    original.rescale(pq.ms).magnitude)
+                self.assertEqual(spiketrain.t_start, original.t_start)
+                self.assertEqual(spiketrain.t_stop, original.t_stop)
+                self.assertEqual(spiketrain.sampling_rate, 30 * pq.kHz)
+                self.assertEqual(spiketrain.annotations['id'], unit_id)
+
+    def test_pickle(self):
+        container = pickle.loads(pickle.dumps(self.container))
+        self.assertEqual(container.unit_ids, self.container.unit_ids)
+        np.testing.assert_array_equal(
+            container.spiketrain('Unit 2', 1).magnitude, [5])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            TrialSpikeTrains.from_spiketrains(
+                {'Unit 1': self.spiketrains['Unit 1'],
+                 'Unit 2': self.spiketrains['Unit 2'][:1]})
+        with self.assertRaises(ValueError):
+            TrialSpikeTrains(self.container.times, [[0, 3, 6]],
+                             [[[0, 10], [0, 9]]], self.container.units[:1],
+                             pq.ms)
+
+    def test_empty(self):
+        container = TrialSpikeTrains.from_spiketrains({})
+        self.assertEqual(container.unit_ids, [])
+        self.assertEqual(container.spike_counts().shape, (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
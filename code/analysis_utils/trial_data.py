@@ -0,0 +1,216 @@
+"""
+Compact storage of the spike trains of the units selected in the trials of
+a session.
+
+The analysis scripts select the spike train of each unit in each trial. As
+`neo.SpikeTrain` objects, each of them carries its own quantities and
+annotations. `TrialSpikeTrains` stores the spike times of all units and
+trials in a single buffer instead, with offsets to the spikes of each trial
+(as in a compressed sparse row matrix), and a table with the metadata of the
+units. The spike times of a trial are views of the buffer, that are
+converted to `neo.SpikeTrain` objects sharing the buffer only when a
+function requires them. The container is also cheap to pickle, e.g., to
+send to other processes.
+"""
+
+import numpy as np
+import quantities as pq
+
+import neo
+
+
+# Metadata of each unit, from the annotations of its spike trains
+UNIT_DTYPE = np.dtype([('id', object), ('sua', bool), ('SNR', np.float64)])
+
+
+class TrialSpikeTrains:
+    """
+    Spike trains of several units in the same trials, stored in a single
+    buffer.
+
+    The spikes of unit `u` in trial `k` are
+    `times[offsets[u, k]:offsets[u, k + 1]]`, where the trials of each unit
+    are consecutive. Usually created with `from_spiketrains`.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        Spike times of all units and trials, in `time_units`. The container
+        keeps a read-only view of the array.
+    offsets : np.ndarray
+        Array of shape (number of units, number of trials + 1) with the
+        start and stop index in `times` of each trial of each unit.
+    bounds : np.ndarray
+        Array of shape (number of units, number of trials, 2) with the
+        `t_start` and `t_stop` of each spike train, in `time_units`.
+    units : np.ndarray
+        Structured array with the id, SUA flag and SNR of each unit (see
+        `UNIT_DTYPE`).
+    time_units : pq.Quantity
+        Units of the spike times.
+    sampling_rate : pq.Quantity, optional
+        Sampling rate of the spike trains.
+        Default: 1 Hz
+
+    Raises
+    ------
+    ValueError
+        If the shapes of the arrays do not match, or the unit ids are not
+        unique.
+    """
+
+    __slots__ = ('times', 'offsets', 'bounds', 'units', 'time_units',
+                 'sampling_rate', '_unit_index')
+
+    def __init__(self, times, offsets, bounds, units, time_units,
+                 sampling_rate=1 * pq.Hz):
+        times = np.asarray(times, dtype=np.float64).view()
+        times.flags.writeable = False
+        offsets = np.asarray(offsets, dtype=np.int64)
+        bounds = np.asarray(bounds, dtype=np.float64)
+        units = np.asarray(units, dtype=UNIT_DTYPE)
+
+        if offsets.ndim != 2 or offsets.shape[0] != len(units):
+            raise ValueError("The offsets must have one row per unit")
+        if bounds.shape != (len(units), offsets.shape[1] - 1, 2):
+            raise ValueError("The bounds must have one entry per unit and "
+                             "trial")
+        if offsets.size and (offsets.min() < 0 or
+                             offsets.max() > len(times) or
+                             np.any(np.diff(offsets, axis=1) < 0)):
+            raise ValueError("The offsets are out of the spike times")
+
+        self.times = times
+        self.offsets = offsets
+        self.bounds = bounds
+        self.units = units
+        self.time_units = pq.Quantity(1, time_units).units
+        self.sampling_rate = sampling_rate
+        self._unit_index = {unit_id: index for index, unit_id in
+                            enumerate(units['id'])}
+        if len(self._unit_index) != len(units):
+            raise ValueError("The unit ids must be unique")
+
+    @classmethod
+    def from_spiketrains(cls, spiketrains):
+        """
+        Stores the spike trains of several units in the same trials.
+
+        Parameters
+        ----------
+        spiketrains : dict
+            Dictionary where the unit id is the key and the value is a list
+            of `neo.SpikeTrain`s, one per trial. The SUA flag and the SNR of
+            each unit are taken from the annotations `sua` and `SNR` of its
+            first spike train (False and NaN if missing).
+
+        Returns
+        -------
+        TrialSpikeTrains
+            Container with the units in the order of `spiketrains`, and the
+            spike times in the units of the first spike train.
+
+        Raises
+        ------
+        ValueError
+            If the units do not have the same number of trials.
+        """
+        n_trials = {len(unit_spiketrains)
+                    for unit_spiketrains in spiketrains.values()}
+        if len(n_trials) > 1:
+            raise ValueError("All units must have the same number of trials")
+        n_units, n_trials = len(spiketrains), max(n_trials, default=0)
+
+        all_spiketrains = [st for unit_spiketrains in spiketrains.values()
+                           for st in unit_spiketrains]
+        time_units, sampling_rate = pq.s, 1 * pq.Hz
+        if all_spiketrains:
+            time_units = all_spiketrains[0].units
+            sampling_rate = all_spiketrains[0].sampling_rate
+
+        times = [st.rescale(time_units).magnitude for st in all_spiketrains]
+        bounds = [(st.t_start.rescale(time_units).magnitude.item(),
+                   st.t_stop.rescale(time_units).magnitude.item())
+                  for st in all_spiketrains]
+
+        # Offsets of the consecutive spike trains, where each unit starts
+        # at the stop of the last trial of the previous unit
+        offsets = np.zeros(len(times) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(st_times) for st_times in times])
+        offsets = offsets[np.arange(n_units)[:, np.newaxis] * n_trials +
+                          np.arange(n_trials + 1)]
+
+        units = np.empty(n_units, dtype=UNIT_DTYPE)
+        for index, (unit_id, unit_spiketrains) in enumerate(
+                spiketrains.items()):
+            annotations = unit_spiketrains[0].annotations \
+                if unit_spiketrains else {}
+            units[index] = (unit_id, bool(annotations.get('sua', False)),
+                            annotations.get('SNR', np.nan))
+
+        return cls(np.concatenate(times) if times else np.empty(0), offsets,
+                   np.reshape(np.array(bounds, dtype=np.float64),
+                              (n_units, n_trials, 2)),
+                   units, time_units, sampling_rate=sampling_rate)
+
+    @property
+    def n_units(self):
+        """
+        Number of units.
+        """
+        return len(self.units)
+
+    @property
+    def n_trials(self):
+        """
+        Number of trials of each unit.
+        """
+        return self.offsets.shape[1] - 1
+
+    @property
+    def unit_ids(self):
+        """
+        List with the id of each unit, in the order of storage.
+        """
+        return list(self._unit_index)
+
+    def spike_counts(self):
+        """
+        Returns the number of spikes of each unit in each trial, as an array
+        of shape (number of units, number of trials).
+        """
+        return np.diff(self.offsets, axis=1)
+
+    def trial_times(self, unit_id, trial):
+        """
+        Returns the spike times of a unit in a trial, as a read-only view of
+        the buffer (in `time_units`).
+        """
+        unit = self._unit_index[unit_id]
+        return self.times[self.offsets[unit, trial]:
+                          self.offsets[unit, trial + 1]]
+
+    def spiketrain(self, unit_id, trial):
+        """
+        Returns the spike train of a unit in a trial as a `neo.SpikeTrain`,
+        that shares the spike times with the buffer. The id, SUA flag and
+        SNR of the unit are annotations of the spike train.
+        """
+        unit = self._unit_index[unit_id]
+        t_start, t_stop = self.bounds[unit, trial]
+        return neo.SpikeTrain(self.trial_times(unit_id, trial),
+                              units=self.time_units,
+                              t_start=t_start * self.time_units,
+                              t_stop=t_stop * self.time_units,
+                              sampling_rate=self.sampling_rate,
+                              id=unit_id,
+                              sua=bool(self.units['sua'][unit]),
+                              SNR=float(self.units['SNR'][unit]))
+
+    def spiketrains(self, unit_id):
+        """
+        Returns a list with the `neo.SpikeTrain` of each trial of a unit (see
+        `spiketrain`).
+        """
+        return [self.spiketrain(unit_id, trial)
+                for trial in range(self.n_trials)]
@@ -0,0 +1,43 @@
+"""
+This script merges several provenance files saved as Turtle files into a
+single file.
+
+The intended use is to combine the files saved by the processes of a
+parallel analysis (e.g., one file per MPI rank), that describe the shared
+data several times, before inserting them into the triple store. Nodes and
+triples present in more than one file are stored only once. The files are
+read in parallel.
+"""
+
+from pathlib import Path
+import argparse
+import logging
+
+from analysis_utils.provenance_merge import merge_provenance_files
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main(input_files, output_file, workers=None, remove=False):
+    logging.info(f"Merging {len(input_files)} files into {output_file}")
+    n_triples = merge_provenance_files(input_files, output_file,
+                                       n_workers=workers,
+                                       remove_inputs=remove)
+    logging.info(f"Saved {n_triples} triples")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--workers', type=int, required=False, default=None)
+    parser.add_argument('--remove', action='store_true',
+                        help="remove the input files after merging")
+    parser.add_argument('input_files', type=str, nargs="+")
+    args = parser.parse_args()
+
+    input_files = [Path(input_file).expanduser().absolute()
+                   for input_file in args.input_files]
+    output_file = Path(args.output).expanduser().absolute()
+
+    main(input_files, output_file, workers=args.workers, remove=args.remove)
@@ -11,15 +11,37 @@
 # symbolic link was created. If using the dataset by providing the path to the
 # local GIN repository folder, please change $DATA_I accordingly.
 #
+# The surrogate ISIH analyses can process several sessions in one run, by
+# setting SESSIONS to their files or to glob patterns (e.g.,
+# SESSIONS='./data/*_no_raw.nix'). The outputs of each session are saved in
+# its own folder.
+#
 # Outputs will be stored into the `analyses` subfolder in the `outputs` folder
 # with respect to the root of the repository. To change, please modify the
 # $OUTPUT_FOLDER variable below.
+#
+# To store the generated spike train surrogates, set SURROGATE_STORE to a
+# folder (e.g., SURROGATE_STORE=./outputs/surrogate_store), that is not
+# cleared between runs. Surrogates are then reused by any later run (of these
+# or of the CCH scripts) with the same data, parameters and seed. The folder
+# can be safely deleted to free disk space. The store is not used by default,
+# so that the surrogates are generated (and recorded in the provenance) by
+# each run.
 
 
 DATA_I=./data/i140703-001_no_raw.nix
 
+SESSIONS=${SESSIONS:-$DATA_I}
+
 OUTPUT_FOLDER=./outputs/analyses
 
+SURROGATE_STORE=${SURROGATE_STORE:-}
+
+STORE_FLAG=""
+if [ -n "$SURROGATE_STORE" ]; then
+    STORE_FLAG="--surrogate_store=$SURROGATE_STORE"
+fi
+
 
 # Specific output subfolders
 
@@ -80,11 +102,11 @@ SURROGATE_SCRIPT=compute_isi_histograms.py
 
 SURROGATE_OUTPUT_1=$SURROGATE_ISIH_OUTPUT/surrogate_isih_1
 mkdir $SURROGATE_OUTPUT_1
-python $SURROGATE_CODE_ROOT/surrogate_1/$SURROGATE_SCRIPT --output_path=$SURROGATE_OUTPUT_1 $DATA_I
+python $SURROGATE_CODE_ROOT/surrogate_1/$SURROGATE_SCRIPT $STORE_FLAG --output_path=$SURROGATE_OUTPUT_1 $SESSIONS
 
 SURROGATE_OUTPUT_2=$SURROGATE_ISIH_OUTPUT/surrogate_isih_2
 mkdir $SURROGATE_OUTPUT_2
-python $SURROGATE_CODE_ROOT/surrogate_2/$SURROGATE_SCRIPT --output_path=$SURROGATE_OUTPUT_2 $DATA_I
+python $SURROGATE_CODE_ROOT/surrogate_2/$SURROGATE_SCRIPT $STORE_FLAG --output_path=$SURROGATE_OUTPUT_2 $SESSIONS
 
 
 # Run ISI histograms obtained from artificially-generated spike trains